@@ -0,0 +1,138 @@
+import os
+import json
+import math
+import threading
+from datetime import datetime
+
+from file_lock import FileLock, atomic_write_json
+
+ANOMALY_CHANNELS = ['temperature', 'pressure', 'humidity', 'soil_moisture']
+
+# Smallest standard deviation assumed per channel, so a flat signal does not
+# turn sensor noise into huge z-scores
+MIN_STD = {'temperature': 0.3, 'pressure': 0.5, 'humidity': 1.0, 'soil_moisture': 1.0}
+
+# Largest plausible change between consecutive readings: ``step`` plus
+# ``per_minute`` for every minute between them. Soil moisture only counts
+# drops, since watering raises it quickly.
+RATE_LIMITS = {
+    'temperature': {'step': 3.0, 'per_minute': 1.0, 'rises': True},
+    'pressure': {'step': 3.0, 'per_minute': 0.5, 'rises': True},
+    'humidity': {'step': 15.0, 'per_minute': 5.0, 'rises': True},
+    'soil_moisture': {'step': 10.0, 'per_minute': 2.0, 'rises': False}
+}
+
+
+class AnomalyDetector:
+    """Streaming per-channel anomaly detection for one device.
+
+    Each channel keeps an exponentially weighted mean and variance
+    (``alpha`` is the weight of the newest reading) and its previous value,
+    so a reading is checked and folded in with O(1) work. A reading is
+    anomalous on a channel when it lies more than ``z_threshold`` standard
+    deviations from the mean (once ``warmup`` readings have been seen), or
+    when it changed faster than ``RATE_LIMITS`` allow since the previous
+    reading, e.g. a failing sensor or a sudden soil moisture drop while the
+    values are still inside the thresholds.
+
+    The state lives in a small JSON file, written under a lock and replaced
+    atomically (like ``LatestState``), so it survives restarts and every
+    server process continues from the same state.
+    """
+
+    def __init__(self, path, alpha=0.1, z_threshold=4.0, warmup=10):
+        self.path = path
+        self.alpha = alpha
+        self.z_threshold = z_threshold
+        self.warmup = warmup
+        self._lock = threading.Lock()
+        self._file_lock = FileLock(path + '.lock')
+        self._state = {'last_timestamp': None, 'channels': {}}
+        self._stamp = None
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _reload(self):
+        """Pick up state another process wrote (caller holds both locks)"""
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                self._state = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Anomaly state unreadable, starting over: {e}")
+        self._stamp = stamp
+
+    def update(self, reading):
+        """Check one reading and fold it into the state; see ``update_many``"""
+        return self.update_many([reading])[0]
+
+    def update_many(self, readings):
+        """Check readings (oldest first) and fold them in, with one state write
+
+        Returns one ``{'anomaly': bool, 'anomalies': [...]}`` per reading.
+        Readings older than the newest one seen are checked against the
+        current state but do not change it.
+        """
+        with self._lock, self._file_lock:
+            self._reload()
+            results = [self._check(reading) for reading in readings]
+            atomic_write_json(self.path, self._state)
+            self._stamp = self._stat()
+        return results
+
+    def _check(self, reading):
+        timestamp = reading.get('timestamp')
+        last_timestamp = self._state['last_timestamp']
+        current = last_timestamp is None or (timestamp or '') >= last_timestamp
+        minutes = None
+        if current and last_timestamp and timestamp:
+            try:
+                minutes = max((datetime.fromisoformat(timestamp) - datetime.fromisoformat(last_timestamp)).total_seconds(), 0) / 60
+            except (ValueError, TypeError):
+                pass  # Unparseable or mixed naive/aware timestamps: skip the rate check
+
+        anomalies = []
+        for channel in ANOMALY_CHANNELS:
+            value = reading.get(channel)
+            if value is None:
+                continue
+            state = self._state['channels'].get(channel)
+            if state is None:
+                if current:
+                    self._state['channels'][channel] = {'mean': value, 'var': 0.0, 'last': value, 'count': 1}
+                continue
+
+            std = max(math.sqrt(state['var']), MIN_STD[channel])
+            z = (value - state['mean']) / std
+            if state['count'] >= self.warmup and abs(z) > self.z_threshold:
+                anomalies.append({'channel': channel, 'reason': 'zscore', 'value': value, 'z': round(z, 2)})
+
+            if minutes is not None:
+                limit = RATE_LIMITS[channel]
+                change = value - state['last']
+                allowed = limit['step'] + limit['per_minute'] * minutes
+                if abs(change) > allowed and (change < 0 or limit['rises']):
+                    anomalies.append({
+                        'channel': channel, 'reason': 'rate', 'value': value,
+                        'change': round(change, 3), 'minutes': round(minutes, 2)
+                    })
+
+            if current:
+                # Incremental EWMA mean and variance
+                diff = value - state['mean']
+                increment = self.alpha * diff
+                state['mean'] += increment
+                state['var'] = (1 - self.alpha) * (state['var'] + diff * increment)
+                state['last'] = value
+                state['count'] += 1
+
+        if current and timestamp:
+            self._state['last_timestamp'] = timestamp
+        return {'anomaly': bool(anomalies), 'anomalies': anomalies}
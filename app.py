@@ -1,29 +1,385 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, g
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
 import uuid
+import time
+import hashlib
 from datetime import datetime
-import json
-import random
+import threading
+import numpy as np
 from supabase_config import supabase_storage
+from sensor_store import SensorLogStore
+from metadata_store import ImageMetadataStore
+from tts_cache import TTSAudioCache
+from tts_worker import TTSWorkerPool
+from upload_stream import StreamingUploadRequest
+from thumbnails import ThumbnailCache, THUMBNAIL_FORMATS
+from latest_state import LatestState
+from sensor_history import (
+    SensorHistory, aggregate_buckets, iso_to_epoch_ms, epoch_ms_to_iso, parse_duration_seconds
+)
+from sensor_compaction import SensorCompactor, parse_tiers, DEFAULT_TIERS
+from file_lock import claim_directory
+from sensor_batch import BatchError, parse_batch
+from plant_rules import RuleEngine, load_profiles
+from device_partitions import DevicePartition, DevicePartitions, DEFAULT_DEVICE, valid_device_id
+from instrumentation import registry, stage, record_error
+from metrics_ring import MetricsRing, RecordTooLarge
+from anomaly import AnomalyDetector
+from event_stream import EventBroker, CLOSED
 
 app = Flask(__name__)
 
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, timing request parsing and response encoding"""
+    def loads(self, s, **kwargs):
+        with stage('json_load'):
+            return super().loads(s, **kwargs)
+    
+    def dumps(self, obj, **kwargs):
+        with stage('json_dump'):
+            return super().dumps(obj, **kwargs)
+
+app.json = TimedJSONProvider(app)
+
 # Configuration
-UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')  # All local data lives under here
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'webp'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+SENSOR_LOG_FOLDER = os.path.join(UPLOAD_FOLDER, 'sensor_log')
+SENSOR_SEGMENT_SIZE = int(os.environ.get('SENSOR_SEGMENT_SIZE', 5000))  # Readings per segment
+SENSOR_TIERS = os.environ.get('SENSOR_TIERS', DEFAULT_TIERS)  # <bucket>:<keep>, finest first
+SENSOR_ROLLUP_FOLDER = os.path.join(UPLOAD_FOLDER, 'sensor_rollups')
+SENSOR_COMPACTION_INTERVAL = int(os.environ.get('SENSOR_COMPACTION_INTERVAL', 60))  # Seconds
+DEVICES_FOLDER = os.path.join(UPLOAD_FOLDER, 'devices')  # Sensor partitions of non-default devices
+HISTORY_DEFAULT_HOURS = 24  # Window when no start is given
+HISTORY_MAX_BUCKETS = int(os.environ.get('HISTORY_MAX_BUCKETS', 500))
+METADATA_DB = os.path.join(UPLOAD_FOLDER, 'metadata.db')
+AUDIO_FOLDER = os.path.join(UPLOAD_FOLDER, 'audio')
+TTS_RATE = 150  # Speed of speech
+TTS_VOLUME = 0.9  # Volume level
+TTS_CACHE_MAX_MB = int(os.environ.get('TTS_CACHE_MAX_MB', 64))
+TTS_WORKERS = int(os.environ.get('TTS_WORKERS', 2))
+TTS_QUEUE_SIZE = int(os.environ.get('TTS_QUEUE_SIZE', 64))
+AUDIO_JOB_MAX_WAIT = 30  # Seconds a job status request may long-poll
+SPOOL_FOLDER = os.path.join(UPLOAD_FOLDER, 'spool')
+IMAGE_PAGE_SIZE = 50  # Default /images page size
+IMAGE_PAGE_MAX = 500
+IMAGE_FIELDS = ['id', 'original_filename', 'image_url', 'file_size', 'upload_timestamp', 'file_type', 'storage_type',
+                'device_id', 'plant_id']
+THUMBNAIL_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
+THUMBNAIL_CACHE_MAX_MB = int(os.environ.get('THUMBNAIL_CACHE_MAX_MB', 256))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+THUMBNAIL_MAX_WIDTH = 2048
+THUMBNAIL_DEFAULT_WIDTH = 256
+SUPABASE_WRITE_BEHIND = os.environ.get('SUPABASE_WRITE_BEHIND', '1') != '0'
+SUPABASE_FLUSH_SIZE = int(os.environ.get('SUPABASE_FLUSH_SIZE', 500))  # Rows per bulk insert
+SUPABASE_FLUSH_DELAY = float(os.environ.get('SUPABASE_FLUSH_DELAY', 2.0))  # Max seconds a row waits
+SUPABASE_BUFFER_SIZE = int(os.environ.get('SUPABASE_BUFFER_SIZE', 10000))
+METRICS_CAPACITY = int(os.environ.get('METRICS_CAPACITY', 10000))  # Entries kept by POST /metrics
+METRICS_SLOT_BYTES = int(os.environ.get('METRICS_SLOT_BYTES', 2048))  # Max encoded size of one entry
+METRICS_PAGE_MAX = 1000
+SUPABASE_OUTBOX_SIZE = int(os.environ.get('SUPABASE_OUTBOX_SIZE', 100000))  # Failed writes kept for replay
+SUPABASE_HEALTH_INTERVAL = float(os.environ.get('SUPABASE_HEALTH_INTERVAL', 30))  # Seconds between health probes
+SUPABASE_REQUIRED = os.environ.get('SUPABASE_REQUIRED', '0') == '1'  # /ready fails while Supabase is down
+INSTRUMENTATION_FOLDER = os.path.join(UPLOAD_FOLDER, 'instrumentation')  # Per-process metric snapshots
+PLANT_PROFILES_FILE = os.environ.get('PLANT_PROFILES_FILE', 'plant_profiles.json')  # Thresholds per plant type
+DEFAULT_PLANT_TYPE = os.environ.get('DEFAULT_PLANT_TYPE', 'default')  # Profile for readings without plant_type
+ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', 0.1))  # EWMA weight of the newest reading
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', 4.0))
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', 10))  # Readings before z-scores count
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15))  # Seconds between /stream keep-alive comments
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 32))  # Events a subscriber may fall behind
+STREAM_HISTORY = int(os.environ.get('STREAM_HISTORY', 64))  # Events per device kept for Last-Event-ID resume
+# Open streams per process. gunicorn.conf.py gives gthread workers this many
+# threads on top of GUNICORN_THREADS, so streams never take the threads
+# that serve ingest and other requests
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 256))
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', 1.0))  # Seconds between checks for other processes' readings
+STREAM_RETRY_MS = 3000  # Reconnect delay suggested to EventSource clients
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Stream multipart file parts to disk in chunks, hashing and size-checking
+# as they arrive, instead of buffering whole images in memory
+class UploadRequest(StreamingUploadRequest):
+    upload_dir = UPLOAD_FOLDER
+    max_file_size = MAX_FILE_SIZE
+
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + 64 * 1024  # Allow for multipart framing
+
+@app.teardown_request
+def cleanup_streamed_uploads(exc):
+    """Remove spooled upload parts that were not moved into place"""
+    request.cleanup_uploads()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """Per-endpoint latency histogram plus request and 5xx counters"""
+    started = g.get('request_started')
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        registry.observe('plantai_http_request_seconds', time.perf_counter() - started,
+                         {'endpoint': endpoint, 'method': request.method})
+        registry.inc('plantai_http_requests_total',
+                     {'endpoint': endpoint, 'method': request.method, 'status': str(response.status_code)})
+        if response.status_code >= 500:
+            registry.inc('plantai_http_errors_total', {'endpoint': endpoint, 'method': request.method})
+    return response
+
+# Local time-series store for sensor readings (append-only segments)
+sensor_store = SensorLogStore(
+    SENSOR_LOG_FOLDER,
+    segment_max_readings=SENSOR_SEGMENT_SIZE,
+    retention_days=0  # Aged segments are rolled up by the compactor instead
+)
+sensor_store.migrate_legacy_file(os.path.join(UPLOAD_FOLDER, 'sensor_data.json'))
+
+# Tiered retention: raw readings are downsampled into coarser rollups as they age
+sensor_compactor = SensorCompactor(
+    sensor_store,
+    SENSOR_ROLLUP_FOLDER,
+    parse_tiers(SENSOR_TIERS),
+    interval=SENSOR_COMPACTION_INTERVAL,
+    segment_max_readings=SENSOR_SEGMENT_SIZE
+)
+
+# Columnar per-segment cache used to answer history range queries
+sensor_history = SensorHistory(sensor_store, sensor_compactor.rollup_stores())
+
+# Indexed image metadata (SQLite, WAL mode)
+metadata_store = ImageMetadataStore(METADATA_DB)
+metadata_store.migrate_legacy_file(os.path.join(UPLOAD_FOLDER, 'metadata.json'))
+
+# Fixed-capacity ring of POST /metrics entries, memory-mapped by every process
+metrics_ring = MetricsRing(os.path.join(UPLOAD_FOLDER, 'metrics.ring'), METRICS_CAPACITY, METRICS_SLOT_BYTES)
+metrics_ring.migrate_legacy_file(os.path.join(UPLOAD_FOLDER, 'metrics.json'))
+
+# Newest reading and its derived status, served by /response-body
+# (kept in a file so every server process serves the same snapshot)
+latest_state = LatestState(os.path.join(UPLOAD_FOLDER, 'latest_state.json'))
+
+def open_anomaly_detector(directory):
+    """Streaming anomaly state of one device, kept in ``directory``"""
+    return AnomalyDetector(
+        os.path.join(directory, 'anomaly_state.json'),
+        alpha=ANOMALY_ALPHA,
+        z_threshold=ANOMALY_Z_THRESHOLD,
+        warmup=ANOMALY_WARMUP
+    )
+
+def open_device_partition(device_id, directory):
+    """Sensor log, rollups, history cache, latest state and anomaly state of one device, under ``directory``"""
+    store = SensorLogStore(
+        os.path.join(directory, 'sensor_log'),
+        segment_max_readings=SENSOR_SEGMENT_SIZE,
+        retention_days=0
+    )
+    compactor = SensorCompactor(
+        store,
+        os.path.join(directory, 'sensor_rollups'),
+        parse_tiers(SENSOR_TIERS),
+        interval=SENSOR_COMPACTION_INTERVAL,
+        segment_max_readings=SENSOR_SEGMENT_SIZE
+    )
+    history = SensorHistory(store, compactor.rollup_stores())
+    latest = LatestState(os.path.join(directory, 'latest_state.json'))
+    return DevicePartition(device_id, store, compactor, history, latest, open_anomaly_detector(directory))
+
+# Every device ingests into and reads from its own partition; readings
+# without a device_id go to the default device and its original paths
+device_partitions = DevicePartitions(
+    DEVICES_FOLDER,
+    open_device_partition,
+    DevicePartition(DEFAULT_DEVICE, sensor_store, sensor_compactor, sensor_history, latest_state,
+                    open_anomaly_detector(UPLOAD_FOLDER)),
+    compaction_interval=SENSOR_COMPACTION_INTERVAL
+)
+
+# Fans each device's status changes out to its /stream subscribers; the
+# poll picks up readings that other server processes accepted
+stream_broker = EventBroker(
+    queue_size=STREAM_QUEUE_SIZE,
+    history=STREAM_HISTORY,
+    max_subscribers=STREAM_MAX_SUBSCRIBERS,
+    poll=lambda device_ids: poll_stream_devices(device_ids),
+    poll_interval=STREAM_POLL_INTERVAL
+)
+
+# Resized image variants, rendered by worker processes and kept in a disk LRU
+thumbnail_cache = ThumbnailCache(
+    THUMBNAIL_FOLDER,
+    max_bytes=THUMBNAIL_CACHE_MAX_MB * 1024 * 1024,
+    workers=THUMBNAIL_WORKERS
+)
+
+# Status thresholds per plant type, compiled once into lookup arrays
+plant_rules = RuleEngine(load_profiles(PLANT_PROFILES_FILE), default=DEFAULT_PLANT_TYPE)
+
+# Every message the rules can produce (used to warm the TTS cache)
+SIMPLE_MESSAGES = {
+    'healthy': "Plant health is good. All sensors reading normal.",
+    'temperature_warning': "Temperature needs attention. Check plant environment.",
+    'humidity_warning': "Humidity is low. Consider misting the plant.",
+    'soil_warning': "Soil is dry. Time to water your plant.",
+    'general_warning': "Plant needs some attention. Check sensor readings.",
+    'temperature_critical': "Critical temperature alert. Immediate action needed.",
+    'humidity_critical': "Very low humidity. Plant is stressed.",
+    'soil_critical': "Plant is severely dehydrated. Water immediately.",
+    'general_critical': "Critical plant health issue detected."
+}
+
+# generate_ai_response sentence per channel and side of its warning range
+AI_RESPONSES = {
+    'temperature': {
+        'low': "🌡️ Temperature is quite cool - consider moving to a warmer spot.",
+        'high': "🌡️ Temperature is getting hot - ensure adequate ventilation.",
+        'ok': "🌡️ Temperature looks comfortable for your plant."
+    },
+    'humidity': {
+        'low': "💧 Humidity is low - consider misting or using a humidifier.",
+        'high': "💧 Humidity is very high - ensure good air circulation.",
+        'ok': "💧 Humidity levels are good for plant health."
+    },
+    'soil_moisture': {
+        'low': "🌱 Soil is quite dry - time to water your plant!",
+        'high': "🌱 Soil is very wet - be careful not to overwater.",
+        'ok': "🌱 Soil moisture looks healthy."
+    }
+}
+
+# Content-addressed TTS audio cache, warmed with every known message
+tts_cache = TTSAudioCache(
+    AUDIO_FOLDER,
+    rate=TTS_RATE,
+    volume=TTS_VOLUME,
+    max_bytes=TTS_CACHE_MAX_MB * 1024 * 1024
+)
+
+# Synthesis runs in long-lived worker processes, never in the request
+tts_pool = TTSWorkerPool(
+    tts_cache,
+    workers=TTS_WORKERS,
+    max_queue=TTS_QUEUE_SIZE,
+    jobs_dir=os.path.join(AUDIO_FOLDER, 'jobs')
+)
+
+# Queue depths, read whenever /internal/metrics is scraped
+registry.gauge('plantai_tts_queue_depth', tts_pool.queue_depth, 'TTS jobs waiting for a worker process')
+registry.gauge(
+    'plantai_supabase_buffer_depth',
+    lambda: supabase_storage.sensor_buffer.depth() if supabase_storage.sensor_buffer else 0,
+    'Sensor rows spooled but not yet flushed to Supabase'
+)
+registry.gauge(
+    'plantai_supabase_outbox_depth',
+    lambda: supabase_storage.outbox.depth() if supabase_storage.outbox else 0,
+    'Failed Supabase writes waiting to be replayed'
+)
+registry.gauge('plantai_stream_subscribers', stream_broker.subscriber_count, 'Open /stream connections')
+registry.gauge(
+    'plantai_supabase_up',
+    lambda: 1 if supabase_storage.health['status'] == 'ok' else 0,
+    'Whether the last Supabase health probe succeeded'
+)
+
+# Threads and child processes do not survive fork, so background services
+# start per server process: from the gunicorn post_worker_init hook, from
+# __main__, or at the latest on a process's first request
+_worker_lock = threading.Lock()
+_worker_pid = None
+_spool_claim = None
+_outbox_claim = None
+
+def init_worker():
+    """Start this process's background services (once per process)"""
+    global _worker_pid, _spool_claim, _outbox_claim
+    with _worker_lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        
+        # Each process saves its metrics so a scrape of any one sees them all
+        registry.attach(INSTRUMENTATION_FOLDER)
+        
+        # Writes that failed while Supabase was unreachable are replayed from
+        # a spooled outbox, which dead processes' successors also adopt;
+        # writes Supabase rejects for good are set aside in a dead-letter file
+        if supabase_storage.initialized:
+            supabase_storage.enable_dead_letter(os.path.join(SPOOL_FOLDER, 'dead_letter.jsonl'))
+            outbox_dir, _outbox_claim = claim_directory(os.path.join(SPOOL_FOLDER, 'outbox'))
+            supabase_storage.enable_outbox(
+                outbox_dir,
+                handlers={'image_uploads': replay_image_uploads},
+                max_items=SUPABASE_OUTBOX_SIZE,
+                flush_size=SUPABASE_FLUSH_SIZE,
+                max_delay=SUPABASE_FLUSH_DELAY
+            )
+        
+        # Sensor inserts to Supabase go through a spooled write-behind buffer;
+        # each process owns a spool directory and adopts those of dead ones
+        if SUPABASE_WRITE_BEHIND:
+            spool_dir, _spool_claim = claim_directory(os.path.join(SPOOL_FOLDER, 'sensor_readings'))
+            supabase_storage.enable_write_behind(
+                spool_dir,
+                max_items=SUPABASE_BUFFER_SIZE,
+                flush_size=SUPABASE_FLUSH_SIZE,
+                max_delay=SUPABASE_FLUSH_DELAY
+            )
+        
+        # Connectivity is checked in the background, never on the request path
+        supabase_storage.start_health_probe(SUPABASE_HEALTH_INTERVAL)
+        
+        device_partitions.start()
+        stream_broker.start()
+        tts_pool.start()
+        tts_pool.warm(SIMPLE_MESSAGES.values())
+        seed_latest_state()
+
+@app.before_request
+def ensure_worker_started():
+    init_worker()
+
 def allowed_file(filename):
     """Check if the uploaded file has an allowed extension"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_image_metadata(image_url, original_filename, file_size, blob_name=None, bucket=None):
-    """Save metadata about the uploaded image"""
+def parse_device_fields(source):
+    """``(device_id, plant_id)`` from a request body or form; ValueError if malformed"""
+    device_id = source.get('device_id') or DEFAULT_DEVICE
+    plant_id = source.get('plant_id') or None
+    if not valid_device_id(device_id):
+        raise ValueError('device_id must be 1-64 letters, digits, ".", "_" or "-"')
+    if plant_id is not None and not valid_device_id(plant_id):
+        raise ValueError('plant_id must be 1-64 letters, digits, ".", "_" or "-"')
+    return device_id, plant_id
+
+def device_partition_or_error(device_id):
+    """``(partition, None)`` for a device with data, else ``(None, error response)``"""
+    try:
+        partition = device_partitions.get(device_id, create=False)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    if partition is None:
+        return None, (jsonify({'error': 'Unknown device'}), 404)
+    return partition, None
+
+def save_image_metadata(image_url, original_filename, file_size, blob_name=None, bucket=None, sha256=None,
+                        device_id=DEFAULT_DEVICE, plant_id=None, reuse=False):
+    """Save metadata about the uploaded image
+    
+    With ``reuse`` the image points at an already stored blob; returns None
+    if that blob was deleted meanwhile (see ``ImageMetadataStore.add``).
+    """
     metadata = {
         'id': str(uuid.uuid4()),
         'original_filename': original_filename,
@@ -33,36 +389,73 @@ def save_image_metadata(image_url, original_filename, file_size, blob_name=None,
         'file_type': original_filename.rsplit('.', 1)[1].lower(),
         'blob_name': blob_name,
         'bucket': bucket,
-        'storage_type': 'supabase' if bucket and bucket != 'local' else 'local'
+        'storage_type': 'supabase' if bucket and bucket != 'local' else 'local',
+        'sha256': sha256,
+        'device_id': device_id,
+        'plant_id': plant_id
     }
     
-    metadata_file = os.path.join(UPLOAD_FOLDER, 'metadata.json')
-    
-    # Load existing metadata or create new list
-    if os.path.exists(metadata_file):
-        with open(metadata_file, 'r') as f:
-            all_metadata = json.load(f)
-    else:
-        all_metadata = []
-    
-    # Add new metadata
-    all_metadata.append(metadata)
+    # Indexed insert; no read-modify-write of the whole metadata set
+    metadata, superseded = metadata_store.add(metadata, reuse=reuse)
+    if metadata is None:
+        return None
     
-    # Save updated metadata
-    with open(metadata_file, 'w') as f:
-        json.dump(all_metadata, f, indent=2)
+    # A concurrent upload of the same content won the race; drop our copy
+    if superseded and superseded['blob_name']:
+        remove_stored_blob(superseded['blob_name'], superseded['bucket'])
     
     return metadata
 
+def remove_stored_blob(blob_name, bucket):
+    """Delete a stored image object from Supabase Storage or local disk"""
+    if bucket and bucket != 'local':
+        return supabase_storage.delete_image(blob_name)
+    
+    file_path = os.path.join(UPLOAD_FOLDER, secure_filename(blob_name))
+    if os.path.exists(file_path):
+        os.remove(file_path)
+    return True
+
+def replay_image_uploads(uploads):
+    """Outbox handler: move images that fell back to local storage into Supabase"""
+    for item in uploads:
+        local_path = os.path.join(UPLOAD_FOLDER, secure_filename(item['blob_name']))
+        if not os.path.exists(local_path):
+            continue  # Deleted (or already moved) before the replay
+        result = supabase_storage.upload_image_file(local_path, item['blob_name'], item['content_type'], upsert=True)
+        if not result:
+            raise RuntimeError(f"Replay of {item['blob_name']} to Supabase failed")
+        
+        moved = metadata_store.relocate_blob(item['blob_name'], 'local', {
+            'blob_name': result['file_path'],
+            'bucket': result['bucket'],
+            'image_url': result['url'],
+            'storage_type': 'supabase'
+        })
+        if moved:
+            os.remove(local_path)
+        else:
+            # Every record of the image went away during the upload
+            supabase_storage.delete_image(result['file_path'])
+
 @app.route('/upload', methods=['POST'])
 def upload_image():
     """Handle image upload requests - THE MAIN API"""
     try:
-        # Check if file is present in request
-        if 'image' not in request.files:
+        # Check if file is present in request (parsing streams parts to disk)
+        try:
+            with stage('upload_receive'):
+                files = request.files
+        except RequestEntityTooLarge:
+            return jsonify({
+                'error': 'File too large',
+                'max_size_mb': MAX_FILE_SIZE // (1024 * 1024)
+            }), 400
+        
+        if 'image' not in files:
             return jsonify({'error': 'No image file provided'}), 400
         
-        file = request.files['image']
+        file = files['image']
         
         # Check if file is selected
         if file.filename == '':
@@ -75,41 +468,64 @@ def upload_image():
                 'allowed_types': list(ALLOWED_EXTENSIONS)
             }), 400
         
-        # Check file size
-        file.seek(0, 2)  # Seek to end
-        file_size = file.tell()
-        file.seek(0)  # Reset to beginning
+        # Which device (and plant) took the picture
+        try:
+            device_id, plant_id = parse_device_fields(request.form)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({
-                'error': 'File too large',
-                'max_size_mb': MAX_FILE_SIZE // (1024 * 1024)
-            }), 400
+        # Size and checksum were computed while the part was streamed to disk
+        upload = file.stream
+        file_size = upload.size
+        checksum = upload.hexdigest()
         
         # Generate secure filename
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         unique_filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{filename}"
         
-        # Read file data
-        file_data = file.read()
-        file.seek(0)  # Reset for potential local fallback
-        
         # Determine content type
         content_type = file.content_type or f"image/{filename.rsplit('.', 1)[1].lower()}"
         
-        # Try Supabase Storage first
+        # Identical content already stored? Reference it instead of uploading
+        # again, unless its last reference is deleted before ours is recorded
+        metadata = None
+        with stage('metadata_lookup'):
+            existing_blob = metadata_store.find_blob(checksum)
+        if existing_blob:
+            with stage('metadata_write'):
+                metadata = save_image_metadata(
+                    existing_blob['image_url'],
+                    file.filename,
+                    file_size,
+                    existing_blob['blob_name'],
+                    existing_blob['bucket'],
+                    checksum,
+                    device_id=device_id,
+                    plant_id=plant_id,
+                    reuse=True
+                )
+            if metadata:
+                print(f"♻️  Duplicate image, reusing stored blob {existing_blob['blob_name']}")
+            else:
+                print(f"♻️  Stored blob {existing_blob['blob_name']} was just deleted, storing the image again")
+                existing_blob = None
+        
         supabase_result = None
-        if supabase_storage.initialized:
-            supabase_result = supabase_storage.upload_image(
-                file_data, unique_filename, content_type
+        supabase_failed = False
+        if not metadata and supabase_storage.initialized:
+            # Try Supabase Storage first, streaming from the spooled part
+            supabase_result = supabase_storage.upload_image_file(
+                upload.path, unique_filename, content_type
             )
+            supabase_failed = supabase_result is None
         
         # Fallback to local storage if Supabase fails
-        if not supabase_result:
+        if not metadata and not supabase_result:
             print("📁 Using local storage fallback")
             file_path = os.path.join(UPLOAD_FOLDER, unique_filename)
-            file.save(file_path)
+            with stage('file_save'):
+                upload.publish(file_path)
             supabase_result = {
                 'url': f"/uploads/{unique_filename}",
                 'file_path': unique_filename,
@@ -117,24 +533,37 @@ def upload_image():
             }
         
         # Save metadata
-        metadata = save_image_metadata(
-            supabase_result['url'], 
-            file.filename, 
-            file_size,
-            supabase_result['file_path'],
-            supabase_result['bucket']
-        )
+        if not metadata:
+            with stage('metadata_write'):
+                metadata = save_image_metadata(
+                    supabase_result['url'], 
+                    file.filename, 
+                    file_size,
+                    supabase_result['file_path'],
+                    supabase_result['bucket'],
+                    checksum,
+                    device_id=device_id,
+                    plant_id=plant_id
+                )
+        
+        # Move the local copy to Supabase once it is reachable again
+        if supabase_failed and metadata['blob_name'] == unique_filename:
+            supabase_storage.add_to_outbox('image_uploads', [{'blob_name': unique_filename, 'content_type': content_type}])
         
         return jsonify({
             'success': True,
             'message': 'Image uploaded successfully',
             'image_id': metadata['id'],
-            'filename': unique_filename,
+            'filename': os.path.basename(metadata['blob_name']),
             'original_filename': file.filename,
             'file_size': file_size,
+            'sha256': checksum,
             'upload_timestamp': metadata['upload_timestamp'],
-            'image_url': supabase_result['url'],
-            'storage_type': 'supabase' if supabase_storage.initialized else 'local'
+            'image_url': metadata['image_url'],
+            'storage_type': metadata['storage_type'],
+            'device_id': metadata['device_id'],
+            'plant_id': metadata['plant_id'],
+            'deduplicated': existing_blob is not None
         }), 200
         
     except Exception as e:
@@ -169,6 +598,19 @@ def receive_sensor_data():
         except (ValueError, TypeError):
             return jsonify({'error': 'Invalid data types. All sensor values must be numbers.'}), 400
         
+        try:
+            device_id, plant_id = parse_device_fields(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Optional plant type selects the threshold profile
+        plant_type = data.get('plant_type')
+        if plant_type is not None and (not isinstance(plant_type, str) or plant_rules.profile_id(plant_type) is None):
+            return jsonify({
+                'error': f'Unknown plant_type: {plant_type}',
+                'plant_types': plant_rules.names
+            }), 400
+        
         # Add timestamp and unique ID
         sensor_data = {
             'id': str(uuid.uuid4()),
@@ -177,194 +619,277 @@ def receive_sensor_data():
             'pressure': pressure,
             'humidity': humidity,
             'soil_moisture': soil_moisture,
-            'source': 'raspberry_pi'
+            'source': 'raspberry_pi',
+            'device_id': device_id,
+            'plant_id': plant_id
         }
+        if plant_type is not None:
+            sensor_data['plant_type'] = plant_type
         
-        # Store sensor data in Supabase or locally
+        # Store sensor data in Supabase when configured
         if supabase_storage.initialized:
-            # Save to Supabase database
+            # Save to Supabase database (spooled and flushed in bulk when write-behind is on)
             db_result = supabase_storage.save_sensor_data(sensor_data)
             if db_result:
                 sensor_data['id'] = db_result['id']
-        else:
-            # Fallback to local storage
-            sensor_file = os.path.join(UPLOAD_FOLDER, 'sensor_data.json')
-            
-            # Load existing sensor data or create new list
-            if os.path.exists(sensor_file):
-                with open(sensor_file, 'r') as f:
-                    all_sensor_data = json.load(f)
-            else:
-                all_sensor_data = []
-            
-            # Add new sensor data
-            all_sensor_data.append(sensor_data)
-            
-            # Keep only last 1000 readings to prevent file from growing too large
-            if len(all_sensor_data) > 1000:
-                all_sensor_data = all_sensor_data[-1000:]
-            
-            # Save updated sensor data
-            with open(sensor_file, 'w') as f:
-                json.dump(all_sensor_data, f, indent=2)
         
-        # Determine status color based on sensor readings
-        status_color = determine_status_color(sensor_data)
+        # Always keep a local copy in the device's own log: O(1) append, and
+        # history is served from the log
+        partition = device_partitions.get(device_id)
+        with stage('sensor_log_append'):
+            partition.store.append(sensor_data)
         
-        # Generate simple message for TTS
-        message = generate_simple_message(sensor_data, status_color)
+        # Status color and simple TTS message from the plant's thresholds
+        with stage('classify'):
+            status_color, message_key, _ = classify_reading(sensor_data)
+        message = SIMPLE_MESSAGES[message_key]
         
-        # Generate WAD audio file
-        audio_file_path = generate_wad_file(message, sensor_data['id'])
+        # Sudden jumps the thresholds miss, from the device's running statistics
+        with stage('anomaly_detect'):
+            anomaly = detect_anomalies(partition, [sensor_data])[0]
+        
+        # Generate WAD audio file (cached URL or background job handle)
+        audio = generate_wad_file(message, sensor_data['id'])
+        
+        publish_latest_reading(sensor_data, status_color, message, audio, anomaly)
         
         return jsonify({
             'status_color': status_color,
+            'anomaly': anomaly['anomaly'],
+            'anomalies': anomaly['anomalies'],
             'message': message,
-            'audio_file': audio_file_path
+            'audio_file': audio['audio_file'],
+            'audio_job': audio['job_id'],
+            'audio_status': audio['status']
         }), 200
         
     except Exception as e:
         return jsonify({'error': f'Sensor data processing failed: {str(e)}'}), 500
 
-def generate_ai_response(sensor_data):
-    """Generate AI-like response based on sensor data"""
-    temp = sensor_data['temperature']
-    humidity = sensor_data['humidity']
-    soil_moisture = sensor_data['soil_moisture']
-    
-    responses = []
-    
-    # Temperature analysis
-    if temp < 15:
-        responses.append("🌡️ Temperature is quite cool - consider moving to a warmer spot.")
-    elif temp > 30:
-        responses.append("🌡️ Temperature is getting hot - ensure adequate ventilation.")
-    else:
-        responses.append("🌡️ Temperature looks comfortable for your plant.")
-    
-    # Humidity analysis
-    if humidity < 30:
-        responses.append("💧 Humidity is low - consider misting or using a humidifier.")
-    elif humidity > 80:
-        responses.append("💧 Humidity is very high - ensure good air circulation.")
-    else:
-        responses.append("💧 Humidity levels are good for plant health.")
-    
-    # Soil moisture analysis
-    if soil_moisture < 20:
-        responses.append("🌱 Soil is quite dry - time to water your plant!")
-    elif soil_moisture > 80:
-        responses.append("🌱 Soil is very wet - be careful not to overwater.")
-    else:
-        responses.append("🌱 Soil moisture looks healthy.")
-    
-    return " ".join(responses)
-
-def generate_simple_message(sensor_data, status_color):
-    """Generate a simple message for TTS based on sensor readings"""
-    temp = sensor_data['temperature']
-    humidity = sensor_data['humidity']
-    soil = sensor_data['soil_moisture']
-    
-    if status_color == 'green':
-        return "Plant health is good. All sensors reading normal."
-    elif status_color == 'yellow':
-        if temp < 18 or temp > 28:
-            return "Temperature needs attention. Check plant environment."
-        elif humidity < 40:
-            return "Humidity is low. Consider misting the plant."
-        elif soil < 30:
-            return "Soil is dry. Time to water your plant."
-        else:
-            return "Plant needs some attention. Check sensor readings."
-    else:  # red
-        if temp < 15 or temp > 32:
-            return "Critical temperature alert. Immediate action needed."
-        elif humidity < 30:
-            return "Very low humidity. Plant is stressed."
-        elif soil < 20:
-            return "Plant is severely dehydrated. Water immediately."
-        else:
-            return "Critical plant health issue detected."
-
-def generate_wad_file(message, sensor_id):
-    """Generate a WAD audio file for the message using TTS"""
+@app.route('/sensor-data/batch', methods=['POST'])
+def receive_sensor_data_batch():
+    """Handle a batch of buffered sensor readings in one request"""
     try:
-        import pyttsx3
-        import os
+        data = request.get_json()
         
-        # Create audio directory if it doesn't exist
-        audio_dir = os.path.join(UPLOAD_FOLDER, 'audio')
-        if not os.path.exists(audio_dir):
-            os.makedirs(audio_dir)
+        if not data:
+            return jsonify({'error': 'No JSON data provided'}), 400
         
-        # Generate unique filename
-        audio_filename = f"sensor_{sensor_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.wav"
-        audio_path = os.path.join(audio_dir, audio_filename)
+        # Validate every reading together
+        try:
+            columns, timestamps, plant_types, errors = parse_batch(data)
+            # One device per batch (the Pi replaying its own buffer)
+            device_id, plant_id = parse_device_fields(data if isinstance(data, dict) else {})
+        except (BatchError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        # Threshold profile row per reading
+        profile_ids = np.full(len(errors), plant_rules.default_id)
+        for i, plant_type in enumerate(plant_types):
+            if plant_type is not None:
+                profile_id = plant_rules.profile_id(plant_type)
+                if profile_id is None:
+                    errors[i] = f'Unknown plant_type: {plant_type}'
+                else:
+                    profile_ids[i] = profile_id
+        
+        valid = np.array([error is None for error in errors])
+        if not valid.any():
+            return jsonify({
+                'error': 'No valid readings in batch',
+                'results': [{'index': i, 'error': error} for i, error in enumerate(errors)]
+            }), 400
+        
+        # Classify all readings at once
+        with stage('classify'):
+            colors, message_keys, _ = plant_rules.classify(columns, profile_ids)
+        
+        # Build records, oldest first so the log stays in time order
+        now = datetime.now().isoformat()
+        accepted = []
+        for i in np.flatnonzero(valid):
+            reading = {
+                'id': str(uuid.uuid4()),
+                'timestamp': timestamps[i] or now,
+                'temperature': float(columns['temperature'][i]),
+                'pressure': float(columns['pressure'][i]),
+                'humidity': float(columns['humidity'][i]),
+                'soil_moisture': float(columns['soil_moisture'][i]),
+                'source': 'raspberry_pi',
+                'device_id': device_id,
+                'plant_id': plant_id
+            }
+            if plant_types[i] is not None:
+                reading['plant_type'] = plant_types[i]
+            accepted.append((i, reading))
+        accepted.sort(key=lambda item: item[1]['timestamp'])
+        sensor_readings = [reading for _, reading in accepted]
         
-        # Initialize TTS engine
-        engine = pyttsx3.init()
+        # Persist the whole batch in a single storage write
+        if supabase_storage.initialized:
+            db_result = supabase_storage.save_sensor_data_batch(sensor_readings)
+            if db_result and len(db_result) == len(sensor_readings):
+                for reading, row in zip(sensor_readings, db_result):
+                    reading['id'] = row['id']
+        partition = device_partitions.get(device_id)
+        with stage('sensor_log_append'):
+            partition.store.append_many(sensor_readings)
+        
+        # Oldest first, so the detector sees the readings as they happened
+        with stage('anomaly_detect'):
+            anomalies = detect_anomalies(partition, sensor_readings)
+        
+        results = [{'index': i, 'error': error} for i, error in enumerate(errors)]
+        for (i, reading), anomaly in zip(accepted, anomalies):
+            results[i] = {
+                'index': int(i),
+                'id': reading['id'],
+                'timestamp': reading['timestamp'],
+                'status_color': str(colors[i]),
+                'anomaly': anomaly['anomaly'],
+                'anomalies': anomaly['anomalies'],
+                'message': SIMPLE_MESSAGES[message_keys[i]]
+            }
         
-        # Configure TTS settings
-        engine.setProperty('rate', 150)  # Speed of speech
-        engine.setProperty('volume', 0.9)  # Volume level
+        # Summary status and audio for the newest reading
+        newest_index, newest = accepted[-1]
+        status_color = str(colors[newest_index])
+        message = SIMPLE_MESSAGES[message_keys[newest_index]]
+        audio = generate_wad_file(message, newest['id'])
         
-        # Generate audio file
-        engine.save_to_file(message, audio_path)
-        engine.runAndWait()
+        publish_latest_reading(newest, status_color, message, audio, anomalies[-1])
         
-        # Return relative path for API response
-        return f"/audio/{audio_filename}"
+        return jsonify({
+            'accepted': len(accepted),
+            'rejected': len(errors) - len(accepted),
+            'anomalies': sum(anomaly['anomaly'] for anomaly in anomalies),
+            'results': results,
+            'status_color': status_color,
+            'anomaly': anomalies[-1]['anomaly'],
+            'message': message,
+            'audio_file': audio['audio_file'],
+            'audio_job': audio['job_id'],
+            'audio_status': audio['status']
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Sensor batch processing failed: {str(e)}'}), 500
+
+@app.route('/sensor-data/history', methods=['GET'])
+def get_sensor_history():
+    """Aggregated sensor readings (?start=&end=&bucket=&device_id=) with min/max/mean/last per bucket"""
+    return sensor_history_response(request.args.get('device_id') or DEFAULT_DEVICE)
+
+@app.route('/devices/<device_id>/sensor-data/history', methods=['GET'])
+def get_device_sensor_history(device_id):
+    """Aggregated sensor readings of one device (?start=&end=&bucket=)"""
+    return sensor_history_response(device_id)
+
+def sensor_history_response(device_id):
+    """History query against one device's partition"""
+    try:
+        partition, error = device_partition_or_error(device_id)
+        if error:
+            return error
         
-    except ImportError:
-        # Fallback: create a simple text file if pyttsx3 is not available
-        audio_dir = os.path.join(UPLOAD_FOLDER, 'audio')
-        if not os.path.exists(audio_dir):
-            os.makedirs(audio_dir)
+        try:
+            if request.args.get('end'):
+                end_ms = int(iso_to_epoch_ms([request.args['end']])[0])
+            else:
+                end_ms = int(iso_to_epoch_ms([datetime.now().isoformat()])[0]) + 1
+            if request.args.get('start'):
+                start_ms = int(iso_to_epoch_ms([request.args['start']])[0])
+            else:
+                start_ms = end_ms - HISTORY_DEFAULT_HOURS * 3600 * 1000
+        except ValueError:
+            return jsonify({'error': 'Invalid start or end. Use ISO 8601 format.'}), 400
+        
+        if end_ms <= start_ms:
+            return jsonify({'error': 'end must be after start'}), 400
+        
+        span_ms = end_ms - start_ms
+        if request.args.get('bucket'):
+            try:
+                bucket_seconds = parse_duration_seconds(request.args['bucket'])
+            except ValueError:
+                return jsonify({'error': 'bucket must be seconds or a duration like 5m, 1h, 1d'}), 400
+            if bucket_seconds <= 0:
+                return jsonify({'error': 'bucket must be positive'}), 400
+            if span_ms / (bucket_seconds * 1000) > HISTORY_MAX_BUCKETS:
+                return jsonify({
+                    'error': f'Too many buckets for this range (max {HISTORY_MAX_BUCKETS}). Use a wider bucket.'
+                }), 400
+        else:
+            # Widest whole-second bucket that keeps the response under the cap
+            bucket_seconds = max(1, -(-span_ms // (HISTORY_MAX_BUCKETS * 1000)))
+        bucket_ms = bucket_seconds * 1000
         
-        audio_filename = f"sensor_{sensor_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
-        audio_path = os.path.join(audio_dir, audio_filename)
+        ts, counts, stats = partition.history.range_columns(start_ms, end_ms)
+        buckets = aggregate_buckets(ts, counts, stats, start_ms, bucket_ms)
         
-        with open(audio_path, 'w') as f:
-            f.write(message)
+        return jsonify({
+            'device_id': device_id,
+            'start': epoch_ms_to_iso(start_ms),
+            'end': epoch_ms_to_iso(end_ms),
+            'bucket_seconds': bucket_seconds,
+            'readings': int(counts.sum()),
+            'buckets': buckets
+        }), 200
         
-        return f"/audio/{audio_filename}"
-    
     except Exception as e:
-        print(f"Error generating audio file: {e}")
-        return None
+        return jsonify({'error': f'Failed to get sensor history: {str(e)}'}), 500
 
-def determine_status_color(sensor_data):
-    """Determine status color based on sensor readings"""
-    temp = sensor_data['temperature']
-    humidity = sensor_data['humidity']
-    soil_moisture = sensor_data['soil_moisture']
-    
-    # Count issues
-    issues = 0
+def classify_reading(sensor_data):
+    """Status color, SIMPLE_MESSAGES key and per-channel low/ok/high for a reading
     
-    if temp < 10 or temp > 35:
-        issues += 2  # Critical temperature
-    elif temp < 15 or temp > 30:
-        issues += 1  # Warning temperature
+    Uses the reading's plant_type profile, or the default profile when it
+    has none (or names a profile no longer configured).
+    """
+    plant_type = sensor_data.get('plant_type')
+    if plant_rules.profile_id(plant_type) is None:
+        plant_type = None
+    return plant_rules.classify_one(sensor_data, plant_type)
+
+def detect_anomalies(partition, readings):
+    """Anomaly result per reading (oldest first), or none flagged if detection fails
     
-    if humidity < 20 or humidity > 90:
-        issues += 2  # Critical humidity
-    elif humidity < 30 or humidity > 80:
-        issues += 1  # Warning humidity
+    Runs after the readings are stored, so a detector error must not fail
+    the request: the client would retry and store them twice.
+    """
+    try:
+        return partition.anomalies.update_many(readings)
+    except Exception as e:
+        print(f"⚠️  Anomaly detection failed for {partition.device_id}: {e}")
+        record_error('anomaly_detect')
+        return [{'anomaly': False, 'anomalies': []} for _ in readings]
+
+def generate_ai_response(sensor_data):
+    """Generate AI-like response based on sensor data"""
+    _, _, sides = classify_reading(sensor_data)
+    return " ".join(AI_RESPONSES[channel][side] for channel, side in sides.items())
+
+def generate_simple_message(sensor_data, status_color=None):
+    """Generate a simple message for TTS based on sensor readings
     
-    if soil_moisture < 10 or soil_moisture > 90:
-        issues += 2  # Critical soil moisture
-    elif soil_moisture < 20 or soil_moisture > 80:
-        issues += 1  # Warning soil moisture
+    The message follows from the reading's thresholds, so ``status_color``
+    is only accepted for compatibility.
+    """
+    return SIMPLE_MESSAGES[classify_reading(sensor_data)[1]]
+
+def generate_wad_file(message, sensor_id):
+    """Generate a WAD audio file for the message using TTS
     
-    # Determine color based on total issues
-    if issues >= 4:
-        return "red"    # Critical issues
-    elif issues >= 2:
-        return "yellow" # Warning issues
-    else:
-        return "green"  # All good
+    Audio is content-addressed by message text and voice settings, so
+    repeated messages are served from the cache without running TTS.
+    Cache misses are queued on the TTS worker pool and return a job handle
+    (``job_id``) that can be polled on /audio/jobs/<job_id>.
+    """
+    with stage('tts_submit'):
+        return tts_pool.submit(message)
+
+def determine_status_color(sensor_data):
+    """Determine status color based on sensor readings"""
+    return classify_reading(sensor_data)[0]
 
 @app.route('/metrics', methods=['POST'])
 def store_metrics():
@@ -389,175 +914,451 @@ def store_metrics():
             'source': 'api_request'
         }
         
-        # Store metrics locally (in production, this would go to S3 or database)
-        metrics_file = os.path.join(UPLOAD_FOLDER, 'metrics.json')
-        
-        # Load existing metrics or create new list
-        if os.path.exists(metrics_file):
-            with open(metrics_file, 'r') as f:
-                all_metrics = json.load(f)
-        else:
-            all_metrics = []
-        
-        # Add new metrics
-        all_metrics.append(metrics_data)
-        
-        # Keep only last 500 entries to prevent file from growing too large
-        if len(all_metrics) > 500:
-            all_metrics = all_metrics[-500:]
-        
-        # Save updated metrics
-        with open(metrics_file, 'w') as f:
-            json.dump(all_metrics, f, indent=2)
+        # Store metrics locally (in production, this would go to S3 or database);
+        # one slot write in the ring, overwriting the oldest entry when full
+        try:
+            with stage('metrics_write'):
+                seq = metrics_ring.append(metrics_data)
+        except RecordTooLarge as e:
+            return jsonify({'error': f'Metrics entry too large: {e}'}), 413
         
         return jsonify({
             'success': True,
             'message': 'Metrics stored successfully',
             'metrics_id': metrics_data['id'],
+            'seq': seq,
             'timestamp': metrics_data['timestamp']
         }), 200
         
     except Exception as e:
         return jsonify({'error': f'Metrics storage failed: {str(e)}'}), 500
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Newest stored metrics entries (?limit=), or the next page after a sequence number (?after=)
+    
+    Readers tailing the store pass the returned ``next_after`` as ``after``;
+    ``overrun`` tells them entries were overwritten before they read them.
+    """
+    try:
+        try:
+            limit = min(int(request.args.get('limit', 100)), METRICS_PAGE_MAX)
+            after = request.args.get('after')
+            after = int(after) if after is not None else None
+        except ValueError:
+            return jsonify({'error': 'limit and after must be integers'}), 400
+        if limit < 1 or (after is not None and after < 0):
+            return jsonify({'error': 'limit must be positive and after non-negative'}), 400
+        
+        if after is None:
+            records = metrics_ring.read(limit=limit)
+            next_after = records[-1][0] if records else metrics_ring.head()
+            overrun = False
+        else:
+            records, next_after, overrun = metrics_ring.read_after(after, limit)
+        
+        entries = [dict(entry, seq=seq) for seq, entry in records]
+        return jsonify({
+            'entries': entries,
+            'count': len(entries),
+            'next_after': next_after,
+            'overrun': overrun,
+            'head': metrics_ring.head(),
+            'tail': metrics_ring.tail(),
+            'capacity': metrics_ring.capacity
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to read metrics: {str(e)}'}), 500
+
 @app.route('/audio/<filename>')
 def serve_audio(filename):
     """Serve audio files"""
     try:
-        audio_dir = os.path.join(UPLOAD_FOLDER, 'audio')
-        audio_path = os.path.join(audio_dir, filename)
+        audio_path = os.path.join(AUDIO_FOLDER, secure_filename(filename))
         
         if os.path.exists(audio_path):
-            return send_file(audio_path, as_attachment=True)
+            return send_file(os.path.abspath(audio_path), as_attachment=True)
         else:
             return jsonify({'error': 'Audio file not found'}), 404
     except Exception as e:
         return jsonify({'error': f'Failed to serve audio: {str(e)}'}), 500
 
+@app.route('/audio/jobs/<job_id>', methods=['GET'])
+def get_audio_job(job_id):
+    """Report TTS job status; ?wait=<seconds> long-polls until it finishes"""
+    try:
+        try:
+            wait = min(float(request.args.get('wait', 0)), AUDIO_JOB_MAX_WAIT)
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+        
+        job = tts_pool.get_job(job_id, wait=wait)
+        if job is None:
+            return jsonify({'error': 'Audio job not found'}), 404
+        
+        return jsonify(job), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to get audio job: {str(e)}'}), 500
+
 @app.route('/response-body', methods=['GET'])
 def get_response_body():
-    """Get the latest response body with status color"""
+    """Get the latest response body with status color (?device_id= for another device)"""
+    return latest_response(request.args.get('device_id') or DEFAULT_DEVICE)
+
+@app.route('/devices/<device_id>/response-body', methods=['GET'])
+def get_device_response_body(device_id):
+    """Latest response body of one device"""
+    return latest_response(device_id)
+
+def latest_response(device_id):
+    """Serve the latest-state snapshot of one device"""
     try:
-        # Get the latest sensor data
-        sensor_file = os.path.join(UPLOAD_FOLDER, 'sensor_data.json')
+        partition, error = device_partition_or_error(device_id)
+        if error:
+            return error
         
-        if not os.path.exists(sensor_file):
+        # Served from the in-memory latest state that ingest keeps current
+        snapshot = current_snapshot(partition.latest)
+        
+        if not snapshot:
             return jsonify({
                 'status_color': 'yellow',
                 'message': 'No sensor data available'
             }), 404
         
-        with open(sensor_file, 'r') as f:
-            all_sensor_data = json.load(f)
+        response = app.response_class(snapshot['body'], mimetype='application/json')
+        response.set_etag(snapshot['etag'])
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
         
-        if not all_sensor_data:
-            return jsonify({
-                'status_color': 'yellow',
-                'message': 'No sensor data available'
-            }), 404
+    except Exception as e:
+        return jsonify({'error': f'Failed to get response body: {str(e)}'}), 500
+
+def current_snapshot(latest):
+    """The latest-state snapshot (or None), with audio that finished since the reading arrived"""
+    snapshot = latest.get()
+    if snapshot:
+        audio = snapshot['audio']
+        if audio['status'] in ('queued', 'running') and audio['job_id']:
+            job = tts_pool.get_job(audio['job_id'])
+            if job and job['status'] != audio['status']:
+                latest.set_audio(snapshot['reading'].get('id'), job)
+                snapshot = latest.get()
+    return snapshot
+
+@app.route('/stream', methods=['GET'])
+def stream():
+    """Server-Sent Events with the latest status of a device (?device_id=)"""
+    return stream_response(request.args.get('device_id') or DEFAULT_DEVICE)
+
+@app.route('/devices/<device_id>/stream', methods=['GET'])
+def device_stream(device_id):
+    """Server-Sent Events with the latest status of one device"""
+    return stream_response(device_id)
+
+def stream_response(device_id):
+    """Subscribe to a device's status changes, resuming after Last-Event-ID"""
+    try:
+        if not valid_device_id(device_id):
+            return jsonify({'error': f'Invalid device_id: {device_id}'}), 400
         
-        # Get the most recent sensor reading
-        latest_sensor_data = all_sensor_data[-1]
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        if last_event_id is not None:
+            try:
+                last_event_id = int(last_event_id)
+            except ValueError:
+                return jsonify({'error': 'Last-Event-ID must be an event id from this stream'}), 400
         
-        # Determine status color
-        status_color = determine_status_color(latest_sensor_data)
+        subscription, resumed = stream_broker.subscribe(device_id, last_event_id)
+        if subscription is None:
+            return jsonify({'error': 'Too many open streams, retry shortly'}), 503, {'Retry-After': '5'}
         
-        # Generate simple message for TTS
-        message = generate_simple_message(latest_sensor_data, status_color)
+        try:
+            # Without the missed events at hand, catch up with the current status
+            initial = None
+            if not resumed:
+                partition = device_partitions.get(device_id, create=False)
+                snapshot = current_snapshot(partition.latest) if partition else None
+                if snapshot and snapshot['version'] != last_event_id:
+                    initial = (snapshot['version'], snapshot['body'])
+        except Exception:
+            subscription.close()
+            raise
+        
+        return app.response_class(
+            stream_events(subscription, initial),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
         
-        # Generate WAD audio file
-        audio_file_path = generate_wad_file(message, latest_sensor_data['id'])
+    except Exception as e:
+        return jsonify({'error': f'Failed to open stream: {str(e)}'}), 500
+
+def stream_events(subscription, initial):
+    """SSE frames for one subscriber until it disconnects or is dropped"""
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        last_id = None
+        if initial:
+            last_id = initial[0]
+            yield f"id: {initial[0]}\ndata: {initial[1]}\n\n"
+        while True:
+            event = subscription.get(STREAM_HEARTBEAT)
+            if event is None:
+                # Keeps proxies from closing an idle connection and
+                # surfaces a disconnected client on the write
+                yield ": heartbeat\n\n"
+            elif event is CLOSED:
+                return
+            elif last_id is None or event[0] > last_id:
+                last_id = event[0]
+                yield f"id: {event[0]}\ndata: {event[1]}\n\n"
+    finally:
+        subscription.close()
+
+def publish_stream_event(device_id, snapshot):
+    """Push a latest-state snapshot to the device's /stream subscribers"""
+    if snapshot:
+        stream_broker.publish(device_id, snapshot['version'], snapshot['body'])
+
+def poll_stream_devices(device_ids):
+    """Publish status changes made by other server processes (or finished audio)"""
+    for device_id in device_ids:
+        partition = device_partitions.get(device_id, create=False)
+        if partition is not None:
+            publish_stream_event(device_id, current_snapshot(partition.latest))
+
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    """Every device that has sent readings, with its count and latest status"""
+    try:
+        devices = []
+        for device_id in device_partitions.device_ids():
+            partition = device_partitions.get(device_id)
+            snapshot = partition.latest.get()
+            devices.append({
+                'device_id': device_id,
+                'readings': partition.store.count(),
+                'plant_id': snapshot['reading'].get('plant_id') if snapshot else None,
+                'latest_timestamp': snapshot['reading'].get('timestamp') if snapshot else None,
+                'status_color': snapshot['status_color'] if snapshot else None,
+                'anomaly': bool(snapshot and snapshot.get('anomaly') and snapshot['anomaly']['anomaly'])
+            })
+        
+        return jsonify({'devices': devices, 'count': len(devices)}), 200
         
-        return jsonify({
-            'status_color': status_color,
-            'message': message,
-            'audio_file': audio_file_path
-        }), 200
+    except Exception as e:
+        return jsonify({'error': f'Failed to list devices: {str(e)}'}), 500
+
+def publish_latest_reading(sensor_data, status_color, message, audio, anomaly=None):
+    """Make an accepted reading the one its device's /response-body serves and /stream pushes"""
+    device_id = sensor_data.get('device_id') or DEFAULT_DEVICE
+    partition = device_partitions.get(device_id)
+    if partition.latest.update(sensor_data, status_color, message, audio, anomaly):
+        publish_stream_event(device_id, partition.latest.get())
+
+def seed_latest_state():
+    """Load the newest reading from the active backend into the latest state"""
+    try:
+        if latest_state.get():
+            # Already published (by this or another server process)
+            return
+        
+        if supabase_storage.initialized:
+            latest_sensor_data = supabase_storage.get_latest_sensor_data(device_id=DEFAULT_DEVICE)
+        else:
+            latest_sensor_data = sensor_store.latest()
         
+        if not latest_sensor_data:
+            return
+        
+        status_color, message_key, _ = classify_reading(latest_sensor_data)
+        message = SIMPLE_MESSAGES[message_key]
+        audio = generate_wad_file(message, latest_sensor_data.get('id'))
+        publish_latest_reading(latest_sensor_data, status_color, message, audio)
     except Exception as e:
-        return jsonify({'error': f'Failed to get response body: {str(e)}'}), 500
+        print(f"⚠️  Could not seed latest sensor state: {e}")
 
 @app.route('/images', methods=['GET'])
 def get_images():
-    """Get list of uploaded images with Supabase URLs"""
+    """List uploaded images a page at a time
+    
+    ?limit=&cursor=&order=&fields= plus filters storage_type, file_type,
+    device_id, plant_id, since and until.
+    """
     try:
-        metadata_file = os.path.join(UPLOAD_FOLDER, 'metadata.json')
-        
-        if not os.path.exists(metadata_file):
-            return jsonify({'images': [], 'count': 0}), 200
+        try:
+            limit = min(max(int(request.args.get('limit', IMAGE_PAGE_SIZE)), 1), IMAGE_PAGE_MAX)
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        
+        order = request.args.get('order', 'asc').lower()
+        if order not in ('asc', 'desc'):
+            return jsonify({'error': 'order must be asc or desc'}), 400
+        
+        fields = IMAGE_FIELDS
+        if request.args.get('fields'):
+            fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+            unknown = [f for f in fields if f not in IMAGE_FIELDS]
+            if unknown:
+                return jsonify({
+                    'error': f'Unknown fields: {", ".join(unknown)}',
+                    'allowed_fields': IMAGE_FIELDS
+                }), 400
+        
+        # The listing only changes when the metadata generation does, so a
+        # matching ETag is answered without running the query
+        etag = f"{metadata_store.generation()}-{hashlib.sha1(request.query_string).hexdigest()[:16]}"
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
         
-        with open(metadata_file, 'r') as f:
-            all_metadata = json.load(f)
+        try:
+            records, next_cursor = metadata_store.list_page(
+                limit=limit,
+                cursor=request.args.get('cursor'),
+                descending=order == 'desc',
+                columns=fields,
+                storage_type=request.args.get('storage_type'),
+                file_type=request.args.get('file_type', '').lower() or None,
+                device_id=request.args.get('device_id'),
+                plant_id=request.args.get('plant_id'),
+                since=request.args.get('since'),
+                until=request.args.get('until')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Return images with Supabase URLs
         images = []
-        for metadata in all_metadata:
-            # Handle both old and new metadata formats
-            image_url = metadata.get('image_url') or metadata.get('stored_path', '')
-            image_info = {
-                'id': metadata['id'],
-                'original_filename': metadata['original_filename'],
-                'image_url': image_url,
-                'file_size': metadata['file_size'],
-                'upload_timestamp': metadata['upload_timestamp'],
-                'file_type': metadata['file_type'],
-                'storage_type': metadata.get('storage_type', 'local')
-            }
-            images.append(image_info)
+        for metadata in records:
+            if 'storage_type' in fields:
+                metadata['storage_type'] = metadata.get('storage_type') or 'local'
+            images.append({field: metadata[field] for field in fields})
         
-        return jsonify({
+        response = jsonify({
             'images': images,
             'count': len(images),
+            'next_cursor': next_cursor,
             'supabase_enabled': supabase_storage.initialized
-        }), 200
+        })
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
         
     except Exception as e:
         return jsonify({'error': f'Failed to get images: {str(e)}'}), 500
 
+@app.route('/images/<image_id>/thumb', methods=['GET'])
+def get_image_thumbnail(image_id):
+    """Serve a resized variant of an image (?w=<px>&format=jpeg|png|webp&q=<1-95>)"""
+    try:
+        try:
+            width = int(request.args.get('w', THUMBNAIL_DEFAULT_WIDTH))
+            quality = int(request.args.get('q', 80))
+        except ValueError:
+            return jsonify({'error': 'w and q must be integers'}), 400
+        fmt = request.args.get('format', 'jpeg').lower()
+        
+        if not 1 <= width <= THUMBNAIL_MAX_WIDTH:
+            return jsonify({'error': f'w must be between 1 and {THUMBNAIL_MAX_WIDTH}'}), 400
+        if not 1 <= quality <= 95:
+            return jsonify({'error': 'q must be between 1 and 95'}), 400
+        if fmt not in THUMBNAIL_FORMATS:
+            return jsonify({'error': 'Unsupported format', 'formats': list(THUMBNAIL_FORMATS)}), 400
+        
+        image_metadata = metadata_store.get(image_id)
+        if not image_metadata:
+            return jsonify({'error': 'Image not found'}), 404
+        
+        def fetch_source():
+            """Locate (or download) the original; only called on a cache miss"""
+            if image_metadata.get('storage_type') == 'supabase' and image_metadata.get('blob_name'):
+                tmp_path = os.path.join(THUMBNAIL_FOLDER, f".source_{uuid.uuid4().hex}.tmp")
+                if not supabase_storage.download_image_to(image_metadata['blob_name'], tmp_path):
+                    raise FileNotFoundError('Original not available from Supabase Storage')
+                return tmp_path, lambda: os.remove(tmp_path)
+            
+            # Local blob, or a legacy record that only has its stored path
+            name = image_metadata.get('blob_name') or os.path.basename(image_metadata.get('image_url') or '')
+            source_path = os.path.join(UPLOAD_FOLDER, secure_filename(name))
+            if not name or not os.path.exists(source_path):
+                raise FileNotFoundError('Original image file is missing')
+            return source_path, None
+        
+        # Identical content renders identically, so key variants by checksum
+        source_id = image_metadata.get('sha256') or image_metadata['id']
+        try:
+            thumb_path = thumbnail_cache.get_or_render(source_id, fetch_source, width, fmt, quality)
+        except FileNotFoundError as e:
+            return jsonify({'error': str(e)}), 404
+        
+        # Conditional GETs (If-None-Match / If-Modified-Since) get a 304
+        return send_file(
+            os.path.abspath(thumb_path),
+            mimetype=THUMBNAIL_FORMATS[fmt][2],
+            etag=os.path.basename(thumb_path).rsplit('.', 1)[0],
+            conditional=True,
+            max_age=86400
+        )
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to render thumbnail: {str(e)}'}), 500
+
 @app.route('/images/<image_id>', methods=['DELETE'])
 def delete_image(image_id):
     """Delete an image from Supabase Storage and metadata"""
     try:
-        metadata_file = os.path.join(UPLOAD_FOLDER, 'metadata.json')
-        
-        if not os.path.exists(metadata_file):
-            return jsonify({'error': 'No images found'}), 404
-        
-        with open(metadata_file, 'r') as f:
-            all_metadata = json.load(f)
-        
-        # Find the image
-        image_metadata = None
-        for metadata in all_metadata:
-            if metadata['id'] == image_id:
-                image_metadata = metadata
-                break
+        # Remove the record and drop its reference on the stored blob
+        image_metadata, last_reference = metadata_store.delete(image_id)
         
         if not image_metadata:
             return jsonify({'error': 'Image not found'}), 404
         
-        # Delete from Supabase Storage if applicable
-        if image_metadata.get('storage_type') == 'supabase' and image_metadata.get('blob_name'):
-            success = supabase_storage.delete_image(image_metadata['blob_name'])
+        # Delete the stored object only when no other record shares it
+        blob_removed = bool(last_reference and image_metadata.get('blob_name'))
+        if blob_removed:
+            success = remove_stored_blob(image_metadata['blob_name'], image_metadata.get('bucket'))
             if not success:
                 return jsonify({'error': 'Failed to delete from Supabase Storage'}), 500
         
-        # Remove from metadata
-        all_metadata = [m for m in all_metadata if m['id'] != image_id]
-        
-        # Save updated metadata
-        with open(metadata_file, 'w') as f:
-            json.dump(all_metadata, f, indent=2)
-        
         return jsonify({
             'success': True,
             'message': 'Image deleted successfully',
-            'image_id': image_id
+            'image_id': image_id,
+            'blob_removed': blob_removed
         }), 200
         
     except Exception as e:
         return jsonify({'error': f'Failed to delete image: {str(e)}'}), 500
 
+@app.route('/internal/metrics', methods=['GET'])
+def internal_metrics():
+    """Prometheus scrape target: request latencies, stage timings, queue depths, errors
+    
+    Operational telemetry for the server itself, separate from the
+    user-facing POST /metrics store.
+    """
+    return app.response_class(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: reports the cached Supabase health without querying it
+    
+    Local storage keeps the service usable while Supabase is unreachable,
+    so the answer is 503 only when SUPABASE_REQUIRED is set.
+    """
+    health = supabase_storage.health
+    supabase_ok = health['status'] in ('ok', 'disabled')
+    status_code = 503 if SUPABASE_REQUIRED and health['status'] != 'ok' else 200
+    return jsonify({
+        'status': 'ready' if supabase_ok else 'degraded',
+        'supabase': health,
+        'supabase_outbox': supabase_storage.outbox_status(),
+        'timestamp': datetime.now().isoformat()
+    }), status_code
+
 @app.route('/', methods=['GET'])
 def home():
     """Simple home endpoint"""
@@ -573,7 +1374,12 @@ def home():
             'get_images': {
                 'path': '/images',
                 'method': 'GET',
-                'description': 'Get list of uploaded images with URLs'
+                'description': 'Page through uploaded images (?limit=, cursor=, fields=, filters) with ETag'
+            },
+            'image_thumbnail': {
+                'path': '/images/<image_id>/thumb',
+                'method': 'GET',
+                'description': 'Resized image variant (?w=, format=, q=) with ETag caching'
             },
             'delete_image': {
                 'path': '/images/<image_id>',
@@ -585,21 +1391,80 @@ def home():
                 'method': 'POST',
                 'description': 'Receive sensor data from Raspberry Pi'
             },
+            'sensor_data_batch': {
+                'path': '/sensor-data/batch',
+                'method': 'POST',
+                'description': 'Receive a batch of buffered sensor readings'
+            },
+            'sensor_history': {
+                'path': '/sensor-data/history',
+                'method': 'GET',
+                'description': 'Bucketed min/max/mean/last readings (?start=, end=, bucket=, device_id=)'
+            },
+            'devices': {
+                'path': '/devices',
+                'method': 'GET',
+                'description': 'Devices with reading counts and latest status'
+            },
+            'device_response_body': {
+                'path': '/devices/<device_id>/response-body',
+                'method': 'GET',
+                'description': 'Latest status of one device'
+            },
+            'device_stream': {
+                'path': '/devices/<device_id>/stream',
+                'method': 'GET',
+                'description': 'Server-Sent Events with the status of one device'
+            },
+            'device_sensor_history': {
+                'path': '/devices/<device_id>/sensor-data/history',
+                'method': 'GET',
+                'description': 'Bucketed sensor history of one device'
+            },
             'metrics': {
                 'path': '/metrics',
                 'method': 'POST',
                 'description': 'Store additional metrics (optional)'
             },
+            'get_metrics': {
+                'path': '/metrics',
+                'method': 'GET',
+                'description': 'Newest stored metrics (?limit=) or those after a sequence number (?after=)'
+            },
             'response_body': {
                 'path': '/response-body',
                 'method': 'GET',
                 'description': 'Get latest status and sensor readings'
+            },
+            'stream': {
+                'path': '/stream',
+                'method': 'GET',
+                'description': 'Server-Sent Events pushing status, message and audio on every new reading'
+            },
+            'audio_job': {
+                'path': '/audio/jobs/<job_id>',
+                'method': 'GET',
+                'description': 'TTS job status (?wait=<seconds> to long-poll)'
+            },
+            'internal_metrics': {
+                'path': '/internal/metrics',
+                'method': 'GET',
+                'description': 'Prometheus metrics: request latency, stage timings, queue depths'
+            },
+            'ready': {
+                'path': '/ready',
+                'method': 'GET',
+                'description': 'Readiness probe with the cached Supabase health and outbox backlog'
             }
         },
+        'plant_types': plant_rules.names,
         'storage': {
             'type': 'supabase' if supabase_storage.initialized else 'local',
             'supabase_enabled': supabase_storage.initialized,
-            'database_url': supabase_storage.database_url if supabase_storage.initialized else None
+            'database_url': supabase_storage.database_url if supabase_storage.initialized else None,
+            'supabase_health': supabase_storage.health['status'],
+            'supabase_outbox_pending': supabase_storage.outbox_status()['pending'],
+            'sensor_tiers': sensor_compactor.describe()
         },
         'timestamp': datetime.now().isoformat()
     })
@@ -616,10 +1481,24 @@ if __name__ == '__main__':
     print(f"🚀 Server starting on port {port}")
     print(f"📡 API endpoints:")
     print(f"   • POST /upload - Upload plant images to Supabase")
-    print(f"   • GET /images - Get list of uploaded images")
+    print(f"   • GET /images - Page through uploaded images")
+    print(f"   • GET /images/<id>/thumb - Resized image variant")
     print(f"   • DELETE /images/<id> - Delete image from Supabase")
     print(f"   • POST /sensor-data - Receive sensor data from Pi")
+    print(f"   • POST /sensor-data/batch - Receive buffered readings in bulk")
+    print(f"   • GET /sensor-data/history - Aggregated sensor history")
+    print(f"   • GET /devices - Devices and their latest status")
+    print(f"   • GET /devices/<id>/response-body - Latest status of one device")
+    print(f"   • GET /devices/<id>/sensor-data/history - History of one device")
+    print(f"   • GET /devices/<id>/stream - Live status of one device (SSE)")
     print(f"   • POST /metrics - Store additional metrics")
+    print(f"   • GET /metrics - Read stored metrics")
     print(f"   • GET /response-body - Get AI response and status")
+    print(f"   • GET /stream - Live status pushed on every reading (SSE)")
+    print(f"   • GET /audio/jobs/<id> - TTS job status")
+    print(f"   • GET /internal/metrics - Prometheus server metrics")
+    print(f"   • GET /ready - Readiness, Supabase health and outbox backlog")
     print("=" * 50)
+    print(f"💡 Production: gunicorn -c gunicorn.conf.py wsgi:application")
+    init_worker()
     app.run(debug=False, host='0.0.0.0', port=port)
\ No newline at end of file
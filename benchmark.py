@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Load test and benchmark for the PlantAI Backend API
+
+Drives /sensor-data, /sensor-data/batch, /sensor-data/history, /upload,
+/images and /response-body through the Flask test client and over real
+HTTP, at several concurrency levels, payload sizes and pre-seeded history
+sizes, and reports latency percentiles, throughput and peak RSS as JSON.
+
+Each history size runs in a fresh process with its data in a scratch
+directory (UPLOAD_FOLDER), so runs never touch ./uploads and results are
+comparable across versions:
+
+    python benchmark.py --history 1k 100k 1M --images 10000 \\
+        --transport client http --concurrency 1 8 --output bench.json
+
+With --url the HTTP transport targets an already running server (for
+example gunicorn) instead of one started in-process; that server is not
+seeded, and peak RSS then describes the load generator only.
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+
+import numpy as np
+import requests
+
+SCENARIOS = ['sensor-data', 'sensor-batch', 'sensor-history', 'upload', 'images', 'response-body']
+TRANSPORTS = ['client', 'http']
+COUNT_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def parse_count(text):
+    """'1k' -> 1000, '1M' -> 1000000, '250' -> 250"""
+    text = text.strip().lower()
+    multiplier = COUNT_SUFFIXES.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    return int(float(text) * multiplier)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def log(message):
+    # stdout may carry the JSON report, so progress goes to stderr
+    print(message, file=sys.stderr, flush=True)
+
+
+def random_reading():
+    return {
+        'temperature': round(random.uniform(15, 30), 2),
+        'pressure': round(random.uniform(950, 1050), 2),
+        'humidity': round(random.uniform(20, 80), 2),
+        'soil_moisture': round(random.uniform(10, 90), 2)
+    }
+
+
+class ClientTransport:
+    """Requests through the Flask test client (no sockets, one client per thread)"""
+    name = 'client'
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, image=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if image is not None:
+            response = client.open(path, method=method, content_type='multipart/form-data',
+                                   data={'image': (io.BytesIO(image), 'bench.jpg', 'image/jpeg')})
+        else:
+            response = client.open(path, method=method, json=json_body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPTransport:
+    """Requests over real HTTP (one keep-alive session per thread)"""
+    name = 'http'
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self._local = threading.local()
+
+    def request(self, method, path, json_body=None, image=None):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        files = {'image': ('bench.jpg', image, 'image/jpeg')} if image is not None else None
+        response = session.request(method, self.base_url + path, json=json_body, files=files, timeout=60)
+        return response.status_code
+
+
+def build_request(scenario, args, payload):
+    """Return a function producing ``(method, path, json_body, image)`` for one request"""
+    if scenario == 'sensor-data':
+        return lambda: ('POST', '/sensor-data', random_reading(), None)
+    if scenario == 'sensor-batch':
+        return lambda: ('POST', '/sensor-data/batch', {'readings': [random_reading() for _ in range(payload)]}, None)
+    if scenario == 'sensor-history':
+        start = (datetime.now() - timedelta(hours=24)).isoformat()
+        return lambda: ('GET', f'/sensor-data/history?start={start}&bucket=5m', None, None)
+    if scenario == 'upload':
+        # Random bytes: every upload is new content, so nothing is deduplicated
+        return lambda: ('POST', '/upload', None, os.urandom(payload * 1024))
+    if scenario == 'images':
+        return lambda: ('GET', f'/images?limit={payload}&order=desc', None, None)
+    if scenario == 'response-body':
+        return lambda: ('GET', '/response-body', None, None)
+    raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def scenario_payloads(scenario, args):
+    """The payload sizes a scenario is run with (None when it has no payload)"""
+    if scenario == 'sensor-batch':
+        return [('batch_size', n) for n in args.batch_size]
+    if scenario == 'upload':
+        return [('image_kb', n) for n in args.image_kb]
+    if scenario == 'images':
+        return [('page_size', n) for n in args.page_size]
+    return [(None, None)]
+
+
+def run_load(transport, make_request, concurrency, total, warmup):
+    """Issue ``total`` requests from ``concurrency`` threads and summarize them"""
+    for _ in range(warmup):
+        method, path, body, image = make_request()
+        transport.request(method, path, body, image)
+
+    per_thread = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    barrier = threading.Barrier(concurrency + 1)
+
+    def worker(index):
+        # Build payloads before the clock starts so only the request is timed
+        prepared = [make_request() for _ in range(per_thread[index])]
+        barrier.wait()
+        for method, path, body, image in prepared:
+            started = time.perf_counter()
+            try:
+                status = transport.request(method, path, body, image)
+            except requests.RequestException:
+                status = None
+            latencies[index].append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                errors[index] += 1
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    samples = np.array([value for series in latencies for value in series]) * 1000
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if len(samples) else (0, 0, 0)
+    return {
+        'requests': int(len(samples)),
+        'errors': int(sum(errors)),
+        'p50_ms': round(float(p50), 3),
+        'p95_ms': round(float(p95), 3),
+        'p99_ms': round(float(p99), 3),
+        'mean_ms': round(float(samples.mean()), 3) if len(samples) else 0,
+        'max_ms': round(float(samples.max()), 3) if len(samples) else 0,
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0,
+        'elapsed_s': round(elapsed, 3)
+    }
+
+
+def seed_history(app_module, readings):
+    """Append ``readings`` synthetic readings, newest last, all within the raw tier"""
+    if readings <= 0:
+        return
+    # Keep every reading younger than 24h so compaction stays out of the way
+    spacing = min(60.0, 23 * 3600.0 / readings)
+    now = datetime.now()
+    chunk = 50000
+    for offset in range(0, readings, chunk):
+        batch = []
+        for i in range(offset, min(offset + chunk, readings)):
+            reading = random_reading()
+            reading.update({
+                'id': str(uuid.uuid4()),
+                'timestamp': (now - timedelta(seconds=(readings - i) * spacing)).isoformat(),
+                'source': 'benchmark'
+            })
+            batch.append(reading)
+        app_module.sensor_store.append_many(batch)
+
+
+def seed_images(app_module, images):
+    """Register ``images`` metadata records pointing at distinct local blobs"""
+    for i in range(images):
+        name = f"seed_{i:07d}.jpg"
+        app_module.save_image_metadata(
+            f"/uploads/{name}", name, 1024, name, 'local',
+            hashlib.sha256(name.encode()).hexdigest()
+        )
+
+
+def start_http_server(app):
+    """Serve ``app`` on a free localhost port from a background thread"""
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def run_one(args):
+    """Benchmark one history size in this process, with its data under ``args.workdir``"""
+    readings = parse_count(args.history[0])
+    # Point the app's data at the scratch directory; the cwd stays put so
+    # the real plant profiles are used whatever directory we are run from
+    os.environ['UPLOAD_FOLDER'] = os.path.join(args.workdir, 'uploads')
+    os.environ.setdefault('PLANT_PROFILES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                              'plant_profiles.json'))
+    if not args.supabase:
+        # Measure the local paths; empty values also stop .env from filling them in
+        os.environ['SUPABASE_URL'] = ''
+        os.environ['SUPABASE_ANON_KEY'] = ''
+
+    import app as app_module
+    app_module.init_worker()
+
+    started = time.perf_counter()
+    seed_history(app_module, readings)
+    seed_images(app_module, args.images)
+    if readings:
+        newest = app_module.sensor_store.latest()
+        status_color = app_module.determine_status_color(newest)
+        message = app_module.generate_simple_message(newest, status_color)
+        app_module.publish_latest_reading(newest, status_color, message,
+                                          app_module.generate_wad_file(message, newest['id']))
+    seed_seconds = time.perf_counter() - started
+    log(f"🌱 Seeded {readings} readings and {args.images} images in {seed_seconds:.1f}s")
+
+    transports = []
+    server = None
+    for name in args.transport:
+        if name == 'client':
+            transports.append(ClientTransport(app_module.app))
+        elif args.url:
+            transports.append(HTTPTransport(args.url))
+        else:
+            server, base_url = start_http_server(app_module.app)
+            transports.append(HTTPTransport(base_url))
+
+    results = []
+    for transport in transports:
+        for concurrency in args.concurrency:
+            for scenario in args.scenario:
+                for payload_name, payload in scenario_payloads(scenario, args):
+                    make_request = build_request(scenario, args, payload)
+                    summary = run_load(transport, make_request, concurrency, args.requests, args.warmup)
+                    result = {
+                        'scenario': scenario,
+                        'transport': transport.name,
+                        'concurrency': concurrency,
+                        'payload': {payload_name: payload} if payload_name else {},
+                    }
+                    result.update(summary)
+                    result['peak_rss_mb'] = peak_rss_mb()
+                    results.append(result)
+                    log(f"📊 {transport.name:6} c={concurrency:<3} {scenario:15} {payload_name or '':10} "
+                        f"{payload if payload is not None else '':<6} p50={summary['p50_ms']}ms "
+                        f"p99={summary['p99_ms']}ms {summary['throughput_rps']} req/s")
+    if server:
+        server.shutdown()
+
+    return {
+        'history_readings': readings,
+        'images': args.images,
+        'seed_seconds': round(seed_seconds, 2),
+        'results': results
+    }
+
+
+def child_command(args, history, output, workdir):
+    command = [sys.executable, os.path.abspath(__file__), '--run-one', '--output', output,
+               '--workdir', workdir, '--history', history, '--images', str(args.images),
+               '--requests', str(args.requests), '--warmup', str(args.warmup)]
+    for flag, values in (('--transport', args.transport), ('--concurrency', args.concurrency),
+                         ('--scenario', args.scenario), ('--batch-size', args.batch_size),
+                         ('--image-kb', args.image_kb), ('--page-size', args.page_size)):
+        command += [flag] + [str(v) for v in values]
+    if args.url:
+        command += ['--url', args.url]
+    if args.supabase:
+        command.append('--supabase')
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PlantAI Backend API')
+    parser.add_argument('--history', nargs='+', default=['1k'],
+                        help='Pre-seeded sensor readings per run, e.g. 1k 100k 1M (default 1k)')
+    parser.add_argument('--images', type=parse_count, default=1000, help='Pre-seeded image records (default 1000)')
+    parser.add_argument('--transport', nargs='+', choices=TRANSPORTS, default=TRANSPORTS)
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--scenario', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario (default 200)')
+    parser.add_argument('--warmup', type=int, default=10, help='Unmeasured requests per scenario (default 10)')
+    parser.add_argument('--batch-size', nargs='+', type=int, default=[100], help='Readings per /sensor-data/batch request')
+    parser.add_argument('--image-kb', nargs='+', type=int, default=[64, 1024], help='Upload sizes in KiB')
+    parser.add_argument('--page-size', nargs='+', type=int, default=[50], help='/images page sizes')
+    parser.add_argument('--url', help='Benchmark a running server over HTTP instead of an in-process one')
+    parser.add_argument('--supabase', action='store_true', help='Keep Supabase credentials from the environment')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch data directories')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    parser.add_argument('--run-one', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        with open(args.output, 'w') as f:
+            json.dump(run_one(args), f)
+        return
+
+    report = {
+        'benchmark': 'plantai-backend',
+        'git_commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'requests_per_scenario': args.requests,
+        'runs': []
+    }
+
+    # One process per history size: fresh module state and a clean RSS peak
+    for history in args.history:
+        log(f"🚀 Benchmark with {history} seeded readings")
+        fd, output = tempfile.mkstemp(prefix='plantai_bench_', suffix='.json')
+        os.close(fd)
+        # Removed only after the child exited, so its exit handlers (metric
+        # snapshots, worker pools) still find their directories
+        workdir = tempfile.mkdtemp(prefix='plantai_bench_')
+        try:
+            subprocess.run(child_command(args, history, output, workdir), check=True, stdout=sys.stderr)
+            with open(output, 'r') as f:
+                report['runs'].append(json.load(f))
+        finally:
+            os.remove(output)
+            if args.keep:
+                log(f"📁 Kept data of the {history} run in {workdir}")
+            else:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        log(f"✅ Report written to {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+import os
+import re
+import atexit
+import threading
+
+# Readings and images without a device_id belong to this device
+DEFAULT_DEVICE = 'default'
+
+# Ids name directories, so keep them to a safe character set
+DEVICE_ID_PATTERN = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.-]{0,63}$')
+
+
+def valid_device_id(device_id):
+    return isinstance(device_id, str) and DEVICE_ID_PATTERN.match(device_id) is not None
+
+
+class DevicePartition:
+    """The sensor storage of one device: log, rollup tiers, history cache, latest state and anomaly detector"""
+
+    def __init__(self, device_id, store, compactor, history, latest, anomalies):
+        self.device_id = device_id
+        self.store = store
+        self.compactor = compactor
+        self.history = history
+        self.latest = latest
+        self.anomalies = anomalies
+
+
+class DevicePartitions:
+    """Per-device sensor partitions, opened on first use
+
+    Every device has its own stores (and so its own locks and files), so
+    ingest and reads for one device never wait on another. The default
+    device is passed in already open, keeping its original top-level paths;
+    every other device lives under ``devices_dir/<device_id>/`` and is
+    built by ``open_partition(device_id, directory)``.
+
+    A single background thread runs compaction for all partitions, instead
+    of one thread per device.
+    """
+
+    def __init__(self, devices_dir, open_partition, default_partition, compaction_interval=60):
+        self.devices_dir = devices_dir
+        self.compaction_interval = compaction_interval
+        self._open_partition = open_partition
+        self._partitions = {DEFAULT_DEVICE: default_partition}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        os.makedirs(devices_dir, exist_ok=True)
+
+    def _directory(self, device_id):
+        return os.path.join(self.devices_dir, device_id)
+
+    def get(self, device_id, create=True):
+        """Return the partition of ``device_id``
+
+        With ``create=False`` returns None for a device that has no data yet
+        (in any server process). Raises ValueError for an invalid id.
+        """
+        partition = self._partitions.get(device_id)
+        if partition is not None:
+            return partition
+        if not valid_device_id(device_id):
+            raise ValueError(f'Invalid device_id: {device_id}')
+        if not create and not os.path.isdir(self._directory(device_id)):
+            return None
+        with self._lock:
+            partition = self._partitions.get(device_id)
+            if partition is None:
+                partition = self._open_partition(device_id, self._directory(device_id))
+                self._partitions[device_id] = partition
+        return partition
+
+    def device_ids(self):
+        """Every known device, including those first seen by other processes"""
+        ids = set(self._partitions)
+        for name in os.listdir(self.devices_dir):
+            if valid_device_id(name) and os.path.isdir(self._directory(name)):
+                ids.add(name)
+        return sorted(ids)
+
+    def start(self):
+        """Start the background compaction loop over every partition"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='sensor-compactor', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            for device_id in self.device_ids():
+                if self._stop.is_set():
+                    return
+                self.get(device_id).compactor.run_safely()
+            self._stop.wait(self.compaction_interval)
@@ -0,0 +1,181 @@
+import queue
+import atexit
+import threading
+from collections import deque
+
+from instrumentation import registry
+
+registry.describe('plantai_stream_events_total', 'counter', 'Events published to stream subscribers')
+registry.describe('plantai_stream_dropped_total', 'counter', 'Stream subscribers dropped for falling behind')
+
+# Put on a subscriber's queue when it is dropped or the broker stops
+CLOSED = object()
+
+
+class Subscription:
+    """One stream client: a bounded queue of ``(id, data)`` events"""
+
+    def __init__(self, broker, channel, queue_size):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue.Queue(maxsize=queue_size)
+
+    def get(self, timeout):
+        """The next event, None after ``timeout`` seconds, or CLOSED"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """In-process fan-out of events to many subscribers.
+
+    Events are published per channel (a device id) with an id that only
+    grows, and every subscriber of the channel gets its own copy on a queue
+    of at most ``queue_size`` events. Publishing never blocks: a subscriber
+    whose queue is full is dropped (it gets CLOSED and can reconnect), so a
+    slow client costs nothing but its own connection.
+
+    The last ``history`` events of each channel are kept, so a subscriber
+    that passes the id of the last event it saw gets what it missed. An
+    event whose id is not above the channel's newest is ignored, which lets
+    the same event be published both on the write path and by ``poll``.
+
+    With ``poll`` set, a background thread calls ``poll(channels)`` every
+    ``poll_interval`` seconds while anyone is subscribed, to publish changes
+    made by other server processes.
+    """
+
+    def __init__(self, queue_size=32, history=64, max_subscribers=100, poll=None, poll_interval=1.0):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.poll = poll
+        self.poll_interval = poll_interval
+        self._history_size = history
+        self._lock = threading.Lock()
+        self._subscribers = {}  # channel -> set of Subscription
+        self._history = {}  # channel -> deque of (id, data)
+        self._has_subscribers = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def publish(self, channel, event_id, data):
+        """Send ``data`` to every subscriber of ``channel``; False if not newer"""
+        dropped = []
+        with self._lock:
+            history = self._history.setdefault(channel, deque(maxlen=self._history_size))
+            if history and event_id <= history[-1][0]:
+                return False
+            history.append((event_id, data))
+            for subscription in list(self._subscribers.get(channel, ())):
+                try:
+                    subscription.queue.put_nowait((event_id, data))
+                except queue.Full:
+                    self._remove(subscription)
+                    dropped.append(subscription)
+        registry.inc('plantai_stream_events_total')
+        for subscription in dropped:
+            self._close_queue(subscription)
+            print(f"⚠️  Dropped a slow stream subscriber of {channel}")
+        if dropped:
+            self.dropped += len(dropped)
+            registry.inc('plantai_stream_dropped_total', value=len(dropped))
+        return True
+
+    def subscribe(self, channel, last_event_id=None):
+        """Open a subscription, queueing events after ``last_event_id``
+
+        Returns ``(subscription, resumed)``; ``resumed`` is False when the
+        kept history does not reach back to ``last_event_id`` (or none was
+        given), so the caller should send the current state first. Returns
+        ``(None, False)`` when ``max_subscribers`` are already connected.
+        """
+        with self._lock:
+            if self._count() >= self.max_subscribers:
+                return None, False
+            subscription = Subscription(self, channel, self.queue_size)
+            history = self._history.get(channel, ())
+            resumed = False
+            if last_event_id is not None and history:
+                newest = history[-1][0]
+                if last_event_id == newest:
+                    resumed = True
+                elif history[0][0] - 1 <= last_event_id < newest:
+                    missed = [event for event in history if event[0] > last_event_id]
+                    for event in missed[-self.queue_size:]:
+                        subscription.queue.put_nowait(event)
+                    resumed = len(missed) <= self.queue_size
+            self._subscribers.setdefault(channel, set()).add(subscription)
+            self._has_subscribers.set()
+        return subscription, resumed
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        """Forget ``subscription`` (caller holds ``_lock``)"""
+        subscribers = self._subscribers.get(subscription.channel)
+        if subscribers is not None:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.channel]
+        if not self._subscribers:
+            self._has_subscribers.clear()
+
+    def _close_queue(self, subscription):
+        """Discard the subscriber's queued events and wake its reader with CLOSED"""
+        while True:
+            try:
+                subscription.queue.get_nowait()
+            except queue.Empty:
+                break
+        subscription.queue.put_nowait(CLOSED)
+
+    def _count(self):
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def subscriber_count(self):
+        with self._lock:
+            return self._count()
+
+    def channels(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def start(self):
+        """Start the poll thread (a no-op without ``poll``)"""
+        if self.poll is None or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='event-stream-poll', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._has_subscribers.wait()
+            if self._stop.is_set():
+                break
+            try:
+                self.poll(self.channels())
+            except Exception as e:
+                print(f"⚠️  Stream poll failed: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def stop(self):
+        """Stop polling and close every subscription"""
+        self._stop.set()
+        with self._lock:
+            subscriptions = [s for subscribers in self._subscribers.values() for s in subscribers]
+            for subscription in subscriptions:
+                self._remove(subscription)
+        self._has_subscribers.set()
+        for subscription in subscriptions:
+            self._close_queue(subscription)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
@@ -0,0 +1,84 @@
+import os
+import json
+import tempfile
+
+# Advisory locks need fcntl (Linux/macOS); elsewhere locks are per-process only
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class FileLock:
+    """Cross-process exclusive lock on a lock file (``flock``).
+
+    The file is opened on every ``acquire`` rather than once, so a forked
+    child never shares (and silently co-owns) its parent's lock. Separate
+    ``FileLock`` acquisitions also exclude each other between threads of the
+    same process, but a single instance is not re-entrant.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """Take the lock; with ``blocking=False`` return False if it is held"""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        os.close(self._fd)
+        self._fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+def atomic_write_json(path, data):
+    """Write ``data`` as JSON to a temp file next to ``path``, then rename it into place
+
+    Readers see either the old or the new file, never a partial one.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def claim_directory(base_dir, max_slots=64):
+    """Claim a directory no other live process is using
+
+    Tries ``base_dir``, then ``base_dir.1``, ``base_dir.2``... and returns
+    ``(directory, lock)`` for the first one whose owner lock is free. Keep
+    ``lock`` referenced for the life of the process; when a process dies its
+    claim is released and the next process to start takes over the
+    directory (and whatever it left behind).
+    """
+    for slot in range(max_slots):
+        directory = base_dir if slot == 0 else f"{base_dir}.{slot}"
+        os.makedirs(directory, exist_ok=True)
+        lock = FileLock(os.path.join(directory, '.owner.lock'))
+        if lock.acquire(blocking=False):
+            return directory, lock
+    raise RuntimeError(f"No free directory slot under {base_dir}")
@@ -0,0 +1,23 @@
+# Gunicorn configuration for running PlantAI with several worker processes
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+if worker_class == 'gthread':
+    # Each open /stream holds a thread for its whole life, so streams get
+    # their own STREAM_MAX_SUBSCRIBERS threads (as in app.py) on top of the
+    # request threads. The pool only starts threads as connections need them
+    threads += int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 256))
+timeout = 60
+
+# Import the app (stores, migrations, caches) once in the master; workers
+# inherit it on fork and start their own background services below
+preload_app = True
+
+
+def post_worker_init(worker):
+    from app import init_worker
+    init_worker()
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import atexit
+import threading
+import functools
+from contextlib import contextmanager
+
+from file_lock import FileLock, atomic_write_json, claim_directory
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and latency histograms.
+
+    Recording is a dict update under one lock, cheap enough for every
+    request. ``render`` produces the Prometheus text exposition format.
+    Gauges are callbacks evaluated when read (queue depths and the like),
+    so nothing has to push them.
+
+    With ``attach`` each server process also saves its metrics to its own
+    file, and ``render`` adds up the counters and histograms of every
+    process, so a scrape of any worker sees the whole server. Gauges are
+    point-in-time values of one process, so they are not added up: each
+    live process reports its own, labelled with its ``pid``.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._help = {}  # name -> (type, help)
+        self._counters = {}  # (name, label key) -> value
+        self._histograms = {}  # (name, label key) -> [bucket counts..., sum, count]
+        self._gauges = {}  # name -> (callback, label name or None)
+        self._directory = None
+        self._slot = None
+        self._claim = None
+        self._thread = None
+        self._pid = os.getpid()  # Process the in-memory values were recorded in
+
+    def describe(self, name, metric_type, help_text):
+        self._help[name] = (metric_type, help_text)
+
+    def inc(self, name, labels=None, value=1):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, labels=None):
+        key = (name, _label_key(labels))
+        with self._lock:
+            series = self._histograms.get(key)
+            if series is None:
+                series = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += seconds
+            series[-1] += 1
+
+    def gauge(self, name, callback, help_text='', label=None):
+        """Register a gauge read from ``callback()``
+
+        With ``label`` the callback returns ``{label value: number}``;
+        otherwise it returns a single number.
+        """
+        self.describe(name, 'gauge', help_text)
+        self._gauges[name] = (callback, label)
+
+    def _gauge_values(self):
+        values = []
+        for name, (callback, label) in self._gauges.items():
+            try:
+                value = callback()
+            except Exception:
+                continue
+            if label is None:
+                values.append([name, [], value])
+            else:
+                values.extend([name, [[label, str(k)]], v] for k, v in value.items())
+        return values
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as ``plantai_stage_seconds{stage=name}``; count it if it raises"""
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc('plantai_stage_errors_total', {'stage': name})
+            raise
+        finally:
+            self.observe('plantai_stage_seconds', time.perf_counter() - start, {'stage': name})
+
+    def timed(self, name):
+        """Decorator form of ``stage``"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Counters, histograms and current gauge values as a JSON-serializable dict"""
+        gauges = self._gauge_values()
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'counters': [[name, list(key), value] for (name, key), value in self._counters.items()],
+                'histograms': [[name, list(key), list(series)] for (name, key), series in self._histograms.items()],
+                'gauges': gauges
+            }
+
+    def attach(self, directory, interval=5.0):
+        """Share metrics with the other server processes through ``directory``
+
+        Claims a per-process slot, continues from the totals a previous
+        owner of the slot left behind plus what this process recorded
+        before attaching, and saves a snapshot every ``interval`` seconds
+        (and at exit).
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._slot, self._claim = claim_directory(os.path.join(directory, 'worker'))
+        self._directory = directory
+
+        with self._lock:
+            recorded = (self._counters, self._histograms)
+            if self._pid != os.getpid():
+                # Recorded by the parent before it forked this worker (e.g.
+                # at import with gunicorn's preload_app): saved once, by the
+                # first worker to attach, instead of once per worker
+                self._save_inherited(os.path.join(directory, f'parent-{os.getppid()}'), recorded)
+                recorded = ({}, {})
+            self._pid = os.getpid()
+
+            # Start from the slot's saved totals so counters never go backwards
+            previous = self._read(os.path.join(self._slot, 'metrics.json')) or {}
+            self._counters = {
+                (name, tuple(tuple(pair) for pair in key)): value
+                for name, key, value in previous.get('counters', [])
+            }
+            self._histograms = {
+                (name, tuple(tuple(pair) for pair in key)): list(series)
+                for name, key, series in previous.get('histograms', [])
+                if len(series) == len(self.buckets) + 2
+            }
+            for key, value in recorded[0].items():
+                self._counters[key] = self._counters.get(key, 0) + value
+            for key, series in recorded[1].items():
+                current = self._histograms.get(key, [0] * len(series))
+                self._histograms[key] = [a + b for a, b in zip(current, series)]
+
+        def save_loop():
+            while True:
+                time.sleep(interval)
+                self.save()
+
+        self._thread = threading.Thread(target=save_loop, name='metrics-saver', daemon=True)
+        self._thread.start()
+        atexit.register(self.save)
+
+    def _save_inherited(self, directory, recorded):
+        """Save a parent's pre-fork counters and histograms unless a sibling already did"""
+        counters, histograms = recorded
+        if not counters and not histograms:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, 'metrics.json')
+        with FileLock(os.path.join(directory, '.lock')):
+            if os.path.exists(path):
+                return
+            atomic_write_json(path, {
+                'counters': [[name, list(key), value] for (name, key), value in counters.items()],
+                'histograms': [[name, list(key), list(series)] for (name, key), series in histograms.items()],
+                'gauges': []
+            })
+
+    def save(self):
+        if self._directory:
+            try:
+                atomic_write_json(os.path.join(self._slot, 'metrics.json'), self.snapshot())
+            except OSError as e:
+                print(f"⚠️  Could not save metrics snapshot: {e}")
+
+    def _read(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _other_snapshots(self):
+        """Saved snapshots of every other process slot, with its liveness"""
+        if not self._directory:
+            return []
+        snapshots = []
+        for name in sorted(os.listdir(self._directory)):
+            slot = os.path.join(self._directory, name)
+            if slot == self._slot or not os.path.isdir(slot):
+                continue
+            snapshot = self._read(os.path.join(slot, 'metrics.json'))
+            if not snapshot:
+                continue
+            # A slot whose owner lock is free belongs to a process that exited
+            owner = FileLock(os.path.join(slot, '.owner.lock'))
+            alive = not owner.acquire(blocking=False)
+            if not alive:
+                owner.release()
+            snapshots.append((snapshot, alive))
+        return snapshots
+
+    def render(self):
+        """Prometheus text exposition of this process plus all saved peers"""
+        counters, histograms, gauges = {}, {}, {}
+        for snapshot, alive in [(self.snapshot(), True)] + self._other_snapshots():
+            for name, key, value in snapshot.get('counters', []):
+                ckey = (name, tuple(tuple(pair) for pair in key))
+                counters[ckey] = counters.get(ckey, 0) + value
+            for name, key, series in snapshot.get('histograms', []):
+                hkey = (name, tuple(tuple(pair) for pair in key))
+                current = histograms.get(hkey, [0] * len(series))
+                histograms[hkey] = [a + b for a, b in zip(current, series)]
+            if alive and snapshot.get('pid') is not None:
+                for name, key, value in snapshot.get('gauges', []):
+                    gkey = (name, tuple(tuple(pair) for pair in key) + (('pid', str(snapshot['pid'])),))
+                    gauges[gkey] = value
+
+        lines = []
+        emitted = set()
+
+        def header(name, default_type):
+            if name in emitted:
+                return
+            emitted.add(name)
+            metric_type, help_text = self._help.get(name, (default_type, ''))
+            if help_text:
+                lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, key), value in sorted(counters.items()):
+            header(name, 'counter')
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        for (name, key), series in sorted(histograms.items()):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(key, [('le', repr(bound))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{name}_sum{_format_labels(key)} {series[-2]}")
+            lines.append(f"{name}_count{_format_labels(key)} {series[-1]}")
+
+        for (name, key), value in sorted(gauges.items()):
+            header(name, 'gauge')
+            lines.append(f"{name}{_format_labels(key)} {value}")
+
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide default registry, shared by every module that records metrics
+registry = MetricsRegistry()
+registry.describe('plantai_http_request_seconds', 'histogram', 'Request latency by endpoint')
+registry.describe('plantai_http_requests_total', 'counter', 'Requests by endpoint, method and status')
+registry.describe('plantai_http_errors_total', 'counter', 'Requests answered with a 5xx status')
+registry.describe('plantai_stage_seconds', 'histogram', 'Time spent in each processing stage')
+registry.describe('plantai_stage_errors_total', 'counter', 'Failures per processing stage')
+
+stage = registry.stage
+timed = registry.timed
+
+
+def record_error(stage_name):
+    """Count a failure that was handled without raising"""
+    registry.inc('plantai_stage_errors_total', {'stage': stage_name})
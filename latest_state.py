@@ -0,0 +1,117 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+from file_lock import FileLock, atomic_write_json
+
+
+class LatestState:
+    """Process-wide snapshot of the newest reading and its derived status.
+
+    Ingest calls ``update`` once per accepted reading; readers get the
+    pre-serialized response body and its ETag without touching storage,
+    classification or TTS.
+
+    With ``path`` set the snapshot is also kept in that file (written under a
+    lock, replaced atomically), so every server process serves the same
+    snapshot and ETag; ``get`` only re-reads it when the file has changed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version = 0
+        self._snapshot = None
+        self._stamp = None  # (inode, mtime) of the file behind _snapshot
+        self._file_lock = FileLock(path + '.lock') if path else None
+
+    def update(self, reading, status_color, message, audio, anomaly=None):
+        """Replace the snapshot unless ``reading`` is older than the current one
+
+        ``audio`` is the handle returned by ``generate_wad_file`` and
+        ``anomaly`` the detector's verdict on the reading, if any. Returns
+        True if the snapshot changed.
+        """
+        with self._exclusive():
+            current = self._snapshot
+            if current and reading.get('timestamp') and current['reading'].get('timestamp') \
+                    and reading['timestamp'] < current['reading']['timestamp']:
+                # Replayed history must not hide a newer live reading
+                return False
+            self._store(reading, status_color, message, audio, anomaly)
+            return True
+
+    def set_audio(self, reading_id, audio):
+        """Attach finished audio to the snapshot if it still describes ``reading_id``"""
+        with self._exclusive():
+            current = self._snapshot
+            if current is None or current['reading'].get('id') != reading_id:
+                return False
+            self._store(current['reading'], current['status_color'], current['message'], audio, current.get('anomaly'))
+            return True
+
+    @contextmanager
+    def _exclusive(self):
+        """Thread lock plus, when shared, the file lock with the snapshot reloaded"""
+        with self._lock:
+            if self._file_lock is None:
+                yield
+                return
+            with self._file_lock:
+                self._reload()
+                yield
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _reload(self):
+        """Pick up a snapshot another process wrote (caller holds ``_lock``)"""
+        stamp = self._stat()
+        if stamp is None or stamp == self._stamp:
+            return
+        try:
+            with open(self.path, 'r') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._snapshot = snapshot
+        self._version = snapshot['version']
+        self._stamp = stamp
+
+    def _store(self, reading, status_color, message, audio, anomaly=None):
+        self._version += 1
+        body = {
+            'status_color': status_color,
+            'anomaly': bool(anomaly and anomaly['anomaly']),
+            'anomalies': anomaly['anomalies'] if anomaly else [],
+            'message': message,
+            'audio_file': audio['audio_file'],
+            'audio_job': audio['job_id'],
+            'audio_status': audio['status']
+        }
+        snapshot = {
+            'reading': reading,
+            'status_color': status_color,
+            'message': message,
+            'audio': audio,
+            'anomaly': anomaly,
+            'body': json.dumps(body),
+            'etag': f"{reading.get('id')}-{self._version}",
+            'version': self._version
+        }
+        if self.path:
+            atomic_write_json(self.path, snapshot)
+            self._stamp = self._stat()
+        self._snapshot = snapshot
+
+    def get(self):
+        """Return the current snapshot (or None); treat it as read-only"""
+        if self.path and self._stat() != self._stamp:
+            with self._lock:
+                self._reload()
+        return self._snapshot
@@ -0,0 +1,347 @@
+import os
+import json
+import base64
+import sqlite3
+import threading
+
+from file_lock import FileLock
+from device_partitions import DEFAULT_DEVICE
+
+
+def encode_cursor(upload_timestamp, image_id):
+    """Opaque pagination cursor for the position after one record"""
+    raw = json.dumps([upload_timestamp, image_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of ``encode_cursor``; raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        upload_timestamp, image_id = json.loads(raw)
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return str(upload_timestamp), str(image_id)
+
+
+class ImageMetadataStore:
+    """SQLite-backed index of uploaded image metadata.
+
+    Runs in WAL mode so readers never block the single writer, and every
+    upload or delete is an indexed point operation instead of a rewrite of
+    the whole metadata file.
+
+    Stored objects are content-addressed: the ``blobs`` table maps a SHA-256
+    to the stored object and counts the image records that reference it, so
+    identical uploads share one object and it is only removed with its last
+    reference.
+
+    Every insert or delete bumps a generation counter in the same
+    transaction, so listings can be validated (ETag) without being re-read.
+    """
+
+    COLUMNS = (
+        'id', 'original_filename', 'image_url', 'file_size', 'upload_timestamp',
+        'file_type', 'blob_name', 'bucket', 'storage_type', 'sha256', 'device_id', 'plant_id'
+    )
+
+    def __init__(self, db_path):
+        """Open (or create) the metadata database at ``db_path``"""
+        self.db_path = db_path
+        self._local = threading.local()
+        self._create_schema()
+
+    def _connection(self):
+        """Return this thread's connection, opening it on first use
+
+        A connection inherited across ``fork`` must not be used, so one made
+        by another process is abandoned and replaced.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _create_schema(self):
+        conn = self._connection()
+        had_blobs = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'blobs'"
+        ).fetchone() is not None
+        with conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS images (
+                    id TEXT PRIMARY KEY,
+                    original_filename TEXT NOT NULL,
+                    image_url TEXT,
+                    file_size INTEGER,
+                    upload_timestamp TEXT NOT NULL,
+                    file_type TEXT,
+                    blob_name TEXT,
+                    bucket TEXT,
+                    storage_type TEXT DEFAULT 'local',
+                    sha256 TEXT,
+                    device_id TEXT DEFAULT '{DEFAULT_DEVICE}',
+                    plant_id TEXT
+                )
+            """)
+            # Databases created before a column existed get it added in place
+            existing = {row['name'] for row in conn.execute('PRAGMA table_info(images)')}
+            if 'sha256' not in existing:
+                conn.execute('ALTER TABLE images ADD COLUMN sha256 TEXT')
+            if 'device_id' not in existing:
+                # Existing images were all uploaded by the default device
+                conn.execute(f"ALTER TABLE images ADD COLUMN device_id TEXT DEFAULT '{DEFAULT_DEVICE}'")
+            if 'plant_id' not in existing:
+                conn.execute('ALTER TABLE images ADD COLUMN plant_id TEXT')
+            # Keyset pagination walks (upload_timestamp, id)
+            conn.execute('DROP INDEX IF EXISTS idx_images_upload_timestamp')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_images_upload_timestamp_id ON images(upload_timestamp, id)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_images_storage_type ON images(storage_type)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_images_sha256 ON images(sha256)')
+            # Per-device listings page through their own slice of the index
+            conn.execute(
+                'CREATE INDEX IF NOT EXISTS idx_images_device_upload_timestamp_id ON images(device_id, upload_timestamp, id)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_images_plant_id ON images(plant_id)')
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS blobs (
+                    sha256 TEXT PRIMARY KEY,
+                    blob_name TEXT,
+                    bucket TEXT,
+                    image_url TEXT,
+                    storage_type TEXT,
+                    file_size INTEGER,
+                    refcount INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', 0)")
+            if not had_blobs:
+                # Backfill references for records that already carry a checksum
+                conn.execute("""
+                    INSERT OR IGNORE INTO blobs (sha256, blob_name, bucket, image_url, storage_type, file_size, refcount)
+                    SELECT sha256, MIN(blob_name), MIN(bucket), MIN(image_url), MIN(storage_type), MIN(file_size), COUNT(*)
+                    FROM images WHERE sha256 IS NOT NULL GROUP BY sha256
+                """)
+
+    def _row_to_dict(self, row):
+        return dict(row) if row is not None else None
+
+    def _bump_generation(self, conn):
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'generation'")
+
+    def generation(self):
+        """Counter that changes whenever any record is added or removed"""
+        row = self._connection().execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def add(self, metadata, reuse=False):
+        """Insert one metadata record and take a reference on its blob
+
+        Returns ``(metadata, superseded)``. If another upload registered the
+        same content first, ``metadata`` is repointed at that blob and
+        ``superseded`` holds the now-unused object (``blob_name``/``bucket``)
+        for the caller to remove; otherwise ``superseded`` is None.
+
+        With ``reuse`` the caller stored nothing and relies on an existing
+        blob of the same content (found with ``find_blob``). If that blob's
+        last reference was deleted meanwhile, nothing is inserted and
+        ``(None, None)`` is returned, so the caller stores the bytes itself.
+        The lookup and the new reference happen in one write transaction,
+        so a concurrent ``delete`` either sees the new reference or has
+        already dropped the blob.
+        """
+        conn = self._connection()
+        metadata = dict(metadata)
+        superseded = None
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if metadata.get('sha256'):
+                blob = conn.execute('SELECT * FROM blobs WHERE sha256 = ?', (metadata['sha256'],)).fetchone()
+                if blob is None and reuse:
+                    return None, None
+                if blob is None:
+                    conn.execute(
+                        'INSERT INTO blobs (sha256, blob_name, bucket, image_url, storage_type, file_size, refcount) '
+                        'VALUES (?, ?, ?, ?, ?, ?, 1)',
+                        (metadata['sha256'], metadata.get('blob_name'), metadata.get('bucket'),
+                         metadata.get('image_url'), metadata.get('storage_type'), metadata.get('file_size'))
+                    )
+                else:
+                    if blob['blob_name'] != metadata.get('blob_name') or blob['bucket'] != metadata.get('bucket'):
+                        superseded = {'blob_name': metadata.get('blob_name'), 'bucket': metadata.get('bucket')}
+                        for column in ('blob_name', 'bucket', 'image_url', 'storage_type'):
+                            metadata[column] = blob[column]
+                    conn.execute('UPDATE blobs SET refcount = refcount + 1 WHERE sha256 = ?', (metadata['sha256'],))
+
+            values = [metadata.get(column) for column in self.COLUMNS]
+            conn.execute(
+                f"INSERT INTO images ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                values
+            )
+            self._bump_generation(conn)
+        return metadata, superseded
+
+    def relocate_blob(self, blob_name, bucket, new_location):
+        """Point every record of a stored object at a new copy of it
+
+        ``new_location`` holds the new ``blob_name``, ``bucket``,
+        ``image_url`` and ``storage_type``. Returns how many image records
+        were updated (0 if they have all been deleted meanwhile).
+        """
+        columns = ('blob_name', 'bucket', 'image_url', 'storage_type')
+        values = [new_location[column] for column in columns]
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        conn = self._connection()
+        with conn:
+            updated = conn.execute(
+                f'UPDATE images SET {assignments} WHERE blob_name = ? AND bucket = ?',
+                values + [blob_name, bucket]
+            ).rowcount
+            conn.execute(f'UPDATE blobs SET {assignments} WHERE blob_name = ? AND bucket = ?', values + [blob_name, bucket])
+            if updated:
+                self._bump_generation(conn)
+        return updated
+
+    def find_blob(self, sha256):
+        """Return the stored object for ``sha256`` if one is referenced, else None"""
+        row = self._connection().execute(
+            'SELECT * FROM blobs WHERE sha256 = ? AND refcount > 0', (sha256,)
+        ).fetchone()
+        return self._row_to_dict(row)
+
+    def get(self, image_id):
+        """Look up a single record by id, or None"""
+        row = self._connection().execute('SELECT * FROM images WHERE id = ?', (image_id,)).fetchone()
+        return self._row_to_dict(row)
+
+    def delete(self, image_id):
+        """Delete a record by id and drop its blob reference
+
+        Returns ``(metadata, remove_blob)``: the deleted record (None if it
+        did not exist) and whether that was the last reference, i.e. the
+        caller should now remove the stored object. Records without a
+        checksum predate deduplication and always own their object.
+        """
+        conn = self._connection()
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT * FROM images WHERE id = ?', (image_id,)).fetchone()
+            if row is None:
+                return None, False
+            conn.execute('DELETE FROM images WHERE id = ?', (image_id,))
+            self._bump_generation(conn)
+
+            remove_blob = True
+            if row['sha256']:
+                conn.execute('UPDATE blobs SET refcount = refcount - 1 WHERE sha256 = ?', (row['sha256'],))
+                blob = conn.execute('SELECT refcount FROM blobs WHERE sha256 = ?', (row['sha256'],)).fetchone()
+                if blob is not None and blob['refcount'] > 0:
+                    remove_blob = False
+                else:
+                    conn.execute('DELETE FROM blobs WHERE sha256 = ?', (row['sha256'],))
+        return self._row_to_dict(row), remove_blob
+
+    def list_images(self):
+        """Return every record, oldest upload first"""
+        rows = self._connection().execute('SELECT * FROM images ORDER BY upload_timestamp, id').fetchall()
+        return [self._row_to_dict(row) for row in rows]
+
+    def list_page(self, limit=50, cursor=None, descending=False, columns=None,
+                  storage_type=None, file_type=None, since=None, until=None,
+                  device_id=None, plant_id=None):
+        """Return ``(records, next_cursor)`` for one page of a filtered listing
+
+        Pages are keyed on ``(upload_timestamp, id)`` rather than offsets, so
+        each page is an index range scan and concurrent uploads never shift
+        records between pages. ``columns`` limits the selected columns (the
+        sort keys are always included); ``since``/``until`` bound
+        ``upload_timestamp`` (inclusive/exclusive).
+        """
+        selected = [c for c in (columns or self.COLUMNS) if c in self.COLUMNS]
+        for key in ('upload_timestamp', 'id'):
+            if key not in selected:
+                selected.append(key)
+
+        clauses, params = [], []
+        if storage_type:
+            clauses.append('storage_type = ?')
+            params.append(storage_type)
+        if file_type:
+            clauses.append('file_type = ?')
+            params.append(file_type)
+        if device_id:
+            clauses.append('device_id = ?')
+            params.append(device_id)
+        if plant_id:
+            clauses.append('plant_id = ?')
+            params.append(plant_id)
+        if since:
+            clauses.append('upload_timestamp >= ?')
+            params.append(since)
+        if until:
+            clauses.append('upload_timestamp < ?')
+            params.append(until)
+        if cursor:
+            after_timestamp, after_id = decode_cursor(cursor)
+            op = '<' if descending else '>'
+            clauses.append(f'(upload_timestamp {op} ? OR (upload_timestamp = ? AND id {op} ?))')
+            params.extend([after_timestamp, after_timestamp, after_id])
+
+        direction = 'DESC' if descending else 'ASC'
+        sql = f"SELECT {', '.join(selected)} FROM images"
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += f' ORDER BY upload_timestamp {direction}, id {direction} LIMIT ?'
+        params.append(limit + 1)  # One extra row tells us whether another page exists
+
+        rows = [self._row_to_dict(row) for row in self._connection().execute(sql, params).fetchall()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]['upload_timestamp'], rows[-1]['id'])
+        return rows, next_cursor
+
+    def count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM images').fetchone()[0]
+
+    def migrate_legacy_file(self, legacy_path):
+        """One-shot import of the old ``metadata.json`` list into the database"""
+        # Serialized across processes so only the first one imports
+        with FileLock(self.db_path + '.migrate.lock'):
+            return self._migrate_legacy_file(legacy_path)
+
+    def _migrate_legacy_file(self, legacy_path):
+        if not os.path.exists(legacy_path):
+            return 0
+        try:
+            with open(legacy_path, 'r') as f:
+                legacy = json.load(f)
+        except (ValueError, OSError) as e:
+            print(f"⚠️  Could not read legacy image metadata {legacy_path}: {e}")
+            return 0
+
+        rows = []
+        for metadata in legacy:
+            # Handle both old and new metadata formats
+            record = dict(metadata)
+            record['image_url'] = metadata.get('image_url') or metadata.get('stored_path', '')
+            record.setdefault('storage_type', 'local')
+            record.setdefault('device_id', DEFAULT_DEVICE)
+            rows.append([record.get(column) for column in self.COLUMNS])
+
+        conn = self._connection()
+        with conn:
+            conn.executemany(
+                f"INSERT OR IGNORE INTO images ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                rows
+            )
+            self._bump_generation(conn)
+        os.replace(legacy_path, legacy_path + '.migrated')
+        print(f"✅ Migrated {len(rows)} image metadata records into {self.db_path}")
+        return len(rows)
@@ -0,0 +1,210 @@
+import os
+import json
+import mmap
+import struct
+import threading
+
+from file_lock import FileLock
+
+# magic, slot size, reserved, capacity, head (newest id), tail (oldest id kept)
+HEADER = struct.Struct('<8sIIQQQ')
+HEADER_SIZE = 64
+MAGIC = b'PAIRING1'
+# Each slot starts with the id of the record in it (0 while being written)
+# and the length of the encoded record
+SLOT_HEADER = struct.Struct('<QI')
+
+
+class RecordTooLarge(ValueError):
+    """Raised when an encoded record does not fit in one slot"""
+
+
+class MetricsRing:
+    """Fixed-capacity ring of JSON records in a memory-mapped file.
+
+    The file is a small header followed by ``capacity`` slots of
+    ``slot_size`` bytes. Record ids count up from 1 and record ``n`` lives
+    in slot ``(n - 1) % capacity``, so an append overwrites the oldest
+    record in place: one slot write and a header update under the file
+    lock, whatever the capacity.
+
+    Every process maps the same file, so readers see new records as soon as
+    they are written, without a lock or re-reading the file. A writer clears
+    a slot's id before filling it and sets it last; readers re-check the id
+    after copying a record and skip it if it changed meanwhile.
+    """
+
+    def __init__(self, path, capacity=10000, slot_size=2048):
+        if slot_size <= SLOT_HEADER.size:
+            raise ValueError(f'slot_size must be larger than {SLOT_HEADER.size} bytes')
+        self.path = path
+        self.capacity = capacity
+        self.slot_size = slot_size
+        self._lock_path = path + '.lock'
+        self._lock = threading.Lock()
+
+        with FileLock(self._lock_path):
+            if self._read_layout() != (slot_size, capacity):
+                self._rebuild()
+            with open(path, 'r+b') as f:
+                self._map = mmap.mmap(f.fileno(), 0)
+
+    def _read_layout(self):
+        """``(slot_size, capacity)`` of the existing file, or None"""
+        try:
+            with open(self.path, 'rb') as f:
+                header = f.read(HEADER.size)
+        except OSError:
+            return None
+        if len(header) < HEADER.size:
+            return None
+        magic, slot_size, _, capacity, _, _ = HEADER.unpack(header)
+        return (slot_size, capacity) if magic == MAGIC else None
+
+    def _rebuild(self):
+        """Create the file, carrying over the newest records of an old layout"""
+        records = []
+        head = 0
+        if self._read_layout() is not None:
+            old = MetricsRing.__new__(MetricsRing)
+            old.path = self.path
+            with open(self.path, 'rb') as f:
+                old._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            old.slot_size, old.capacity = self._read_layout()
+            head = old.head()
+            records = old.read(limit=self.capacity)
+            old._map.close()
+
+        # Smaller slots may no longer hold every record
+        encoded = []
+        for record_id, record in records:
+            try:
+                encoded.append((record_id, self._encode(record)))
+            except RecordTooLarge:
+                continue
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.truncate(HEADER_SIZE + self.capacity * self.slot_size)  # Sparse until written
+        with open(tmp_path, 'r+b') as f:
+            mapped = mmap.mmap(f.fileno(), 0)
+            for record_id, data in encoded:
+                self._write_slot(mapped, record_id, data)
+            tail = encoded[0][0] if encoded else head + 1
+            HEADER.pack_into(mapped, 0, MAGIC, self.slot_size, 0, self.capacity, head, tail)
+            mapped.flush()
+            mapped.close()
+        os.replace(tmp_path, self.path)
+        if records:
+            print(f"♻️  Resized metrics ring to {self.capacity} slots, kept {len(encoded)} records")
+
+    def _encode(self, record):
+        data = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        if len(data) > self.slot_size - SLOT_HEADER.size:
+            raise RecordTooLarge(
+                f'Record is {len(data)} bytes; slots hold {self.slot_size - SLOT_HEADER.size}'
+            )
+        return data
+
+    def _slot_offset(self, record_id):
+        return HEADER_SIZE + ((record_id - 1) % self.capacity) * self.slot_size
+
+    def _write_slot(self, mapped, record_id, data):
+        offset = self._slot_offset(record_id)
+        SLOT_HEADER.pack_into(mapped, offset, 0, len(data))
+        mapped[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+        SLOT_HEADER.pack_into(mapped, offset, record_id, len(data))
+
+    def append(self, record):
+        """Store ``record`` (JSON-serializable) and return its id
+
+        Raises RecordTooLarge if it does not fit in a slot.
+        """
+        data = self._encode(record)
+        with self._lock, FileLock(self._lock_path):
+            head = self.head() + 1
+            self._write_slot(self._map, head, data)
+            tail = max(1, head - self.capacity + 1)
+            HEADER.pack_into(self._map, 0, MAGIC, self.slot_size, 0, self.capacity, head, tail)
+        return head
+
+    def head(self):
+        """Id of the newest record (0 when empty)"""
+        return HEADER.unpack_from(self._map, 0)[4]
+
+    def tail(self):
+        """Id of the oldest record still stored"""
+        return HEADER.unpack_from(self._map, 0)[5]
+
+    def __len__(self):
+        return max(0, self.head() - self.tail() + 1)
+
+    def read(self, after=None, limit=None):
+        """``[(id, record), ...]`` oldest first
+
+        Without ``after`` these are the newest ``limit`` records (all kept
+        records without ``limit``); with it, see ``read_after``.
+        """
+        if after is not None:
+            return self.read_after(after, limit)[0]
+        _, _, _, _, head, tail = HEADER.unpack_from(self._map, 0)
+        first = max(tail, head - self.capacity + 1, 1)
+        if limit is not None:
+            first = max(first, head - limit + 1)
+        return self._read_range(first, head)[0]
+
+    def read_after(self, after, limit=None):
+        """Page forward: the oldest ``limit`` records with ids greater than ``after``
+
+        Returns ``(records, next_after, overrun)``. Pass ``next_after`` as
+        ``after`` to get the following page. ``overrun`` is True when some
+        records after ``after`` were overwritten before they could be read,
+        so the reader has missed them; the page then starts at the oldest
+        record still stored.
+        """
+        _, _, _, _, head, tail = HEADER.unpack_from(self._map, 0)
+        first = max(after + 1, tail, head - self.capacity + 1, 1)
+        last = head if limit is None else min(head, first + limit - 1)
+        records, overwritten = self._read_range(first, last)
+        overrun = first > after + 1 or overwritten
+        return records, max(after, last), overrun
+
+    def _read_range(self, first, last):
+        """Records ``first`` to ``last``, and whether any were overwritten meanwhile"""
+        records = []
+        overwritten = False
+        for record_id in range(first, last + 1):
+            offset = self._slot_offset(record_id)
+            stored_id, length = SLOT_HEADER.unpack_from(self._map, offset)
+            if stored_id != record_id:
+                overwritten = True
+                continue
+            data = self._map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+            if SLOT_HEADER.unpack_from(self._map, offset)[0] != record_id:
+                overwritten = True
+                continue
+            records.append((record_id, json.loads(data)))
+        return records, overwritten
+
+    def migrate_legacy_file(self, legacy_path):
+        """One-shot import of the old ``metrics.json`` list into the ring"""
+        with FileLock(self._lock_path + '.migrate'):
+            if not os.path.exists(legacy_path):
+                return 0
+            try:
+                with open(legacy_path, 'r') as f:
+                    legacy = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"⚠️  Could not read legacy metrics {legacy_path}: {e}")
+                return 0
+
+            imported = 0
+            for record in legacy[-self.capacity:]:
+                try:
+                    self.append(record)
+                    imported += 1
+                except RecordTooLarge:
+                    continue
+            os.replace(legacy_path, legacy_path + '.migrated')
+            print(f"✅ Migrated {imported} metrics entries into the metrics ring")
+            return imported
@@ -0,0 +1,157 @@
+import json
+import os
+
+import numpy as np
+
+# Channels the rules look at, in message priority order
+CHANNELS = ['temperature', 'humidity', 'soil_moisture']
+STATUS_COLORS = np.array(['green', 'yellow', 'red'])
+SIDES = ('low', 'ok', 'high')
+
+# Ranges outside which a channel counts as a warning (1 issue point) or as
+# critical (2 points); yellow and red start at these point totals
+DEFAULT_PROFILE = {
+    'temperature': {'critical': [10, 35], 'warning': [15, 30]},
+    'humidity': {'critical': [20, 90], 'warning': [30, 80]},
+    'soil_moisture': {'critical': [10, 90], 'warning': [20, 80]},
+    'yellow_at': 2,
+    'red_at': 4
+}
+
+# SIMPLE_MESSAGES prefix for a channel out of range on the (low, high) side;
+# None falls back to the general message
+MESSAGE_PREFIXES = {
+    'temperature': ('temperature', 'temperature'),
+    'humidity': ('humidity', None),
+    'soil_moisture': ('soil', None)
+}
+
+
+def load_profiles(path=None):
+    """Threshold profiles by plant type: the built-in default plus those in ``path``
+
+    Each profile in the file may leave out channels (or the color cut-offs),
+    which are then taken from its own ``default`` entry or the built-in one.
+    """
+    profiles = {'default': DEFAULT_PROFILE}
+    if path and os.path.exists(path):
+        with open(path, 'r') as f:
+            configured = json.load(f)
+        base = dict(DEFAULT_PROFILE, **configured.get('default', {}))
+        profiles = {'default': base}
+        for name, profile in configured.items():
+            profiles[name] = dict(base, **profile)
+    return profiles
+
+
+class RuleEngine:
+    """Threshold rules for every plant type, compiled into flat arrays
+
+    ``bounds[p, c]`` holds ``(critical low, warning low, warning high,
+    critical high)`` for profile ``p`` and channel ``c``, so classifying a
+    reading is a row lookup and a few comparisons no matter how many
+    profiles exist. Batches go through ``classify``; ``classify_one``
+    applies the same compiled rows to a single reading.
+    """
+
+    def __init__(self, profiles, default='default'):
+        if default not in profiles:
+            raise ValueError(f"Missing default plant profile '{default}'")
+        self.names = list(profiles)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.default_id = self.index[default]
+
+        self.bounds = np.empty((len(self.names), len(CHANNELS), 4), dtype=np.float64)
+        self.yellow_at = np.empty(len(self.names), dtype=np.int8)
+        self.red_at = np.empty(len(self.names), dtype=np.int8)
+        for p, name in enumerate(self.names):
+            profile = profiles[name]
+            for c, channel in enumerate(CHANNELS):
+                (crit_low, crit_high), (warn_low, warn_high) = profile[channel]['critical'], profile[channel]['warning']
+                if not crit_low <= warn_low <= warn_high <= crit_high:
+                    raise ValueError(f"Plant profile '{name}': {channel} warning range must lie inside the critical range")
+                self.bounds[p, c] = (crit_low, warn_low, warn_high, crit_high)
+            self.yellow_at[p] = profile['yellow_at']
+            self.red_at[p] = profile['red_at']
+
+        # Message key for [channel, side (0 low, 1 high), level (0 warning, 1 critical)]
+        self.message_keys = np.array(['healthy', 'general_warning', 'general_critical'] + [
+            f"{prefix}_{level}" if prefix else f"general_{level}"
+            for channel in CHANNELS
+            for prefix in MESSAGE_PREFIXES[channel]
+            for level in ('warning', 'critical')
+        ])
+        self._message_ids = np.arange(3, len(self.message_keys)).reshape(len(CHANNELS), 2, 2)
+
+        # The same tables as plain lists, for single readings without NumPy overhead
+        self._rows = self.bounds.tolist()
+        self._cutoffs = list(zip(self.yellow_at.tolist(), self.red_at.tolist()))
+        self._message_table = self.message_keys[self._message_ids].tolist()
+
+    def profile_id(self, plant_type):
+        """Row of ``plant_type`` (None means the default), or None if unknown"""
+        if plant_type is None:
+            return self.default_id
+        return self.index.get(plant_type)
+
+    def classify(self, columns, profile_ids=None):
+        """Classify readings given as channel columns
+
+        ``profile_ids`` holds a profile row per reading (default profile when
+        None). Returns ``(colors, message_keys, sides)``: arrays of status
+        colors and SIMPLE_MESSAGES keys, and per-channel sides (-1 below the
+        warning range, 0 inside, 1 above) with shape ``(readings, channels)``.
+        """
+        values = np.column_stack([np.asarray(columns[channel], dtype=np.float64) for channel in CHANNELS])
+        rows = np.arange(len(values))
+        if profile_ids is None:
+            profile_ids = np.full(len(values), self.default_id)
+        profile_ids = np.asarray(profile_ids, dtype=np.intp)
+        bounds = self.bounds[profile_ids]
+
+        below = values < bounds[:, :, 1]
+        above = values > bounds[:, :, 2]
+        critical = (values < bounds[:, :, 0]) | (values > bounds[:, :, 3])
+        severity = np.where(critical, 2, below | above).astype(np.int8)
+        score = severity.sum(axis=1)
+        level = (score >= self.yellow_at[profile_ids]).astype(np.int8) + (score >= self.red_at[profile_ids])
+
+        # The message names the first channel at the color's severity
+        hit = severity >= np.where(level == 2, 2, 1)[:, None]
+        first = hit.argmax(axis=1)
+        side = above[rows, first].astype(np.intp)
+        message_ids = self._message_ids[first, side, np.maximum(level - 1, 0)]
+        message_ids = np.where(hit.any(axis=1), message_ids, level)  # general_<level>
+        message_ids = np.where(level == 0, 0, message_ids)
+
+        sides = above.astype(np.int8) - below
+        return STATUS_COLORS[level], self.message_keys[message_ids], sides
+
+    def classify_one(self, reading, plant_type=None):
+        """``(status_color, message_key, {channel: 'low'|'ok'|'high'})`` for one reading
+
+        Same rules as ``classify``, evaluated on the compiled rows directly.
+        Raises KeyError for an unknown ``plant_type``.
+        """
+        profile_id = self.profile_id(plant_type)
+        if profile_id is None:
+            raise KeyError(plant_type)
+        rows = self._rows[profile_id]
+        yellow_at, red_at = self._cutoffs[profile_id]
+
+        severities = []
+        sides = {}
+        for channel, (crit_low, warn_low, warn_high, crit_high) in zip(CHANNELS, rows):
+            value = reading[channel]
+            side = -1 if value < warn_low else 1 if value > warn_high else 0
+            sides[channel] = SIDES[side + 1]
+            severities.append((2 if value < crit_low or value > crit_high else 1 if side else 0, side))
+
+        score = sum(severity for severity, _ in severities)
+        level = 2 if score >= red_at else 1 if score >= yellow_at else 0
+        if level == 0:
+            return 'green', 'healthy', sides
+        for c, (severity, side) in enumerate(severities):
+            if severity >= level:
+                return str(STATUS_COLORS[level]), self._message_table[c][side > 0][level - 1], sides
+        return str(STATUS_COLORS[level]), str(self.message_keys[level]), sides
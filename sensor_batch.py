@@ -0,0 +1,119 @@
+from datetime import datetime
+
+import numpy as np
+
+SENSOR_FIELDS = ['temperature', 'pressure', 'humidity', 'soil_moisture']
+MAX_BATCH_SIZE = 5000
+
+
+class BatchError(ValueError):
+    """Raised when a batch payload is unusable as a whole"""
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def parse_batch(payload):
+    """Turn a batch payload into columns plus per-item errors
+
+    Accepts a list of readings, ``{"readings": [...]}`` or columnar
+    ``{"columns": {"temperature": [...], ...}}``. Returns ``(columns,
+    timestamps, plant_types, errors)`` where ``columns`` maps each sensor
+    field to a float64 array, ``timestamps`` holds an ISO string (or None)
+    per item, ``plant_types`` the optional ``plant_type`` per item and
+    ``errors`` an error message (or None) per item.
+    """
+    if isinstance(payload, dict) and 'columns' in payload:
+        raw_columns = payload['columns']
+        if not isinstance(raw_columns, dict):
+            raise BatchError('columns must be an object of arrays')
+        missing = [field for field in SENSOR_FIELDS if field not in raw_columns]
+        if missing:
+            raise BatchError(f'Missing required columns: {", ".join(missing)}')
+        # Every column we read must be an array; other keys are ignored
+        used = [field for field in SENSOR_FIELDS + ['timestamp', 'plant_type']
+                if raw_columns.get(field) is not None]
+        not_arrays = [field for field in used if not isinstance(raw_columns[field], list)]
+        if not_arrays:
+            raise BatchError(f'Columns must be arrays: {", ".join(not_arrays)}')
+        lengths = {len(raw_columns[field]) for field in used}
+        if len(lengths) != 1:
+            raise BatchError('All columns must be arrays of the same length')
+        size = lengths.pop()
+        raw_timestamps = raw_columns.get('timestamp') or [None] * size
+        raw_plant_types = raw_columns.get('plant_type') or [None] * size
+        readings = None
+    else:
+        readings = payload.get('readings') if isinstance(payload, dict) else payload
+        if not isinstance(readings, list):
+            raise BatchError('Expected a list of readings, {"readings": [...]} or {"columns": {...}}')
+        size = len(readings)
+
+    if size == 0:
+        raise BatchError('Batch is empty')
+    if size > MAX_BATCH_SIZE:
+        raise BatchError(f'Batch too large (max {MAX_BATCH_SIZE} readings)')
+
+    errors = [None] * size
+
+    if readings is not None:
+        # Row-oriented payload: pivot into columns, noting missing fields
+        raw_columns = {field: [None] * size for field in SENSOR_FIELDS}
+        raw_timestamps = [None] * size
+        raw_plant_types = [None] * size
+        for i, reading in enumerate(readings):
+            if not isinstance(reading, dict):
+                errors[i] = 'Reading must be an object'
+                continue
+            missing = [field for field in SENSOR_FIELDS if field not in reading]
+            if missing:
+                errors[i] = f'Missing required fields: {", ".join(missing)}'
+                continue
+            for field in SENSOR_FIELDS:
+                raw_columns[field][i] = reading[field]
+            raw_timestamps[i] = reading.get('timestamp')
+            raw_plant_types[i] = reading.get('plant_type')
+
+    columns = {}
+    valid = np.array([e is None for e in errors])
+    for field in SENSOR_FIELDS:
+        try:
+            column = np.asarray(raw_columns[field], dtype=np.float64)
+        except (ValueError, TypeError):
+            # Slow path only when some value is not numeric
+            column = np.array([_as_float(v) for v in raw_columns[field]], dtype=np.float64)
+        columns[field] = column
+        valid &= np.isfinite(column)
+
+    for i in np.flatnonzero(~valid):
+        if errors[i] is None:
+            errors[i] = 'Invalid data types. All sensor values must be numbers.'
+
+    timestamps = [None] * size
+    for i, ts in enumerate(raw_timestamps):
+        if ts is None or errors[i] is not None:
+            continue
+        try:
+            parsed = datetime.fromisoformat(str(ts))
+            if parsed.tzinfo is not None:
+                # Stored timestamps are naive server-local time
+                parsed = parsed.astimezone().replace(tzinfo=None)
+            timestamps[i] = parsed.isoformat()
+        except ValueError:
+            errors[i] = 'Invalid timestamp. Use ISO 8601 format.'
+
+    plant_types = [None] * size
+    for i, plant_type in enumerate(raw_plant_types):
+        if plant_type is None or errors[i] is not None:
+            continue
+        if not isinstance(plant_type, str):
+            errors[i] = 'plant_type must be a string'
+        else:
+            plant_types[i] = plant_type
+
+    return columns, timestamps, plant_types, errors
+
@@ -0,0 +1,80 @@
+import os
+import json
+import mmap
+import struct
+
+import numpy as np
+
+# File layout: magic, header length, JSON header (padded), then the time
+# column and every value column back to back, each 8-byte aligned
+MAGIC = b'PAICOLS1'
+PREFIX = struct.Struct('<8sI')
+ALIGN = 64
+
+
+def _padded(size, align=8):
+    return (size + align - 1) // align * align
+
+
+def write_columns(path, ts, columns, meta=None):
+    """Write ``ts`` (int64 epoch ms) and named value arrays to a column file
+
+    ``columns`` maps a name to an array of the same length as ``ts``; each
+    keeps its own dtype. ``meta`` is stored in the header as-is. The file is
+    written to a temp name and renamed into place, so readers never see a
+    partial file.
+    """
+    ts = np.ascontiguousarray(ts, dtype=np.int64)
+    arrays = [('ts', ts)] + [(name, np.ascontiguousarray(values)) for name, values in columns.items()]
+
+    layout = []
+    offset = 0
+    for name, values in arrays:
+        layout.append([name, values.dtype.str, offset])
+        offset = _padded(offset + values.nbytes)
+    header = json.dumps({'rows': len(ts), 'columns': layout, 'meta': meta or {}}, separators=(',', ':')).encode('utf-8')
+    data_start = _padded(PREFIX.size + len(header), ALIGN)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREFIX.pack(MAGIC, len(header)))
+        f.write(header)
+        for (_, values), (_, _, column_offset) in zip(arrays, layout):
+            f.seek(data_start + column_offset)
+            f.write(values.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+
+
+def read_header(path):
+    """The ``meta`` and row count of a column file, without mapping its data"""
+    with open(path, 'rb') as f:
+        magic, length = PREFIX.unpack(f.read(PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a sensor column file')
+        header = json.loads(f.read(length))
+    return header['rows'], header['meta']
+
+
+def map_columns(path):
+    """Memory-map a column file as ``(ts, {name: array}, meta)``
+
+    The arrays are read-only views straight onto the page cache: nothing is
+    parsed or copied, and pages are only read when touched. The mapping
+    stays valid after the file is removed.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, length = PREFIX.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a sensor column file')
+    header = json.loads(mapped[PREFIX.size:PREFIX.size + length])
+    data_start = _padded(PREFIX.size + length, ALIGN)
+
+    rows = header['rows']
+    views = {
+        name: np.frombuffer(mapped, dtype=np.dtype(dtype), count=rows, offset=data_start + offset)
+        for name, dtype, offset in header['columns']
+    }
+    ts = views.pop('ts')
+    return ts, views, header['meta']
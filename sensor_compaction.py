@@ -0,0 +1,210 @@
+import os
+import atexit
+import threading
+from datetime import datetime, timedelta
+
+from file_lock import FileLock
+from sensor_store import SensorLogStore
+from sensor_history import (
+    HISTORY_FIELDS, reduce_buckets, epoch_ms_to_iso, parse_duration_seconds
+)
+
+DEFAULT_TIERS = 'raw:24h,1m:7d,1h:forever'
+
+
+def parse_tiers(spec):
+    """Parse ``raw:24h,1m:7d,1h:forever`` into ``[(bucket_seconds, keep_seconds)]``
+
+    The first tier must be ``raw`` (bucket None). ``forever`` (or 0) keeps a
+    tier indefinitely and is only allowed on the last tier.
+    """
+    tiers = []
+    for i, part in enumerate(p.strip() for p in spec.split(',') if p.strip()):
+        try:
+            bucket, keep = part.split(':')
+        except ValueError:
+            raise ValueError(f"Invalid sensor tier '{part}', expected <bucket>:<keep>")
+        if i == 0:
+            if bucket.strip().lower() != 'raw':
+                raise ValueError('The first sensor tier must be raw')
+            bucket_seconds = None
+        else:
+            bucket_seconds = parse_duration_seconds(bucket)
+            previous = tiers[-1][0] or 0
+            if bucket_seconds <= previous or (previous and bucket_seconds % previous):
+                raise ValueError(f"Tier bucket {bucket} must be a multiple of the previous one")
+        keep_seconds = None if keep.strip().lower() in ('forever', '0') else parse_duration_seconds(keep)
+        tiers.append((bucket_seconds, keep_seconds))
+
+    if not tiers:
+        raise ValueError('No sensor tiers configured')
+    if any(keep is None for _, keep in tiers[:-1]):
+        raise ValueError('Only the last sensor tier may be kept forever')
+    return tiers
+
+
+def tier_name(bucket_seconds):
+    """Directory/label for a tier: raw, 1m, 1h, 1d or <n>s"""
+    if bucket_seconds is None:
+        return 'raw'
+    for unit, seconds in (('d', 86400), ('h', 3600), ('m', 60)):
+        if bucket_seconds % seconds == 0:
+            return f"{bucket_seconds // seconds}{unit}"
+    return f"{bucket_seconds}s"
+
+
+class SensorCompactor:
+    """Background downsampling of the sensor log into coarser rollup tiers.
+
+    Each tier keeps data for ``keep`` before its sealed segments are rolled
+    up into the next tier (min/max/sum/last and count per bucket) and
+    removed; the last tier's expired segments are simply dropped. Work is
+    done one sealed segment at a time, outside the ingest lock, so appends
+    never wait on compaction and storage stays bounded by the tier windows.
+    When several server processes run a compactor, a lock file lets only
+    one of them work at a time.
+    """
+
+    def __init__(self, raw_store, rollup_dir, tiers, interval=60, segment_max_readings=5000):
+        """Open one rollup store per non-raw tier under ``rollup_dir``"""
+        self.interval = interval
+        self.tiers = []
+        os.makedirs(rollup_dir, exist_ok=True)
+        self._run_lock = FileLock(os.path.join(rollup_dir, '.compactor.lock'))
+        for bucket_seconds, keep_seconds in tiers:
+            if bucket_seconds is None:
+                store = raw_store
+            else:
+                store = SensorLogStore(
+                    os.path.join(rollup_dir, tier_name(bucket_seconds)),
+                    segment_max_readings=segment_max_readings,
+                    retention_days=0,  # Expiry is handled here
+                    tail_size=1,
+                    rollup=True
+                )
+            self.tiers.append({
+                'name': tier_name(bucket_seconds),
+                'bucket_seconds': bucket_seconds,
+                'keep_seconds': keep_seconds,
+                'store': store
+            })
+
+        self._stop = threading.Event()
+        self._thread = None
+        self.compacted_segments = 0
+        self.dropped_segments = 0
+        self.last_run = None
+        self.last_error = None
+
+    def rollup_stores(self):
+        """Stores of every non-raw tier, finest first"""
+        return [tier['store'] for tier in self.tiers[1:]]
+
+    def start(self):
+        """Start the background compaction loop"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='sensor-compactor', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_safely()
+            self._stop.wait(self.interval)
+
+    def run_safely(self):
+        """``run_once``, recording a failure in ``last_error`` instead of raising"""
+        try:
+            self.run_once()
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ Sensor compaction failed: {e}")
+
+    def run_once(self, now=None):
+        """Compact or expire every segment that has aged out of its tier
+
+        Returns False without doing anything if another process is compacting.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            return False
+        try:
+            self._compact_tiers(now or datetime.now())
+        finally:
+            self._run_lock.release()
+        return True
+
+    def _compact_tiers(self, now):
+        for i, tier in enumerate(self.tiers):
+            if tier['keep_seconds'] is None:
+                continue
+            cutoff = (now - timedelta(seconds=tier['keep_seconds'])).isoformat()
+            store = tier['store']
+            target = self.tiers[i + 1] if i + 1 < len(self.tiers) else None
+
+            # A quiet tier may never fill its active segment; seal it once
+            # its oldest record is due so it can age out like the rest
+            active = store.segments()[-1]
+            if active['count'] and active['min_ts'] < cutoff:
+                store.seal_active()
+
+            for segment in store.segments():
+                if self._stop.is_set():
+                    return
+                if segment.get('active') or segment['count'] == 0 or segment['max_ts'] >= cutoff:
+                    continue
+                if target is not None:
+                    self._compact_segment(tier, target, segment)
+                    self.compacted_segments += 1
+                else:
+                    self.dropped_segments += 1
+                store.remove_segment(segment['seq'])
+        self.last_run = now.isoformat()
+
+    def _compact_segment(self, tier, target, segment):
+        """Roll one sealed segment of ``tier`` up into ``target``"""
+        source_tag = f"{tier['name']}:{segment['seq']}"
+        latest = target['store'].latest()
+        if latest and latest.get('source') == source_tag:
+            # Rolled up before a crash, but not yet removed
+            return
+
+        # Sealed segments are column files: the arrays map straight from disk
+        columns = tier['store'].open_columns(segment['seq'])
+        starts, counts, stats = reduce_buckets(
+            columns.ts, columns.counts, columns.stats(), 0, target['bucket_seconds'] * 1000
+        )
+
+        records = []
+        for j in range(len(starts)):
+            record = {'timestamp': epoch_ms_to_iso(starts[j]), 'count': int(counts[j])}
+            for field in HISTORY_FIELDS:
+                for stat, values in stats[field].items():
+                    record[f"{field}_{stat}"] = round(float(values[j]), 4)
+            record['source'] = source_tag
+            records.append(record)
+        # One write, so the tail record marks the whole segment as done
+        target['store'].append_many(records)
+
+    def describe(self):
+        """Per-tier record counts and compaction counters"""
+        return {
+            'tiers': [
+                {
+                    'name': tier['name'],
+                    'keep_seconds': tier['keep_seconds'],
+                    'records': tier['store'].count(),
+                    'segments': len(tier['store'].segments())
+                }
+                for tier in self.tiers
+            ],
+            'compacted_segments': self.compacted_segments,
+            'dropped_segments': self.dropped_segments,
+            'last_run': self.last_run,
+            'last_error': self.last_error
+        }
@@ -0,0 +1,342 @@
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from sensor_columns import write_columns, map_columns
+
+HISTORY_FIELDS = ['temperature', 'pressure', 'humidity', 'soil_moisture']
+ROLLUP_STATS = ['min', 'max', 'sum', 'last']
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_duration_seconds(value):
+    """Parse a duration given in seconds or as 30s/5m/1h/1d"""
+    value = str(value).strip().lower()
+    if value and value[-1] in DURATION_UNITS:
+        return int(value[:-1]) * DURATION_UNITS[value[-1]]
+    return int(value)
+
+
+def iso_to_epoch_ms(timestamps):
+    """Vectorized ISO-8601 (naive) strings -> int64 epoch milliseconds"""
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.int64)
+    return np.array(timestamps, dtype='datetime64[us]').astype('datetime64[ms]').astype(np.int64)
+
+
+def epoch_ms_to_iso(epoch_ms):
+    return str(np.datetime64(int(epoch_ms), 'ms').astype('datetime64[s]'))
+
+
+def epoch_ms_to_iso_ms(epoch_ms):
+    """Vectorized int64 epoch milliseconds -> millisecond-precision ISO strings"""
+    return np.datetime_as_string(np.asarray(epoch_ms, dtype='datetime64[ms]'), unit='ms')
+
+
+class SegmentColumns:
+    """Sorted column arrays for one log segment
+
+    Raw segments hold one value per field and reading. Rollup segments hold
+    ``<field>_min/_max/_sum/_last`` plus a ``count`` per record, so rollups
+    can be merged again without losing precision.
+
+    The active segment is parsed from its JSON lines (``load``); sealed
+    segments are stored with ``save`` and memory-mapped back with ``open``.
+
+    With ``keep_fields`` the other fields of raw readings (id, the exact
+    timestamp, device_id, plant_type, ...) are kept too and saved as
+    dictionary-encoded columns: an int32 code per row (-1 when a reading
+    lacks the field) and the distinct JSON-encoded values in the header.
+    Readings from a sealed segment then have the same shape as they had in
+    the active one.
+    """
+
+    TEXT_PREFIX = 'field:'
+
+    def __init__(self, rollup=False, keep_fields=False):
+        self.rollup = rollup
+        self.keep_fields = keep_fields and not rollup
+        self.fields = {}  # name -> list of JSON-encoded values (None if absent), per row
+        self.field_codes = {}  # name -> int32 codes into field_values (sealed segments)
+        self.field_values = {}  # name -> distinct JSON-encoded values (sealed segments)
+        self.names = [f"{field}_{stat}" for field in HISTORY_FIELDS for stat in ROLLUP_STATS] \
+            if rollup else list(HISTORY_FIELDS)
+        self.ts = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self.columns = {name: np.empty(0, dtype=np.float64) for name in self.names}
+        self.offset = 0  # Bytes of the segment file already parsed
+        self.records = 0
+        self.last = None  # The last reading appended, and its row after sorting
+        self.last_row = None
+
+    @classmethod
+    def open(cls, path, rollup=False):
+        """Map a sealed segment's column file; the arrays are zero-copy views"""
+        columns = cls(rollup=rollup)
+        ts, views, meta = map_columns(path)
+        columns.ts = ts
+        # Raw readings count once each; a broadcast view costs no memory
+        columns.counts = views.pop('count') if rollup else np.broadcast_to(np.int64(1), ts.shape)
+        for name, values in meta.get('fields', {}).items():
+            columns.field_codes[name] = views.pop(cls.TEXT_PREFIX + name)
+            columns.field_values[name] = values
+        columns.columns = views
+        columns.records = len(ts)
+        columns.last = meta.get('last')
+        columns.last_row = meta.get('last_row')
+        return columns
+
+    def save(self, path, summary=None):
+        """Write the columns as a sealed segment file
+
+        Raw values are stored as float32, rollup statistics as float64 so
+        sums stay exact enough to be merged again. ``summary`` (the segment's
+        index entry) is kept in the header along with the last reading.
+        """
+        dtype = np.float64 if self.rollup else np.float32
+        columns = {name: self.columns[name].astype(dtype) for name in self.names}
+        if self.rollup:
+            columns = dict(count=self.counts, **columns)
+        dictionaries = {}
+        for name, values in self.fields.items():
+            distinct = sorted({value for value in values if value is not None})
+            code_of = {value: code for code, value in enumerate(distinct)}
+            columns[self.TEXT_PREFIX + name] = np.array(
+                [code_of.get(value, -1) for value in values], dtype=np.int32
+            )
+            dictionaries[name] = distinct
+        write_columns(path, self.ts, columns, {
+            'summary': summary,
+            'last': self.last,
+            'last_row': self.last_row,
+            'fields': dictionaries
+        })
+
+    def readings(self):
+        """The rows as reading (or rollup record) dicts, oldest first
+
+        Timestamps come back with millisecond precision. The last reading
+        appended is returned exactly as it was stored, and last.
+        """
+        timestamps = epoch_ms_to_iso_ms(self.ts)
+        values = {name: self.columns[name].astype(np.float64).round(4).tolist() for name in self.names}
+        counts = self.counts.tolist()
+        fields = {name: [json.loads(value) for value in self.field_values[name]] for name in self.field_codes}
+        codes = {name: codes.tolist() for name, codes in self.field_codes.items()}
+        readings = []
+        for i, timestamp in enumerate(timestamps.tolist()):
+            if i == self.last_row:
+                continue
+            reading = {'timestamp': timestamp}
+            if self.rollup:
+                reading['count'] = counts[i]
+            for name in self.names:
+                reading[name] = values[name][i]
+            for name, row_codes in codes.items():
+                if row_codes[i] >= 0:
+                    reading[name] = fields[name][row_codes[i]]
+            readings.append(reading)
+        if self.last is not None:
+            readings.append(self.last)
+        return readings
+
+    def load(self, path):
+        """Parse lines appended to ``path`` since the last call"""
+        readings = []
+        with open(path, 'r') as f:
+            f.seek(self.offset)
+            while True:
+                line = f.readline()
+                if not line or not line.endswith('\n'):
+                    # Stop before a line that is still being written
+                    break
+                self.offset = f.tell()
+                try:
+                    readings.append(json.loads(line))
+                except ValueError:
+                    continue
+        self.extend(readings)
+        return self
+
+    def extend(self, readings):
+        """Append parsed readings, keeping the arrays sorted by time"""
+        if not readings:
+            return
+        ts = iso_to_epoch_ms([r['timestamp'] for r in readings])
+        if self.rollup:
+            counts = np.array([r['count'] for r in readings], dtype=np.int64)
+        else:
+            counts = np.ones(len(readings), dtype=np.int64)
+        self.ts = np.concatenate([self.ts, ts])
+        self.counts = np.concatenate([self.counts, counts])
+        for name in self.names:
+            new_values = np.array([r.get(name, np.nan) for r in readings], dtype=np.float64)
+            self.columns[name] = np.concatenate([self.columns[name], new_values])
+        if self.keep_fields:
+            rows = len(self.ts) - len(readings)
+            for reading in readings:
+                for name in reading:
+                    if name not in self.fields and name not in self.names:
+                        self.fields[name] = [None] * rows
+            for name, values in self.fields.items():
+                values.extend(json.dumps(r[name]) if name in r else None for r in readings)
+        self.records += len(readings)
+        self.last = readings[-1]
+        self.last_row = len(self.ts) - 1
+
+        if len(self.ts) > 1 and np.any(np.diff(self.ts) < 0):
+            # Replayed batches can land out of order
+            order = np.argsort(self.ts, kind='stable')
+            self.ts = self.ts[order]
+            self.counts = self.counts[order]
+            for name in self.names:
+                self.columns[name] = self.columns[name][order]
+            for name, values in self.fields.items():
+                self.fields[name] = [values[i] for i in order]
+            self.last_row = int(np.flatnonzero(order == self.last_row)[0])
+
+    def stats(self, lo=0, hi=None):
+        """Per-field ``{stat: array}`` for rows ``lo:hi``, in rollup form"""
+        stats = {}
+        for field in HISTORY_FIELDS:
+            if self.rollup:
+                stats[field] = {stat: self.columns[f"{field}_{stat}"][lo:hi] for stat in ROLLUP_STATS}
+            else:
+                # A raw reading is a rollup of one
+                values = self.columns[field][lo:hi]
+                stats[field] = {stat: values for stat in ROLLUP_STATS}
+        return stats
+
+
+def reduce_buckets(ts, counts, stats, origin_ms, bucket_ms):
+    """Merge time-sorted rows into fixed-width buckets aligned to ``origin_ms``
+
+    Returns ``(bucket_start_ms, counts, stats)`` for every non-empty bucket,
+    with ``stats`` in the same per-field rollup form as the input.
+    """
+    if len(ts) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), {}
+
+    bucket_ids = (ts - origin_ms) // bucket_ms
+    boundaries = np.flatnonzero(np.diff(bucket_ids)) + 1
+    starts = np.concatenate([[0], boundaries])
+    ends = np.concatenate([boundaries, [len(ts)]])
+
+    reduced = {}
+    for field, columns in stats.items():
+        reduced[field] = {
+            'min': np.minimum.reduceat(columns['min'], starts),
+            'max': np.maximum.reduceat(columns['max'], starts),
+            'sum': np.add.reduceat(columns['sum'], starts),
+            'last': columns['last'][ends - 1]
+        }
+    return origin_ms + bucket_ids[starts] * bucket_ms, np.add.reduceat(counts, starts), reduced
+
+
+class SensorHistory:
+    """Columnar, cached view of the sensor log and its rollups for range queries.
+
+    Sealed segments are column files, memory-mapped as NumPy views without
+    parsing or copying; active segments are parsed incrementally from the
+    byte offset reached last time. Queries pick overlapping segments from
+    each store's index, binary-search the time range inside each one and
+    aggregate per bucket with ``reduceat``.
+    """
+
+    def __init__(self, store, rollup_stores=(), max_cached_segments=64):
+        self.sources = [(store, False)] + [(rollup_store, True) for rollup_store in rollup_stores]
+        self.max_cached_segments = max_cached_segments
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (source index, seq, active) -> SegmentColumns
+
+    def _columns_for(self, source, segment):
+        """Return up-to-date columns for one segment, parsing only new lines"""
+        store, rollup = self.sources[source]
+        active = bool(segment.get('active'))
+        key = (source, segment['seq'], active)
+        with self._lock:
+            columns = self._cache.get(key)
+            if columns is None:
+                columns = SegmentColumns(rollup=rollup) if active else store.open_columns(segment['seq'])
+                self._cache[key] = columns
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_cached_segments:
+                self._cache.popitem(last=False)
+
+            if active and columns.records < segment['count']:
+                columns.load(store.segment_path(segment['seq']))
+            return columns
+
+    def _forget_missing(self, live_keys):
+        with self._lock:
+            for key in list(self._cache):
+                if key not in live_keys:
+                    del self._cache[key]
+
+    def range_columns(self, start_ms, end_ms):
+        """Time-sorted ``(ts, counts, stats)`` for ``start_ms <= ts < end_ms``
+
+        Raw readings and rollup records are returned together, both in
+        rollup form (see ``SegmentColumns.stats``).
+        """
+        start_iso = epoch_ms_to_iso(start_ms)
+        end_iso = epoch_ms_to_iso(end_ms + 1000)  # Index bounds are second-precise strings
+
+        parts = []
+        live_keys = set()
+        for source, (store, _) in enumerate(self.sources):
+            for segment in store.segments():
+                live_keys.add((source, segment['seq'], bool(segment.get('active'))))
+                if segment['count'] == 0 or segment['max_ts'] < start_iso or segment['min_ts'] > end_iso:
+                    continue
+                try:
+                    columns = self._columns_for(source, segment)
+                except FileNotFoundError:
+                    # Compacted or dropped by retention while we were looking
+                    continue
+                lo = np.searchsorted(columns.ts, start_ms, side='left')
+                hi = np.searchsorted(columns.ts, end_ms, side='left')
+                if hi > lo:
+                    parts.append((columns.ts[lo:hi], columns.counts[lo:hi], columns.stats(lo, hi)))
+        self._forget_missing(live_keys)
+
+        if not parts:
+            empty = np.empty(0)
+            return (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64),
+                    {field: {stat: empty for stat in ROLLUP_STATS} for field in HISTORY_FIELDS})
+
+        ts = np.concatenate([part[0] for part in parts])
+        counts = np.concatenate([part[1] for part in parts])
+        stats = {
+            field: {stat: np.concatenate([part[2][field][stat] for part in parts]) for stat in ROLLUP_STATS}
+            for field in HISTORY_FIELDS
+        }
+        if len(parts) > 1 and np.any(np.diff(ts) < 0):
+            order = np.argsort(ts, kind='stable')
+            ts = ts[order]
+            counts = counts[order]
+            stats = {field: {stat: v[order] for stat, v in columns.items()} for field, columns in stats.items()}
+        return ts, counts, stats
+
+
+def aggregate_buckets(ts, counts, stats, start_ms, bucket_ms):
+    """min/max/mean/last per field for each non-empty time bucket
+
+    ``ts`` must be sorted ascending and every value ``>= start_ms``.
+    """
+    starts, bucket_counts, reduced = reduce_buckets(ts, counts, stats, start_ms, bucket_ms)
+
+    buckets = []
+    for i in range(len(starts)):
+        bucket = {'start': epoch_ms_to_iso(starts[i]), 'count': int(bucket_counts[i])}
+        for field, columns in reduced.items():
+            bucket[field] = {
+                'min': round(float(columns['min'][i]), 3),
+                'max': round(float(columns['max'][i]), 3),
+                'mean': round(float(columns['sum'][i] / bucket_counts[i]), 3),
+                'last': round(float(columns['last'][i]), 3)
+            }
+        buckets.append(bucket)
+    return buckets
@@ -0,0 +1,461 @@
+import os
+import json
+import threading
+from contextlib import contextmanager
+from collections import deque
+from datetime import datetime, timedelta
+
+from file_lock import FileLock
+from sensor_columns import read_header
+from sensor_history import SegmentColumns
+
+
+class SensorLogStore:
+    """Append-only, segmented local store for sensor readings.
+
+    Readings are written as one compact JSON object per line to the active
+    segment file. When a segment reaches ``segment_max_readings`` it is sealed:
+    converted to a column file (``SegmentColumns.save``: an int64 epoch-ms
+    column plus one float column per field, about a tenth of the JSON size)
+    and recorded in ``index.json`` together with its min/max timestamps, so
+    startup never has to rescan sealed segments and range queries can skip
+    them. Retention drops whole sealed segments instead of rewriting any file.
+
+    ``rollup`` marks a store of rollup records (see ``SegmentColumns``).
+
+    Several processes may share one log: every operation holds a lock file
+    and first catches up with what other processes appended, rotated or
+    removed (``_sync``), so counts, rotation and the index stay consistent.
+    """
+
+    SEGMENT_PREFIX = 'segment_'
+    SEGMENT_SUFFIX = '.jsonl'
+    COLUMNS_SUFFIX = '.cols'
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = '.lock'
+
+    def __init__(self, base_dir, segment_max_readings=5000, retention_days=180, tail_size=1000, rollup=False):
+        """Open (or create) the log in ``base_dir`` and load the tail index"""
+        self.base_dir = base_dir
+        self.segment_max_readings = segment_max_readings
+        self.retention_days = retention_days
+        self.rollup = rollup
+
+        self._lock = threading.Lock()
+        self._tail = deque(maxlen=tail_size)
+        self._segments = []  # sealed segments: {'seq', 'count', 'min_ts', 'max_ts'}
+        self._active = None  # {'seq', 'count', 'min_ts', 'max_ts'}
+        self._active_file = None
+        self._active_offset = 0  # Bytes of the active segment reflected in memory
+        self._index_stamp = None  # (inode, mtime) of index.json when last read
+        self._pid = os.getpid()
+
+        os.makedirs(self.base_dir, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(self.base_dir, self.LOCK_FILE))
+        with self._file_lock:
+            self._load()
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread and cross-process locks, with state caught up"""
+        with self._lock, self._file_lock:
+            self._sync()
+            yield
+
+    def segment_path(self, seq):
+        """Return the JSON lines path of segment ``seq`` (the active segment's format)"""
+        return os.path.join(self.base_dir, f"{self.SEGMENT_PREFIX}{seq:06d}{self.SEGMENT_SUFFIX}")
+
+    def columns_path(self, seq):
+        """Return the column file path of sealed segment ``seq``"""
+        return os.path.join(self.base_dir, f"{self.SEGMENT_PREFIX}{seq:06d}{self.COLUMNS_SUFFIX}")
+
+    def open_columns(self, seq):
+        """Memory-mapped columns of sealed segment ``seq``"""
+        return SegmentColumns.open(self.columns_path(seq), rollup=self.rollup)
+
+    def _index_path(self):
+        return os.path.join(self.base_dir, self.INDEX_FILE)
+
+    def _list_segment_seqs(self):
+        """List segment sequence numbers present on disk, oldest first"""
+        seqs = set()
+        for name in os.listdir(self.base_dir):
+            if not name.startswith(self.SEGMENT_PREFIX):
+                continue
+            for suffix in (self.SEGMENT_SUFFIX, self.COLUMNS_SUFFIX):
+                if name.endswith(suffix):
+                    try:
+                        seqs.add(int(name[len(self.SEGMENT_PREFIX):-len(suffix)]))
+                    except ValueError:
+                        pass
+        return sorted(seqs)
+
+    def _newest_seq(self):
+        """Sequence number of the segment other processes are appending to"""
+        seqs = self._list_segment_seqs()
+        if not seqs:
+            return self._active['seq']
+        if os.path.exists(self.segment_path(seqs[-1])):
+            return seqs[-1]
+        # Sealed but its successor not created yet (a crash mid-rotation)
+        return seqs[-1] + 1
+
+    def _save_index(self):
+        """Persist the sealed segment index (small, rewritten only on rotation)"""
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'segments': self._segments}, f)
+        os.replace(tmp_path, self._index_path())
+        self._index_stamp = self._stat_index()
+
+    def _stat_index(self):
+        try:
+            stat = os.stat(self._index_path())
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def _sync(self):
+        """Catch up with changes other processes made to the log
+
+        Called with the file lock held, so nobody is mid-write.
+        """
+        # Forked: the inherited handle shares its file position with the parent
+        forked = self._pid != os.getpid()
+        self._pid = os.getpid()
+        reseed = False
+
+        stamp = self._stat_index()
+        if stamp != self._index_stamp:
+            # Rotated, compacted or expired elsewhere
+            with open(self._index_path(), 'r') as f:
+                self._segments = json.load(f).get('segments', [])
+            self._index_stamp = stamp
+
+            # Every rotation rewrites the index; sealed segments are column
+            # files by now, so look for the newest segment in either format
+            newest = self._newest_seq()
+            if newest > self._active['seq']:
+                self._active_file.close()
+                self._tail.clear()  # Refilled below, with what was sealed meanwhile
+                self._open_active(newest, [])
+                self._active_offset = 0  # Read whatever others already wrote to it
+                forked = False
+                reseed = True
+
+        if forked:
+            self._active_file = open(self.segment_path(self._active['seq']), 'ab')
+
+        # Lines other processes appended to the active segment
+        path = self.segment_path(self._active['seq'])
+        if os.path.getsize(path) > self._active_offset:
+            with open(path, 'rb') as f:
+                f.seek(self._active_offset)
+                data = f.read()
+            complete = data[:data.rfind(b'\n') + 1]
+            readings = self._parse_lines(complete.decode('utf-8'))
+            self._widen(self._active, readings)
+            self._active['count'] += len(readings)
+            self._tail.extend(readings)
+            self._active_offset += len(complete)
+            if len(complete) < len(data):
+                # A writer died mid-line; drop the fragment so it cannot
+                # merge with the next append
+                os.truncate(path, self._active_offset)
+
+        if reseed:
+            self._seed_tail()
+
+    def _parse_lines(self, text):
+        readings = []
+        for line in text.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                readings.append(json.loads(line))
+            except ValueError:
+                # A torn final line from a crash mid-write; skip it
+                continue
+        return readings
+
+    def _scan_segment(self, seq):
+        """Read a segment file and return its summary and readings"""
+        if os.path.exists(self.columns_path(seq)):
+            readings = self.open_columns(seq).readings()
+        else:
+            with open(self.segment_path(seq), 'r') as f:
+                readings = self._parse_lines(f.read())
+        summary = {'seq': seq, 'count': len(readings), 'min_ts': None, 'max_ts': None}
+        self._widen(summary, readings)
+        return summary, readings
+
+    def _seal_segment(self, seq, summary=None):
+        """Convert segment ``seq`` from JSON lines to a column file
+
+        The column file is renamed into place before the JSON file is
+        removed, so a crash in between leaves both and the next load just
+        removes the leftover. Returns the segment's summary.
+        """
+        path = self.segment_path(seq)
+        if os.path.exists(self.columns_path(seq)):
+            if os.path.exists(path):
+                os.remove(path)
+            if summary is None:
+                _, meta = read_header(self.columns_path(seq))
+                summary = meta.get('summary')
+            return summary
+
+        columns = SegmentColumns(rollup=self.rollup, keep_fields=True).load(path)
+        if summary is None:
+            _, readings = self._scan_segment(seq)
+            summary = {'seq': seq, 'count': len(readings), 'min_ts': None, 'max_ts': None}
+            self._widen(summary, readings)
+        columns.save(self.columns_path(seq), summary)
+        os.remove(path)
+        return summary
+
+    def _widen(self, summary, readings):
+        """Extend a segment summary's time bounds to cover ``readings``
+
+        Replayed batches can arrive out of order, so bounds are min/max
+        timestamps rather than first/last lines.
+        """
+        if not readings:
+            return
+        timestamps = [r['timestamp'] for r in readings]
+        low, high = min(timestamps), max(timestamps)
+        if summary['min_ts'] is None or low < summary['min_ts']:
+            summary['min_ts'] = low
+        if summary['max_ts'] is None or high > summary['max_ts']:
+            summary['max_ts'] = high
+
+    def _load(self):
+        """Rebuild in-memory state from the index and the active segment"""
+        seqs = self._list_segment_seqs()
+
+        indexed = {}
+        if os.path.exists(self._index_path()):
+            try:
+                with open(self._index_path(), 'r') as f:
+                    for segment in json.load(f).get('segments', []):
+                        indexed[segment['seq']] = segment
+            except (ValueError, OSError) as e:
+                print(f"⚠️  Sensor log index unreadable, rebuilding: {e}")
+                indexed = {}
+
+        if not seqs:
+            self._segments = []
+            self._open_active(1, [])
+            self._save_index()
+            return
+
+        # The newest segment is active unless it was sealed already (a crash
+        # right after sealing); a fresh active segment then follows it
+        if os.path.exists(self.columns_path(seqs[-1])):
+            seqs.append(seqs[-1] + 1)
+
+        # Every segment but the newest is sealed; rescan only the ones the
+        # index does not know about (e.g. after a crash during rotation), and
+        # convert any still in JSON lines (written before column files)
+        sealed = []
+        index_changed = False
+        for seq in seqs[:-1]:
+            if os.path.exists(self.segment_path(seq)):
+                summary = self._seal_segment(seq, indexed.get(seq))
+            else:
+                summary = indexed.get(seq) or read_header(self.columns_path(seq))[1].get('summary') \
+                    or self._scan_segment(seq)[0]
+            sealed.append(summary)
+            if indexed.get(seq) != summary:
+                index_changed = True
+        self._segments = sealed
+        if index_changed or len(indexed) != len(sealed) or not os.path.exists(self._index_path()):
+            self._save_index()
+        self._index_stamp = self._stat_index()
+
+        active_seq = seqs[-1]
+        path = self.segment_path(active_seq)
+        if not os.path.exists(path):
+            open(path, 'ab').close()
+        with open(path, 'rb') as f:
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]
+        if len(complete) < len(data):
+            # Drop a torn final line so the next append starts on a fresh line
+            os.truncate(path, len(complete))
+        self._open_active(active_seq, self._parse_lines(complete.decode('utf-8')))
+        self._seed_tail()
+
+    def _seed_tail(self):
+        """Fill the tail from the newest sealed segment if the active one is short"""
+        if len(self._tail) < self._tail.maxlen and self._segments:
+            previous = self.open_columns(self._segments[-1]['seq'])
+            missing = self._tail.maxlen - len(self._tail)
+            # Rollup stores keep a tail of one: the stored last record will do
+            readings = [previous.last] if missing == 1 and previous.last else previous.readings()
+            self._tail.extendleft(reversed(readings[-missing:]))
+
+    def _open_active(self, seq, readings):
+        """Make ``seq`` the active segment, seeded with its existing readings"""
+        self._active = {'seq': seq, 'count': len(readings), 'min_ts': None, 'max_ts': None}
+        self._widen(self._active, readings)
+        self._active_file = open(self.segment_path(seq), 'ab')
+        self._active_offset = self._active_file.seek(0, os.SEEK_END)
+        self._tail.extend(readings)
+
+    def _rotate(self):
+        """Seal the active segment and start a new one"""
+        self._active_file.close()
+        self._seal_segment(self._active['seq'], dict(self._active))
+        self._segments.append(dict(self._active))
+        self._open_active(self._active['seq'] + 1, [])
+        self._apply_retention()
+        self._save_index()
+
+    def _apply_retention(self):
+        """Drop whole sealed segments whose newest reading is past retention"""
+        if not self.retention_days:
+            return
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).isoformat()
+        while self._segments and (self._segments[0]['max_ts'] or '') < cutoff:
+            expired = self._segments.pop(0)
+            try:
+                self._remove_files(expired['seq'])
+            except OSError as e:
+                print(f"⚠️  Could not remove expired sensor segment {expired['seq']}: {e}")
+
+    def _write(self, readings):
+        """Append readings to the active segment, rotating as segments fill"""
+        start = 0
+        while start < len(readings):
+            room = self.segment_max_readings - self._active['count']
+            if room <= 0:
+                self._rotate()
+                continue
+            chunk = readings[start:start + room]
+            self._active_file.write(
+                ''.join(json.dumps(r, separators=(',', ':')) + '\n' for r in chunk).encode('utf-8')
+            )
+            self._active_file.flush()
+            self._active_offset = self._active_file.tell()
+
+            self._widen(self._active, chunk)
+            self._active['count'] += len(chunk)
+            self._tail.extend(chunk)
+            start += len(chunk)
+
+            if self._active['count'] >= self.segment_max_readings:
+                self._rotate()
+
+    def append(self, reading):
+        """Append a single reading in O(1)"""
+        with self._locked():
+            self._write([reading])
+        return reading
+
+    def append_many(self, readings):
+        """Append several readings with a single write per touched segment"""
+        if not readings:
+            return readings
+        with self._locked():
+            self._write(list(readings))
+        return readings
+
+    def latest(self):
+        """Return the most recent reading, or None if the log is empty"""
+        with self._locked():
+            return self._tail[-1] if self._tail else None
+
+    def tail(self, n=None):
+        """Return up to ``n`` of the most recent readings, oldest first"""
+        with self._locked():
+            readings = list(self._tail)
+        return readings if n is None else readings[-n:]
+
+    def count(self):
+        """Total number of readings currently retained"""
+        with self._locked():
+            return sum(s['count'] for s in self._segments) + self._active['count']
+
+    def segments(self):
+        """Snapshot of the segment index, including the active segment"""
+        with self._locked():
+            return [dict(s) for s in self._segments] + [dict(self._active, active=True)]
+
+    def seal_active(self):
+        """Seal the active segment now, if it holds any readings"""
+        with self._locked():
+            if self._active['count'] == 0:
+                return False
+            self._rotate()
+            return True
+
+    def remove_segment(self, seq):
+        """Drop one sealed segment (e.g. after it was compacted elsewhere)"""
+        with self._locked():
+            if not any(s['seq'] == seq for s in self._segments):
+                return False
+            # File first: a crash in between leaves a stale index entry, which
+            # the next load discards, never a segment that comes back to life
+            self._remove_files(seq)
+            self._segments = [s for s in self._segments if s['seq'] != seq]
+            self._save_index()
+        return True
+
+    def _remove_files(self, seq):
+        for path in (self.columns_path(seq), self.segment_path(seq)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def iter_readings(self, start=None, end=None):
+        """Yield readings with ``start <= timestamp <= end`` (ISO strings)
+
+        Readings come out in append order. Segments whose time range does not
+        overlap the query are skipped without being opened.
+        """
+        for segment in self.segments():
+            if segment['count'] == 0:
+                continue
+            if start and segment['max_ts'] < start:
+                continue
+            if end and segment['min_ts'] > end:
+                continue
+            try:
+                _, readings = self._scan_segment(segment['seq'])
+            except FileNotFoundError:
+                # Dropped by retention between the snapshot and the read
+                continue
+            for reading in readings:
+                ts = reading['timestamp']
+                if (start and ts < start) or (end and ts > end):
+                    continue
+                yield reading
+
+    def migrate_legacy_file(self, legacy_path):
+        """One-shot import of the old ``sensor_data.json`` list into the log"""
+        # Serialized across processes so only the first one imports
+        with FileLock(os.path.join(self.base_dir, '.migrate.lock')):
+            if not os.path.exists(legacy_path):
+                return 0
+            try:
+                with open(legacy_path, 'r') as f:
+                    legacy = json.load(f)
+            except (ValueError, OSError) as e:
+                print(f"⚠️  Could not read legacy sensor data {legacy_path}: {e}")
+                return 0
+
+            if self.count() > 0:
+                # Already imported (or written to) before; keep the file for reference
+                os.replace(legacy_path, legacy_path + '.migrated')
+                print(f"⚠️  Sensor log already has readings, skipped importing {len(legacy)} from {legacy_path}")
+                return 0
+
+            if legacy:
+                self.append_many(legacy)
+            os.replace(legacy_path, legacy_path + '.migrated')
+            print(f"✅ Migrated {len(legacy)} sensor readings into the segmented log")
+            return len(legacy)
@@ -31,5 +31,10 @@ echo ""
 echo "Press Ctrl+C to stop the server"
 echo "================================"
 
+# Start the app: ./start.sh --production runs one gunicorn worker per core
+if [ "$1" = "--production" ]; then
+    exec gunicorn -c gunicorn.conf.py wsgi:application
+fi
+
 # Start the Flask app
 python app.py
@@ -1,7 +1,13 @@
 import os
 import json
+import time
+import threading
+import requests
 from datetime import datetime
 from dotenv import load_dotenv
+from write_behind import WriteBehindBuffer, BufferFull
+from instrumentation import timed, stage, record_error
+from file_lock import FileLock
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,16 +20,50 @@ except ImportError:
     SUPABASE_AVAILABLE = False
     print("⚠️  Supabase dependencies not installed. Install with: pip install supabase postgrest")
 
+# Columns of the sensor_readings table; other reading fields (e.g. the local
+# timestamp) stay in the local log
+SENSOR_COLUMNS = ('id', 'temperature', 'pressure', 'humidity', 'soil_moisture', 'ai_reply', 'status_color',
+                  'source', 'plant_type', 'device_id', 'plant_id')
+
+# PostgREST/PostgreSQL error codes that retrying cannot fix: bad data (22),
+# constraint violations (23), unknown columns or tables (42) and rejected
+# requests (PGRST1xx, PGRST2xx)
+PERMANENT_ERROR_PREFIXES = ('22', '23', '42', 'PGRST1', 'PGRST2')
+
+
+def is_permanent_error(error):
+    """Whether a failed Supabase call would fail again however often it is retried"""
+    return str(getattr(error, 'code', '') or '').startswith(PERMANENT_ERROR_PREFIXES)
+
+
+def sensor_row(reading):
+    """The part of a reading that maps onto sensor_readings columns"""
+    return {key: value for key, value in reading.items() if key in SENSOR_COLUMNS}
+
 class SupabaseStorage:
     def __init__(self):
-        """Initialize Supabase Storage and Database"""
+        """Read the Supabase configuration
+        
+        Nothing touches the network here: the client is created on first use
+        and connectivity is checked by ``check_health`` (periodically, once
+        ``start_health_probe`` runs), so importing this module never blocks.
+        """
         self.supabase_url = os.environ.get('SUPABASE_URL')
         self.supabase_key = os.environ.get('SUPABASE_ANON_KEY')
         self.supabase_service_key = os.environ.get('SUPABASE_SERVICE_KEY')
         self.database_url = os.environ.get('DATABASE_URL')
         
-        self.client = None
+        self._client = None
+        self._client_lock = threading.Lock()
         self.initialized = False
+        self.sensor_buffer = None
+        self.outbox = None
+        self._outbox_handlers = {}
+        self.dead_letter_path = None
+        self.max_attempts = int(os.environ.get('SUPABASE_MAX_ATTEMPTS', 5))
+        self.health = {'status': 'disabled', 'checked_at': None, 'latency_ms': None, 'error': None}
+        self._health_stop = threading.Event()
+        self._health_thread = None
         
         if not SUPABASE_AVAILABLE:
             print("⚠️  Supabase dependencies not available, using local storage")
@@ -34,30 +74,68 @@ class SupabaseStorage:
             print("💡 Set SUPABASE_URL and SUPABASE_ANON_KEY environment variables")
             return
             
-        try:
-            # Initialize Supabase client
-            self.client = create_client(self.supabase_url, self.supabase_key)
-            self.initialized = True
-            print(f"✅ Supabase initialized successfully!")
-            print(f"🔗 URL: {self.supabase_url}")
-            
-            # Test connection
-            self._test_connection()
-            
-        except Exception as e:
-            print(f"❌ Supabase initialization failed: {e}")
-            print("⚠️  Falling back to local storage")
+        self.initialized = True
+        self.health = dict(self.health, status='unknown')
+        print(f"✅ Supabase configured (connects on first use)")
+        print(f"🔗 URL: {self.supabase_url}")
+    
+    @property
+    def client(self):
+        """The Supabase client, created on first access
+        
+        Each server process builds its own, since a preloaded client's
+        connections must not be shared across a fork.
+        """
+        if self._client is None and self.initialized:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = create_client(self.supabase_url, self.supabase_key)
+        return self._client
     
-    def _test_connection(self):
-        """Test Supabase connection"""
+    def check_health(self):
+        """Run a minimal query against Supabase and cache the outcome in ``self.health``"""
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return self.health
+        
+        start = time.perf_counter()
         try:
-            # Try to query a simple table or create test table
-            result = self.client.table('plant_images').select('*').limit(1).execute()
-            print("✅ Supabase connection test successful")
+            with stage('supabase.health_probe'):
+                self.client.table('plant_images').select('id').limit(1).execute()
+            status, error = 'ok', None
         except Exception as e:
-            print(f"⚠️  Supabase connection test failed: {e}")
-            print("💡 This is normal if tables don't exist yet")
+            status, error = 'down', str(e)
+        
+        previous = self.health['status']
+        self.health = {
+            'status': status,
+            'checked_at': datetime.now().isoformat(),
+            'latency_ms': round((time.perf_counter() - start) * 1000, 1),
+            'error': error
+        }
+        if status != previous:
+            if status == 'ok':
+                print("✅ Supabase connection healthy")
+            else:
+                print(f"⚠️  Supabase health check failed: {error}")
+        return self.health
+    
+    def start_health_probe(self, interval=30.0):
+        """Re-check Supabase every ``interval`` seconds in a background thread"""
+        if not self.initialized or self._health_thread is not None:
+            return
+        
+        def probe_loop():
+            while not self._health_stop.is_set():
+                self.check_health()
+                self._health_stop.wait(interval)
+        
+        self._health_thread = threading.Thread(target=probe_loop, name='supabase-health', daemon=True)
+        self._health_thread.start()
+    
+    def stop_health_probe(self):
+        self._health_stop.set()
     
+    @timed('supabase.upload_image')
     def upload_image(self, file_data, filename, content_type):
         """Upload image to Supabase Storage"""
         if not self.initialized or not SUPABASE_AVAILABLE:
@@ -87,8 +165,54 @@ class SupabaseStorage:
             
         except Exception as e:
             print(f"❌ Supabase upload failed: {e}")
+            record_error('supabase.upload_image')
             return None
     
+    @timed('supabase.upload_image_file')
+    def upload_image_file(self, local_path, filename, content_type, upsert=False):
+        """Stream an image file from disk to Supabase Storage
+        
+        The body is sent straight from the file in small blocks, so memory
+        use does not grow with the image size. ``upsert`` overwrites an
+        existing object, which makes a retried upload harmless.
+        """
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return None
+            
+        try:
+            bucket_name = "plant-images"
+            file_path = f"uploads/{filename}"
+            
+            with open(local_path, 'rb') as f:
+                response = requests.post(
+                    f"{self.supabase_url}/storage/v1/object/{bucket_name}/{file_path}",
+                    data=f,
+                    headers={
+                        'apikey': self.supabase_key,
+                        'Authorization': f"Bearer {self.supabase_key}",
+                        'Content-Type': content_type,
+                        'x-upsert': 'true' if upsert else 'false'
+                    },
+                    timeout=60
+                )
+            response.raise_for_status()
+            
+            # Get public URL
+            public_url = self.client.storage.from_(bucket_name).get_public_url(file_path)
+            
+            print(f"✅ Image streamed to Supabase: {public_url}")
+            return {
+                'url': public_url,
+                'file_path': file_path,
+                'bucket': bucket_name
+            }
+            
+        except Exception as e:
+            print(f"❌ Supabase upload failed: {e}")
+            record_error('supabase.upload_image_file')
+            return None
+    
+    @timed('supabase.delete_image')
     def delete_image(self, file_path):
         """Delete image from Supabase Storage"""
         if not self.initialized or not SUPABASE_AVAILABLE:
@@ -101,6 +225,27 @@ class SupabaseStorage:
             return True
         except Exception as e:
             print(f"❌ Supabase delete failed: {e}")
+            record_error('supabase.delete_image')
+            return False
+    
+    @timed('supabase.download_image_to')
+    def download_image_to(self, file_path, dest_path, chunk_size=64 * 1024):
+        """Stream an image from Supabase Storage into a local file"""
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return False
+            
+        try:
+            bucket_name = "plant-images"
+            url = self.client.storage.from_(bucket_name).get_public_url(file_path)
+            with requests.get(url, stream=True, timeout=60) as response:
+                response.raise_for_status()
+                with open(dest_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+            return True
+        except Exception as e:
+            print(f"❌ Failed to download image from Supabase: {e}")
+            record_error('supabase.download_image_to')
             return False
     
     def get_image_url(self, file_path):
@@ -115,32 +260,224 @@ class SupabaseStorage:
             print(f"❌ Failed to get image URL: {e}")
             return None
     
+    def enable_write_behind(self, spool_dir, max_items=10000, flush_size=500, max_delay=2.0, put_timeout=0):
+        """Buffer sensor inserts locally and send them in bulk from a background thread
+        
+        Batches that keep failing move to the outbox (or, for errors a retry
+        cannot fix, to the dead-letter file), and so do readings that find
+        the buffer full, so a Supabase backlog never holds up local ingest.
+        """
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return None
+        if self.sensor_buffer is None:
+            self.sensor_buffer = WriteBehindBuffer(
+                self._flush_sensor_rows,
+                spool_dir,
+                max_items=max_items,
+                flush_size=flush_size,
+                max_delay=max_delay,
+                put_timeout=put_timeout,
+                name='sensor-readings',
+                max_attempts=self.max_attempts,
+                on_give_up=self._set_aside_sensor_rows
+            )
+            self.sensor_buffer.start()
+            print(f"✅ Sensor write-behind enabled (flush every {flush_size} rows or {max_delay}s)")
+        return self.sensor_buffer
+    
+    def enable_outbox(self, spool_dir, handlers=None, max_items=100000, flush_size=500, max_delay=2.0):
+        """Keep failed writes in a spooled outbox and replay them in bulk
+        
+        Entries are ``{'kind': ..., 'data': ...}``. Sensor rows are replayed
+        here with one upsert per batch; ``handlers`` maps any other kind to a
+        function that replays a list of ``data`` items and raises on failure.
+        A failed replay is retried with exponential backoff, so the backlog
+        drains once Supabase is reachable again; a batch rejected with an
+        error a retry cannot fix goes to the dead-letter file instead.
+        """
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return None
+        if self.outbox is None:
+            self._outbox_handlers = dict(handlers or {}, sensor_readings=self._upsert_sensor_rows)
+            self.outbox = WriteBehindBuffer(
+                self._replay_outbox,
+                spool_dir,
+                max_items=max_items,
+                flush_size=flush_size,
+                max_delay=max_delay,
+                put_timeout=0,
+                name='supabase-outbox',
+                max_attempts=self.max_attempts,
+                on_give_up=self._set_aside_outbox_entries
+            )
+            self.outbox.start()
+        return self.outbox
+    
+    def add_to_outbox(self, kind, items):
+        """Record writes that failed so the outbox replays them later"""
+        if self.outbox is None:
+            return False
+        try:
+            self.outbox.put_many({'kind': kind, 'data': item} for item in items)
+            print(f"📮 Queued {len(items)} {kind} for replay to Supabase")
+            return True
+        except BufferFull as e:
+            print(f"❌ Supabase outbox full, dropping {len(items)} {kind}: {e}")
+            record_error('supabase.outbox')
+            return False
+    
+    def enable_dead_letter(self, path):
+        """Append writes Supabase rejected for good to ``path`` (JSON lines)"""
+        self.dead_letter_path = path
+    
+    def add_to_dead_letter(self, kind, items, error):
+        """Keep rejected writes for inspection; True once they are written"""
+        if self.dead_letter_path is None:
+            print(f"❌ Dropping {len(items)} {kind} that Supabase rejected: {error}")
+            return True
+        entry_time = datetime.now().isoformat()
+        lines = ''.join(
+            json.dumps({'kind': kind, 'error': str(error), 'failed_at': entry_time, 'data': item},
+                       separators=(',', ':')) + '\n'
+            for item in items
+        )
+        with FileLock(self.dead_letter_path + '.lock'):
+            with open(self.dead_letter_path, 'a') as f:
+                f.write(lines)
+        record_error('supabase.dead_letter')
+        print(f"🪦 Moved {len(items)} {kind} that Supabase rejected to {self.dead_letter_path}: {error}")
+        return True
+    
+    def _set_aside_sensor_rows(self, rows, error):
+        """Give-up handler of the write-behind buffer"""
+        if not is_permanent_error(error) and self.add_to_outbox('sensor_readings', rows):
+            return True
+        return self.add_to_dead_letter('sensor_readings', rows, error)
+    
+    def _set_aside_outbox_entries(self, entries, error):
+        """Give-up handler of the outbox: only errors a retry cannot fix"""
+        if not is_permanent_error(error):
+            return False
+        by_kind = {}
+        for entry in entries:
+            by_kind.setdefault(entry['kind'], []).append(entry['data'])
+        for kind, items in by_kind.items():
+            self.add_to_dead_letter(kind, items, error)
+        return True
+    
+    def outbox_status(self):
+        """Backlog size and replay progress of the outbox"""
+        if self.outbox is None:
+            return {'enabled': False, 'pending': 0}
+        return {
+            'enabled': True,
+            'pending': self.outbox.depth(),
+            'replayed_total': self.outbox.flushed_total,
+            'failed_replays': self.outbox.failed_flushes,
+            'dead_lettered': self.outbox.given_up_total,
+            'last_error': self.outbox.last_error
+        }
+    
+    @timed('supabase.outbox_replay')
+    def _replay_outbox(self, entries):
+        """Flush function of the outbox: one bulk call per kind (raises on failure)"""
+        by_kind = {}
+        for entry in entries:
+            by_kind.setdefault(entry['kind'], []).append(entry['data'])
+        for kind, items in by_kind.items():
+            handler = self._outbox_handlers.get(kind)
+            if handler is None:
+                print(f"⚠️  Dropping {len(items)} outbox entries of unknown kind '{kind}'")
+                continue
+            handler(items)
+            print(f"✅ Replayed {len(items)} {kind} from the outbox")
+    
+    @timed('supabase.upsert_sensor_rows')
+    def _upsert_sensor_rows(self, rows):
+        """Idempotent bulk insert: rows carry their ids, so a replay never duplicates one"""
+        result = self.client.table('sensor_readings').upsert(
+            [sensor_row(row) for row in rows], on_conflict='id'
+        ).execute()
+        return result.data
+    
+    def _flush_sensor_rows(self, rows):
+        """Flush function of the write-behind buffer (raises on failure)"""
+        data = self._upsert_sensor_rows(rows)
+        print(f"✅ {len(rows)} sensor readings flushed to Supabase")
+        return data
+    
+    @timed('supabase.save_sensor_data')
     def save_sensor_data(self, sensor_data):
-        """Save sensor data to Supabase database"""
+        """Save sensor data to Supabase database
+        
+        With write-behind enabled the reading is spooled and returned
+        immediately (queued in the outbox while the buffer is full).
+        """
         if not self.initialized or not SUPABASE_AVAILABLE:
             return None
+        
+        if self.sensor_buffer is not None:
+            return self._buffer_sensor_rows([sensor_data])[0]
             
         try:
             # Insert sensor data into database
-            result = self.client.table('sensor_readings').insert(sensor_data).execute()
+            result = self.client.table('sensor_readings').insert(sensor_row(sensor_data)).execute()
             print(f"✅ Sensor data saved to Supabase: {result.data}")
             return result.data[0] if result.data else None
         except Exception as e:
             print(f"❌ Failed to save sensor data: {e}")
+            record_error('supabase.save_sensor_data')
+            self.add_to_outbox('sensor_readings', [sensor_data])
+            return None
+    
+    @timed('supabase.save_sensor_data_batch')
+    def save_sensor_data_batch(self, readings):
+        """Save many sensor readings with a single multi-row insert"""
+        if not self.initialized or not SUPABASE_AVAILABLE:
+            return None
+        
+        if self.sensor_buffer is not None:
+            return self._buffer_sensor_rows(readings)
+            
+        try:
+            result = self.client.table('sensor_readings').insert([sensor_row(r) for r in readings]).execute()
+            print(f"✅ {len(readings)} sensor readings saved to Supabase")
+            return result.data if result.data else []
+        except Exception as e:
+            print(f"❌ Failed to save sensor data batch: {e}")
+            record_error('supabase.save_sensor_data_batch')
+            self.add_to_outbox('sensor_readings', readings)
             return None
     
-    def get_latest_sensor_data(self):
-        """Get latest sensor data from Supabase"""
+    def _buffer_sensor_rows(self, rows):
+        """Spool rows for the flusher, or straight to the outbox while it is full"""
+        try:
+            return self.sensor_buffer.put_many(rows)
+        except BufferFull as e:
+            print(f"⚠️  Sensor write-behind full, queueing {len(rows)} readings in the outbox: {e}")
+            record_error('supabase.write_behind')
+            if not self.add_to_outbox('sensor_readings', rows):
+                print(f"❌ Supabase backlog full, {len(rows)} readings are only stored locally")
+            return rows
+    
+    @timed('supabase.get_latest_sensor_data')
+    def get_latest_sensor_data(self, device_id=None):
+        """Get latest sensor data from Supabase (of one device when ``device_id`` is set)"""
         if not self.initialized or not SUPABASE_AVAILABLE:
             return None
             
         try:
-            result = self.client.table('sensor_readings').select('*').order('created_at', desc=True).limit(1).execute()
+            query = self.client.table('sensor_readings').select('*')
+            if device_id:
+                query = query.eq('device_id', device_id)
+            result = query.order('created_at', desc=True).limit(1).execute()
             return result.data[0] if result.data else None
         except Exception as e:
             print(f"❌ Failed to get sensor data: {e}")
+            record_error('supabase.get_latest_sensor_data')
             return None
     
+    @timed('supabase.save_image_metadata')
     def save_image_metadata(self, metadata):
         """Save image metadata to Supabase database"""
         if not self.initialized or not SUPABASE_AVAILABLE:
@@ -152,19 +489,8 @@ class SupabaseStorage:
             return result.data[0] if result.data else None
         except Exception as e:
             print(f"❌ Failed to save image metadata: {e}")
+            record_error('supabase.save_image_metadata')
             return None
-    
-    def get_images(self):
-        """Get all images from Supabase"""
-        if not self.initialized or not SUPABASE_AVAILABLE:
-            return []
-            
-        try:
-            result = self.client.table('plant_images').select('*').order('created_at', desc=True).execute()
-            return result.data if result.data else []
-        except Exception as e:
-            print(f"❌ Failed to get images: {e}")
-            return []
 
 # Global Supabase instance
 supabase_storage = SupabaseStorage()
@@ -11,10 +11,18 @@ CREATE TABLE IF NOT EXISTS sensor_readings (
     ai_reply TEXT,
     status_color VARCHAR(10) CHECK (status_color IN ('green', 'yellow', 'red')),
     source VARCHAR(50) DEFAULT 'raspberry_pi',
+    plant_type VARCHAR(50),
+    device_id VARCHAR(64) NOT NULL DEFAULT 'default',
+    plant_id VARCHAR(64),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Columns added after the first release (existing rows belong to the default device)
+ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS plant_type VARCHAR(50);
+ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS device_id VARCHAR(64) NOT NULL DEFAULT 'default';
+ALTER TABLE sensor_readings ADD COLUMN IF NOT EXISTS plant_id VARCHAR(64);
+
 -- Create plant_images table
 CREATE TABLE IF NOT EXISTS plant_images (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -25,10 +33,15 @@ CREATE TABLE IF NOT EXISTS plant_images (
     file_type VARCHAR(10) NOT NULL,
     image_url TEXT NOT NULL,
     storage_type VARCHAR(20) DEFAULT 'supabase',
+    device_id VARCHAR(64) NOT NULL DEFAULT 'default',
+    plant_id VARCHAR(64),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+ALTER TABLE plant_images ADD COLUMN IF NOT EXISTS device_id VARCHAR(64) NOT NULL DEFAULT 'default';
+ALTER TABLE plant_images ADD COLUMN IF NOT EXISTS plant_id VARCHAR(64);
+
 -- Create metrics table
 CREATE TABLE IF NOT EXISTS plant_metrics (
     id UUID DEFAULT gen_random_uuid() PRIMARY KEY,
@@ -41,7 +54,12 @@ CREATE TABLE IF NOT EXISTS plant_metrics (
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_sensor_readings_created_at ON sensor_readings(created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_sensor_readings_status_color ON sensor_readings(status_color);
+-- Per-device latest/history reads scan only that device's slice
+CREATE INDEX IF NOT EXISTS idx_sensor_readings_device_created_at ON sensor_readings(device_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_sensor_readings_plant_created_at ON sensor_readings(plant_id, created_at DESC);
 CREATE INDEX IF NOT EXISTS idx_plant_images_created_at ON plant_images(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_plant_images_device_created_at_id ON plant_images(device_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_plant_images_plant_id ON plant_images(plant_id);
 CREATE INDEX IF NOT EXISTS idx_plant_metrics_created_at ON plant_metrics(created_at DESC);
 
 -- Enable Row Level Security (RLS)
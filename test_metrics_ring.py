@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Test script for the metrics ring
+Runs against a scratch directory, no server needed (also collected by pytest)
+"""
+
+import os
+import shutil
+import tempfile
+
+from metrics_ring import MetricsRing
+
+
+def test_paging_forward_reports_overrun():
+    """A reader more than ``limit`` behind pages forward and learns what it missed"""
+    print("📜 Testing paging through the metrics ring")
+    print("-" * 30)
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        ring = MetricsRing(os.path.join(base_dir, 'metrics.ring'), capacity=10, slot_size=128)
+        for n in range(1, 9):
+            ring.append({'n': n})
+
+        # Eight entries behind with a page of three: the oldest three first
+        records, next_after, overrun = ring.read_after(0, limit=3)
+        assert [seq for seq, _ in records] == [1, 2, 3], records
+        assert next_after == 3 and not overrun
+        records, next_after, overrun = ring.read_after(next_after, limit=3)
+        assert [seq for seq, _ in records] == [4, 5, 6], records
+        print("✅ Pages continue where the last one ended")
+
+        # Entries 7 and 8 are overwritten before the reader gets to them
+        for n in range(9, 19):
+            ring.append({'n': n})
+        records, next_after, overrun = ring.read_after(next_after, limit=3)
+        assert overrun
+        assert [seq for seq, _ in records] == [9, 10, 11], records
+        assert next_after == 11
+        records, next_after, overrun = ring.read_after(next_after, limit=100)
+        assert [seq for seq, _ in records] == list(range(12, 19)) and not overrun
+        print("✅ Overwritten entries are reported as an overrun")
+
+        assert [seq for seq, _ in ring.read(limit=2)] == [17, 18]
+        print("✅ Without after, the newest entries are returned")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def main():
+    """Run all tests"""
+    print("🌱 PlantAI Metrics Ring Test Suite")
+    print("=" * 50)
+
+    tests = [
+        ("Paging and overrun", test_paging_forward_reports_overrun)
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 Running {test_name}...")
+        try:
+            test_func()
+            passed += 1
+        except AssertionError as e:
+            print(f"❌ {test_name} failed: {e}")
+
+    print(f"\n🎯 Overall: {passed}/{len(tests)} tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,120 @@ def test_sensor_data_api():
         print(f"❌ Error: {e}")
         return False
 
+def test_sensor_batch_api():
+    """Test the batch sensor data API endpoint"""
+    print("\n📦 Testing Sensor Batch API")
+    print("-" * 30)
+    
+    # Simulate readings buffered on the Pi while offline
+    readings = []
+    for minute in range(10):
+        readings.append({
+            "temperature": round(random.uniform(15, 30), 2),
+            "pressure": round(random.uniform(950, 1050), 2),
+            "humidity": round(random.uniform(20, 80), 2),
+            "soil_moisture": round(random.uniform(10, 90), 2),
+            "timestamp": f"2025-01-01T12:{minute:02d}:00"
+        })
+    
+    print(f"📊 Sending {len(readings)} buffered readings")
+    
+    try:
+        response = requests.post(
+            f"{BASE_URL}/sensor-data/batch",
+            json={"readings": readings},
+            headers={'Content-Type': 'application/json'}
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            print("✅ Sensor batch sent successfully!")
+            print(f"   Accepted: {data['accepted']}, Rejected: {data['rejected']}")
+            print(f"   Latest Status Color: {data['status_color']}")
+            print(f"   Latest Message: {data['message']}")
+            return True
+        else:
+            print(f"❌ Sensor batch failed: {response.status_code}")
+            print(f"   Error: {response.json()}")
+            return False
+            
+    except requests.exceptions.ConnectionError:
+        print("❌ Cannot connect to server. Make sure the backend is running on port 5001")
+        return False
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_sensor_batch_malformed_columns():
+    """Columnar batches with a scalar or short column are rejected with 400"""
+    print("\n🧱 Testing Sensor Batch API with malformed columns")
+    print("-" * 30)
+    
+    payloads = [
+        # A required column sent as a single value
+        {"columns": {"temperature": [21.5, 22.0], "pressure": [1013, 1012],
+                     "humidity": [55, 56], "soil_moisture": 40}},
+        # A required column missing (unknown columns are ignored)
+        {"columns": {"temperature": [21.5, 22.0], "humidity": [55, 56],
+                     "light": [300, 310], "soil_moisture": [40, 41]}},
+        # Columns of different lengths
+        {"columns": {"temperature": [21.5, 22.0], "pressure": [1013],
+                     "humidity": [55, 56], "soil_moisture": [40, 41]}}
+    ]
+    
+    try:
+        for payload in payloads:
+            response = requests.post(
+                f"{BASE_URL}/sensor-data/batch",
+                json=payload,
+                headers={'Content-Type': 'application/json'}
+            )
+            if response.status_code != 400:
+                print(f"❌ Expected 400, got {response.status_code} for {json.dumps(payload)}")
+                return False
+            print(f"✅ Rejected: {response.json()['error']}")
+        return True
+            
+    except requests.exceptions.ConnectionError:
+        print("❌ Cannot connect to server. Make sure the backend is running on port 5001")
+        return False
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
+def test_sensor_history_api():
+    """Test the sensor history API endpoint"""
+    print("\n📉 Testing Sensor History API")
+    print("-" * 30)
+    
+    try:
+        # Covers the readings sent by the batch test
+        response = requests.get(
+            f"{BASE_URL}/sensor-data/history",
+            params={"start": "2025-01-01T12:00:00", "end": "2025-01-01T13:00:00", "bucket": "5m"}
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            print("✅ Sensor history retrieved successfully!")
+            print(f"   Readings: {data['readings']} in {len(data['buckets'])} buckets of {data['bucket_seconds']}s")
+            for bucket in data['buckets']:
+                temperature = bucket['temperature']
+                print(f"     • {bucket['start']}: {bucket['count']} readings, "
+                      f"temperature {temperature['min']}-{temperature['max']}°C (mean {temperature['mean']})")
+            return True
+        else:
+            print(f"❌ Sensor history failed: {response.status_code}")
+            print(f"   Error: {response.json()}")
+            return False
+            
+    except requests.exceptions.ConnectionError:
+        print("❌ Cannot connect to server. Make sure the backend is running on port 5001")
+        return False
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return False
+
 def test_response_body_api():
     """Test the response body API endpoint"""
     print("\n🤖 Testing Response Body API")
@@ -160,6 +274,9 @@ def main():
     tests = [
         ("Home Endpoint", test_home_endpoint),
         ("Sensor Data API", test_sensor_data_api),
+        ("Sensor Batch API", test_sensor_batch_api),
+        ("Sensor Batch Malformed Columns", test_sensor_batch_malformed_columns),
+        ("Sensor History API", test_sensor_history_api),
         ("Response Body API", test_response_body_api),
         ("Metrics API", test_metrics_api)
     ]
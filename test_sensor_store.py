@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Test script for the segmented sensor log
+Runs against a scratch directory, no server needed (also collected by pytest)
+"""
+
+import os
+import json
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from sensor_store import SensorLogStore
+
+START = datetime(2024, 12, 1, 12, 0, 0)
+
+
+def make_readings(first, n):
+    """``n`` readings one minute apart, numbered from ``first``"""
+    return [{
+        'id': f'r{first + i}',
+        'timestamp': (START + timedelta(minutes=first + i)).isoformat(timespec='milliseconds'),
+        'temperature': 22.0,
+        'pressure': 1013.0,
+        'humidity': 60.0,
+        'soil_moisture': 50.0
+    } for i in range(n)]
+
+
+def test_shared_log_follows_rotations():
+    """A store keeps working after another store on the same log rotated past it"""
+    print("🔄 Testing two stores sharing one sensor log")
+    print("-" * 30)
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        a = SensorLogStore(base_dir, segment_max_readings=3, retention_days=0)
+        b = SensorLogStore(base_dir, segment_max_readings=3, retention_days=0)
+
+        a.append(make_readings(0, 1)[0])
+        b.append_many(make_readings(1, 7))  # Seals two segments under A
+
+        assert a.count() == 8, a.count()
+        assert a.latest()['id'] == 'r7', a.latest()
+
+        a.append(make_readings(8, 1)[0])
+        assert b.count() == 9, b.count()
+        assert b.latest()['id'] == 'r8', b.latest()
+        assert list(a.iter_readings()) == make_readings(0, 9)
+        print("✅ Both stores see every reading after the rotations")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def test_sealed_readings_keep_their_fields():
+    """A reading has the same fields once its segment is sealed"""
+    print("🧊 Testing fields of readings in sealed segments")
+    print("-" * 30)
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        store = SensorLogStore(base_dir, segment_max_readings=3, retention_days=0)
+        readings = make_readings(0, 4)
+        readings[0]['timestamp'] = (START + timedelta(microseconds=123456)).isoformat()
+        readings[1].update(device_id='pi-kitchen', plant_type='basil')
+        readings[2]['plant_id'] = None
+        store.append_many(readings)  # Seals the first three
+
+        assert store.segments()[0]['count'] == 3
+        assert list(store.iter_readings()) == readings
+        reopened = SensorLogStore(base_dir, segment_max_readings=3, retention_days=0)
+        assert list(reopened.iter_readings()) == readings
+        print("✅ Ids, exact timestamps and text fields survive sealing")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def test_legacy_import_skipped_when_log_has_readings():
+    """The legacy file is only imported into an empty log"""
+    print("📦 Testing the legacy sensor_data.json import")
+    print("-" * 30)
+
+    base_dir = tempfile.mkdtemp()
+    try:
+        store = SensorLogStore(base_dir, retention_days=0)
+        store.append(make_readings(0, 1)[0])
+
+        legacy_path = os.path.join(base_dir, 'sensor_data.json')
+        with open(legacy_path, 'w') as f:
+            json.dump(make_readings(1, 3), f)
+
+        assert store.migrate_legacy_file(legacy_path) == 0
+        assert store.count() == 1, store.count()
+        assert os.path.exists(legacy_path + '.migrated')
+        print("✅ Non-empty log left as is, legacy file set aside")
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def main():
+    """Run all tests"""
+    print("🌱 PlantAI Sensor Log Test Suite")
+    print("=" * 50)
+
+    tests = [
+        ("Shared log rotations", test_shared_log_follows_rotations),
+        ("Sealed reading fields", test_sealed_readings_keep_their_fields),
+        ("Legacy import", test_legacy_import_skipped_when_log_has_readings)
+    ]
+
+    passed = 0
+    for test_name, test_func in tests:
+        print(f"\n🧪 Running {test_name}...")
+        try:
+            test_func()
+            passed += 1
+        except AssertionError as e:
+            print(f"❌ {test_name} failed: {e}")
+
+    print(f"\n🎯 Overall: {passed}/{len(tests)} tests passed")
+
+
+if __name__ == "__main__":
+    main()
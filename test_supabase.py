@@ -134,7 +134,8 @@ def test_get_images():
         if response.status_code == 200:
             data = response.json()
             print("✅ Images list retrieved successfully!")
-            print(f"   Total Images: {data['count']}")
+            print(f"   Images on first page: {data['count']}")
+            print(f"   More pages: {'yes' if data['next_cursor'] else 'no'}")
             print(f"   Supabase Enabled: {data['firebase_enabled']}")
             
             if data['images']:
@@ -0,0 +1,263 @@
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import threading
+import subprocess
+from concurrent.futures import Future
+
+from file_lock import FileLock, atomic_write_json
+
+THUMBNAIL_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+    'webp': ('WEBP', 'webp', 'image/webp')
+}
+
+
+def render_thumbnail(source_path, dest_path, width, fmt, quality):
+    """Resize ``source_path`` to ``width`` pixels wide and write it to ``dest_path``
+
+    Runs in a worker process. Never upscales; keeps the aspect ratio.
+    """
+    from PIL import Image
+
+    pil_format = THUMBNAIL_FORMATS[fmt][0]
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"  # Unique per renderer process
+    with Image.open(source_path) as image:
+        image.draft('RGB', (width, width * 4))  # Cheap JPEG downscale on decode
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(tmp_path, pil_format, quality=quality, optimize=True)
+    os.replace(tmp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def worker_main():
+    """Entry point of a render worker process (one JSON job per stdin line)"""
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            reply = {'size': render_thumbnail(
+                job['source_path'], job['dest_path'], job['width'], job['fmt'], job['quality']
+            )}
+        except Exception as e:
+            reply = {'error': f'{type(e).__name__}: {e}'}
+        try:
+            sys.stdout.write(json.dumps(reply) + '\n')
+            sys.stdout.flush()
+        except BrokenPipeError:
+            # The server went away; nothing left to report to
+            return
+
+
+class ThumbnailCache:
+    """Size-capped on-disk LRU cache of resized image variants.
+
+    Variants are named after a hash of the source identity and the render
+    parameters, so the file name doubles as a strong ETag. Renders run in
+    long-lived worker processes and identical concurrent requests share one
+    render.
+
+    The cache directory is shared by every server process, so its size is
+    accounted on disk too: ``usage.json`` holds the total bytes, updated
+    under a lock file after each render. Once the total exceeds
+    ``max_bytes``, the directory is rescanned and the least recently read
+    variants (by access time, which ``lookup`` bumps) are removed until it
+    is back under ``EVICT_TO`` of the budget.
+    """
+
+    USAGE_FILE = 'usage.json'
+    LOCK_FILE = '.lock'
+    EVICT_TO = 0.9  # Fraction of max_bytes left after an eviction pass
+
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, workers=2):
+        """Account for the variants already in ``cache_dir``"""
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        self._pending = {}  # filename -> Future
+        self._jobs = None  # (request, Future) queue of this process's workers
+        self._workers_pid = None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(self.cache_dir, self.LOCK_FILE))
+        with self._file_lock:
+            total = self._scan_total()
+            self._write_usage(self._evict() if total > self.max_bytes else total)
+
+    def _variants(self):
+        """``(atime, filename, size)`` of every cached variant on disk"""
+        variants = []
+        for entry in os.scandir(self.cache_dir):
+            name = entry.name
+            if name.startswith('.') or name.endswith('.tmp') or name == self.USAGE_FILE:
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # Evicted by another process meanwhile
+            variants.append((stat.st_atime, name, stat.st_size))
+        return variants
+
+    def _scan_total(self):
+        return sum(size for _, _, size in self._variants())
+
+    def _read_usage(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.USAGE_FILE), 'r') as f:
+                return json.load(f)['total_bytes']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_usage(self, total_bytes):
+        atomic_write_json(os.path.join(self.cache_dir, self.USAGE_FILE), {'total_bytes': total_bytes})
+
+    def _render(self, source_path, dest_path, width, fmt, quality):
+        """Queue a render for the worker processes; returns a Future of the file size"""
+        with self._lock:
+            # Feeder threads do not survive fork, so each server process
+            # starts its own workers on first use
+            if self._workers_pid != os.getpid():
+                self._jobs = queue.Queue()
+                for index in range(self.workers):
+                    threading.Thread(target=self._feed, args=(self._jobs,),
+                                     name=f"thumbnail-worker-{index}", daemon=True).start()
+                self._workers_pid = os.getpid()
+        future = Future()
+        self._jobs.put(({
+            'source_path': os.path.abspath(source_path),
+            'dest_path': os.path.abspath(dest_path),
+            'width': width,
+            'fmt': fmt,
+            'quality': quality
+        }, future))
+        return future
+
+    def _spawn(self):
+        # A fresh interpreter that imports only this module: nothing forked
+        # from the threaded server, and the app's __main__ is never re-run
+        return subprocess.Popen(
+            [sys.executable, '-c', 'import thumbnails; thumbnails.worker_main()'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            bufsize=1
+        )
+
+    def _feed(self, jobs):
+        """Hand queued renders to one worker process, restarting it if it dies"""
+        process = self._spawn()
+        while True:
+            request, future = jobs.get()
+            try:
+                process.stdin.write(json.dumps(request) + '\n')
+                process.stdin.flush()
+                line = process.stdout.readline()
+                if not line:
+                    raise RuntimeError('Thumbnail worker exited')
+                reply = json.loads(line)
+            except (OSError, ValueError, RuntimeError) as e:
+                reply = {'error': str(e)}
+                process.kill()
+                process = self._spawn()
+            if 'error' in reply:
+                future.set_exception(RuntimeError(f"Thumbnail render failed: {reply['error']}"))
+            else:
+                future.set_result(reply['size'])
+
+    def variant_name(self, source_id, width, fmt, quality):
+        """Deterministic file name for one rendering of one source"""
+        key = hashlib.sha256(f"{source_id}\x00w={width}\x00f={fmt}\x00q={quality}".encode('utf-8')).hexdigest()
+        return f"{key[:40]}.{THUMBNAIL_FORMATS[fmt][1]}"
+
+    def path(self, filename):
+        return os.path.join(self.cache_dir, filename)
+
+    def lookup(self, filename):
+        """Return the cached variant path and mark it recently used, or None"""
+        path = self.path(filename)
+        try:
+            # Bump only the access time; mtime stays the Last-Modified value
+            os.utime(path, (time.time(), os.stat(path).st_mtime))
+        except OSError:
+            return None
+        return path
+
+    def get_or_render(self, source_id, fetch_source, width, fmt='jpeg', quality=80, timeout=30):
+        """Return the path of the requested variant, rendering it on a miss
+
+        ``fetch_source`` is called only on a miss and must return
+        ``(local_path, cleanup)``; ``cleanup`` (or None) runs after rendering.
+        """
+        filename = self.variant_name(source_id, width, fmt, quality)
+        path = self.lookup(filename)
+        if path:
+            return path
+
+        with self._lock:
+            future = self._pending.get(filename)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._pending[filename] = future
+
+        if not owner:
+            # Someone else is already rendering this variant
+            return future.result(timeout=timeout)
+
+        try:
+            source_path, cleanup = fetch_source()
+            try:
+                size = self._render(source_path, self.path(filename), width, fmt, quality).result(timeout=timeout)
+            finally:
+                if cleanup:
+                    cleanup()
+
+            self._account(size)
+            future.set_result(self.path(filename))
+            return self.path(filename)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+    def _account(self, size):
+        """Add a new variant to the shared total, evicting once over budget"""
+        with self._file_lock:
+            total = self._read_usage()
+            total = self._scan_total() if total is None else total + size
+            if total > self.max_bytes:
+                total = self._evict()
+            self._write_usage(total)
+
+    def _evict(self):
+        """Drop least recently read variants until under ``EVICT_TO`` of ``max_bytes``
+
+        Rescans the directory (caller holds the file lock), which also
+        corrects the total for variants two processes rendered at once or
+        that were removed by hand. Returns the new total.
+        """
+        variants = sorted(self._variants())
+        total = sum(size for _, _, size in variants)
+        target = self.max_bytes * self.EVICT_TO
+        for _, filename, size in variants[:-1]:  # Never the newest
+            if total <= target:
+                break
+            try:
+                os.remove(self.path(filename))
+            except OSError:
+                pass
+            total -= size
+        return total
+
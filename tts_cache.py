@@ -0,0 +1,102 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class TTSAudioCache:
+    """Content-addressed cache of synthesized TTS audio files.
+
+    Files are named after a SHA-256 of the message text and the voice
+    settings, so the same message always maps to the same file and a cache
+    hit needs no TTS work at all. Total size is bounded; the least recently
+    used files are evicted first. Synthesis itself happens in
+    ``tts_worker.TTSWorkerPool``, which registers finished files via ``store``.
+    """
+
+    FILE_PREFIX = 'tts_'
+
+    def __init__(self, audio_dir, rate=150, volume=0.9, max_bytes=64 * 1024 * 1024):
+        """Index existing cached files in ``audio_dir``"""
+        self.audio_dir = audio_dir
+        self.rate = rate
+        self.volume = volume
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (filename, size), LRU order
+        self._total_bytes = 0
+
+        os.makedirs(self.audio_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Seed the LRU index from files already on disk, oldest access first"""
+        cached = []
+        for name in os.listdir(self.audio_dir):
+            if not name.startswith(self.FILE_PREFIX) or name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.audio_dir, name)
+            stat = os.stat(path)
+            key = name[len(self.FILE_PREFIX):].rsplit('.', 1)[0]
+            cached.append((stat.st_mtime, key, name, stat.st_size))
+        for _, key, name, size in sorted(cached):
+            self._entries[key] = (name, size)
+            self._total_bytes += size
+
+    def cache_key(self, message):
+        """Hash of the message text plus the voice settings"""
+        payload = f"{message}\x00rate={self.rate}\x00volume={self.volume}"
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def url(self, filename):
+        """Public URL of a cached audio file"""
+        return f"/audio/{filename}"
+
+    def lookup(self, message):
+        """Return the audio URL for ``message`` if cached, else None"""
+        key = self.cache_key(message)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            # Another server process may have synthesized it
+            for extension in ('wav', 'txt'):
+                filename = f"{self.FILE_PREFIX}{key}.{extension}"
+                if os.path.exists(os.path.join(self.audio_dir, filename)):
+                    self.store(key, filename)
+                    return self.url(filename)
+            return None
+        # Touch the file so the LRU order survives a restart
+        try:
+            os.utime(os.path.join(self.audio_dir, entry[0]))
+        except OSError:
+            with self._lock:
+                self._forget(key)
+            return None
+        return self.url(entry[0])
+
+    def store(self, key, filename):
+        """Register a finished audio file and evict down to the size budget"""
+        size = os.path.getsize(os.path.join(self.audio_dir, filename))
+        with self._lock:
+            self._forget(key)
+            self._entries[key] = (filename, size)
+            self._total_bytes += size
+            self._evict()
+
+    def _forget(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self._total_bytes -= entry[1]
+
+    def _evict(self):
+        """Drop least recently used files until under ``max_bytes``"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            key, (filename, size) = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(os.path.join(self.audio_dir, filename))
+            except OSError:
+                pass
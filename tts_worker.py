@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+import subprocess
+from collections import OrderedDict
+from datetime import datetime
+
+from file_lock import atomic_write_json
+from instrumentation import registry, record_error
+
+
+def synthesize(engine, message, audio_dir, key, rate, volume):
+    """Render ``message`` into the cache directory and return the filename
+
+    Runs inside a worker process. ``engine`` is the worker's long-lived
+    pyttsx3 engine, or None when pyttsx3 is not available.
+    """
+    if engine is None:
+        # Fallback: cache a simple text file if pyttsx3 is not available
+        filename = f"tts_{key}.txt"
+        with open(os.path.join(audio_dir, filename), 'w') as f:
+            f.write(message)
+        return filename
+
+    filename = f"tts_{key}.wav"
+    audio_path = os.path.join(audio_dir, filename)
+    tmp_path = f"{audio_path}.{os.getpid()}.tmp"  # Server processes may render the same message
+
+    # Configure TTS settings
+    engine.setProperty('rate', rate)  # Speed of speech
+    engine.setProperty('volume', volume)  # Volume level
+
+    # Generate audio file, then publish it atomically
+    engine.save_to_file(message, tmp_path)
+    engine.runAndWait()
+    os.replace(tmp_path, audio_path)
+    return filename
+
+
+def worker_main():
+    """Entry point of a TTS worker process (one JSON job per stdin line)"""
+    # Keep a private channel for replies; anything the TTS driver prints
+    # goes to stderr instead of corrupting the protocol.
+    replies = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    engine = None
+    init_error = None
+    try:
+        import pyttsx3
+        engine = pyttsx3.init()
+    except ImportError:
+        pass
+    except Exception as e:
+        init_error = f"TTS engine unavailable: {e}"
+
+    for line in sys.stdin:
+        job = json.loads(line)
+        reply = {'job_id': job['job_id']}
+        if init_error:
+            reply['error'] = init_error
+        else:
+            try:
+                reply['filename'] = synthesize(
+                    engine, job['message'], job['audio_dir'], job['key'], job['rate'], job['volume']
+                )
+            except Exception as e:
+                reply['error'] = str(e)
+        try:
+            replies.write(json.dumps(reply) + '\n')
+            replies.flush()
+        except BrokenPipeError:
+            # The server went away; nothing left to report to
+            return
+
+
+class TTSWorkerPool:
+    """Long-lived TTS worker processes fed from a bounded job queue.
+
+    Each worker process keeps its own pyttsx3 engine for its whole life, so
+    requests never pay engine start-up or synthesis time. Submitting a
+    message that is already queued or running returns the existing job.
+
+    With ``jobs_dir`` set, job status is also written there, so any server
+    process can answer for a job another one queued.
+    """
+
+    MAX_FINISHED_JOBS = 1000
+
+    def __init__(self, cache, workers=2, max_queue=64, jobs_dir=None):
+        """Create a pool that stores finished audio in ``cache``"""
+        self.cache = cache
+        self.workers = workers
+        self.max_queue = max_queue
+        self.jobs_dir = jobs_dir
+        if jobs_dir:
+            os.makedirs(jobs_dir, exist_ok=True)
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()  # job_id -> job
+        self._inflight = {}  # cache key -> job
+        self._threads = []
+        self.started = False
+
+    def start(self):
+        """Spawn the worker processes and their feeder threads"""
+        if self.started:
+            return
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._feed, name=f"tts-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.started = True
+        print(f"🔊 TTS worker pool started with {self.workers} processes")
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [sys.executable, '-c', 'import tts_worker; tts_worker.worker_main()'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            bufsize=1
+        )
+
+    def _feed(self):
+        """Hand queued jobs to one worker process, restarting it if it dies"""
+        process = self._spawn()
+        while True:
+            job = self._queue.get()
+            job['status'] = 'running'
+            request = {
+                'job_id': job['job_id'],
+                'message': job['message'],
+                'key': job['key'],
+                'audio_dir': os.path.abspath(self.cache.audio_dir),
+                'rate': self.cache.rate,
+                'volume': self.cache.volume
+            }
+            started = time.perf_counter()
+            try:
+                process.stdin.write(json.dumps(request) + '\n')
+                process.stdin.flush()
+                line = process.stdout.readline()
+                if not line:
+                    raise RuntimeError('TTS worker exited')
+                reply = json.loads(line)
+            except (OSError, ValueError, RuntimeError) as e:
+                reply = {'error': str(e)}
+                process.kill()
+                process = self._spawn()
+            registry.observe('plantai_stage_seconds', time.perf_counter() - started, {'stage': 'tts_synthesis'})
+            self._finish(job, reply.get('filename'), reply.get('error'))
+
+    def _finish(self, job, filename, error):
+        if filename:
+            try:
+                self.cache.store(job['key'], filename)
+            except OSError as e:
+                filename, error = None, str(e)
+        if filename:
+            job['audio_file'] = self.cache.url(filename)
+            job['status'] = 'done'
+        else:
+            print(f"Error generating audio file: {error}")
+            record_error('tts_synthesis')
+            job['error'] = error
+            job['status'] = 'failed'
+        job['finished_at'] = datetime.now().isoformat()
+        self._persist(job)
+        with self._lock:
+            self._inflight.pop(job['key'], None)
+        job['event'].set()
+
+    def _job_path(self, job_id):
+        # Job ids are uuid4 hex; anything else never names a file
+        if not self.jobs_dir or len(job_id) != 32 or any(c not in '0123456789abcdef' for c in job_id):
+            return None
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _persist(self, job):
+        path = self._job_path(job['job_id'])
+        if path:
+            try:
+                atomic_write_json(path, self.describe(job))
+            except OSError as e:
+                print(f"⚠️  Could not record TTS job {job['job_id']}: {e}")
+
+    def _read_persisted(self, job_id):
+        path = self._job_path(job_id)
+        if not path:
+            return None
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remember(self, job):
+        """Track a job, forgetting the oldest finished ones beyond the cap"""
+        self._jobs[job['job_id']] = job
+        while len(self._jobs) > self.MAX_FINISHED_JOBS:
+            oldest_id, oldest = next(iter(self._jobs.items()))
+            if not oldest['event'].is_set():
+                break
+            del self._jobs[oldest_id]
+            path = self._job_path(oldest_id)
+            if path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def submit(self, message):
+        """Return a job for ``message``: cached, coalesced, newly queued or rejected"""
+        url = self.cache.lookup(message)
+        if url:
+            return {'job_id': None, 'status': 'done', 'audio_file': url}
+
+        key = self.cache.cache_key(message)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is None:
+                job = {
+                    'job_id': uuid.uuid4().hex,
+                    'key': key,
+                    'message': message,
+                    'status': 'queued',
+                    'audio_file': None,
+                    'error': None,
+                    'submitted_at': datetime.now().isoformat(),
+                    'finished_at': None,
+                    'event': threading.Event()
+                }
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    return {'job_id': None, 'status': 'rejected', 'audio_file': None}
+                self._inflight[key] = job
+                self._remember(job)
+                self._persist(job)
+        return self.describe(job)
+
+    def queue_depth(self):
+        """Jobs waiting for a worker process"""
+        return self._queue.qsize()
+
+    def describe(self, job):
+        """Public view of a job"""
+        return {
+            'job_id': job['job_id'],
+            'status': job['status'],
+            'audio_file': job['audio_file'],
+            'error': job['error'],
+            'submitted_at': job['submitted_at'],
+            'finished_at': job['finished_at']
+        }
+
+    def get_job(self, job_id, wait=0):
+        """Look up a job, optionally blocking up to ``wait`` seconds for it to finish"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            return self._get_persisted_job(job_id, wait)
+        if wait > 0:
+            job['event'].wait(wait)
+        return self.describe(job)
+
+    def _get_persisted_job(self, job_id, wait):
+        """Status of a job queued by another server process, polled from disk"""
+        deadline = time.monotonic() + wait
+        while True:
+            job = self._read_persisted(job_id)
+            if job is None or job['status'] not in ('queued', 'running') or time.monotonic() >= deadline:
+                return job
+            time.sleep(0.1)
+
+    def warm(self, messages):
+        """Queue synthesis for every message not yet in the cache"""
+        return [self.submit(message) for message in messages]
@@ -0,0 +1,90 @@
+import os
+import hashlib
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+UPLOAD_CHUNK_SIZE = 64 * 1024  # 64KB
+
+
+class HashingUploadFile:
+    """On-disk destination for one uploaded file part.
+
+    The multipart parser writes the part into this object chunk by chunk.
+    Each write updates a SHA-256 digest and the running size, and the size
+    limit is enforced as soon as it is crossed, so an upload never has to be
+    held in memory or re-read to be measured or checksummed.
+    """
+
+    def __init__(self, directory, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._sha256 = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(dir=directory, prefix='.incoming_', delete=False)
+        self.path = self._file.name
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise RequestEntityTooLarge()
+        self._sha256.update(data)
+        return self._file.write(data)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/etc. go to the underlying temp file
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def hexdigest(self):
+        """SHA-256 of everything written so far"""
+        return self._sha256.hexdigest()
+
+    def iter_chunks(self, chunk_size=UPLOAD_CHUNK_SIZE):
+        """Yield the stored upload back in fixed-size chunks"""
+        self._file.flush()
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def publish(self, dest_path):
+        """Move the upload to its final local path (a rename, not a copy)"""
+        self._file.close()
+        os.replace(self.path, dest_path)
+        self.path = None
+
+    def discard(self):
+        """Remove the temp file unless it was published"""
+        self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+class StreamingUploadRequest(Request):
+    """Request class that streams file parts to hashed temp files on disk
+
+    Set ``upload_dir`` and ``max_file_size`` on the subclass (or the class)
+    before installing it as ``app.request_class``.
+    """
+
+    upload_dir = tempfile.gettempdir()
+    max_file_size = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = HashingUploadFile(self.upload_dir, self.max_file_size)
+        self.__dict__.setdefault('_streamed_uploads', []).append(upload)
+        return upload
+
+    def cleanup_uploads(self):
+        """Delete temp files of uploads that were not published"""
+        for upload in self.__dict__.pop('_streamed_uploads', []):
+            try:
+                upload.discard()
+            except OSError:
+                pass
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+
+
+class BufferFull(Exception):
+    """Raised when the write-behind buffer stays full past the put timeout"""
+
+
+class WriteBehindBuffer:
+    """Bounded, spool-backed buffer that flushes rows in bulk from a thread.
+
+    Every row is appended to ``pending.jsonl`` before ``put`` returns, so a
+    crash never loses an accepted row; on restart the rows after the last
+    committed offset are replayed. A background flusher hands rows to
+    ``flush_fn`` in batches of up to ``flush_size`` once that many are waiting
+    or the oldest has waited ``max_delay`` seconds. ``flush_fn`` must raise on
+    failure; the batch is then retried with exponential backoff. Since a
+    batch can be sent again after a crash or a timeout, ``flush_fn`` should
+    be idempotent.
+
+    With ``max_attempts`` set, a batch that failed that many times in a row
+    is passed to ``on_give_up(batch, error)``; if that returns True the batch
+    is dropped from the buffer, so one bad batch cannot hold up the rest.
+    """
+
+    SPOOL_FILE = 'pending.jsonl'
+    OFFSET_FILE = 'pending.offset'
+    COMPACT_AFTER = 10000  # Committed spool lines before the spool is rewritten
+
+    def __init__(self, flush_fn, spool_dir, max_items=10000, flush_size=500,
+                 max_delay=2.0, put_timeout=5.0, fsync=False, name='write-behind',
+                 max_attempts=None, on_give_up=None):
+        """Create the buffer and replay anything left in the spool"""
+        self.flush_fn = flush_fn
+        self.spool_dir = spool_dir
+        self.max_items = max_items
+        self.flush_size = flush_size
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.fsync = fsync
+        self.name = name
+        self.max_attempts = max_attempts
+        self.on_give_up = on_give_up
+
+        self._cond = threading.Condition()
+        self._items = deque()  # (enqueued_at, row)
+        self._committed = 0  # spool lines already flushed
+        self._thread = None
+        self._stopping = False
+        self.flushed_total = 0
+        self.failed_flushes = 0
+        self.given_up_total = 0
+        self.last_error = None
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._replay_spool()
+        self._spool = open(self._spool_path(), 'a')
+
+    def _spool_path(self):
+        return os.path.join(self.spool_dir, self.SPOOL_FILE)
+
+    def _offset_path(self):
+        return os.path.join(self.spool_dir, self.OFFSET_FILE)
+
+    def _replay_spool(self):
+        """Load rows that were accepted but never flushed before a restart"""
+        if os.path.exists(self._offset_path()):
+            try:
+                with open(self._offset_path(), 'r') as f:
+                    self._committed = int(f.read().strip() or 0)
+            except (ValueError, OSError):
+                self._committed = 0
+
+        rows = []
+        if os.path.exists(self._spool_path()):
+            with open(self._spool_path(), 'r') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-write; skip it
+                        continue
+
+        pending = rows[self._committed:]
+        now = time.monotonic()
+        self._items.extend((now, row) for row in pending)
+        self._committed = 0
+        self._rewrite_spool([row for _, row in self._items])
+        if pending:
+            print(f"♻️  Replaying {len(pending)} spooled rows from {self.spool_dir}")
+
+    def _rewrite_spool(self, rows):
+        """Atomically replace the spool with just ``rows`` and reset the offset"""
+        tmp_path = self._spool_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for row in rows:
+                f.write(json.dumps(row, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self._spool_path())
+        self._write_offset(0)
+
+    def _write_offset(self, offset):
+        tmp_path = self._offset_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self._offset_path())
+
+    def start(self):
+        """Start the background flusher"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, row):
+        """Accept one row; blocks up to ``put_timeout`` while the buffer is full"""
+        self.put_many([row])
+        return row
+
+    def put_many(self, rows):
+        """Accept several rows at once (all or nothing)"""
+        rows = list(rows)
+        if len(rows) > self.max_items:
+            raise BufferFull(f'{len(rows)} rows exceed the buffer capacity of {self.max_items}')
+        deadline = time.monotonic() + self.put_timeout
+        with self._cond:
+            while len(self._items) + len(rows) > self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BufferFull(f'{self.name} buffer is full ({len(self._items)} rows pending)')
+                self._cond.wait(remaining)
+
+            self._spool.write(''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows))
+            self._spool.flush()
+            if self.fsync:
+                os.fsync(self._spool.fileno())
+
+            now = time.monotonic()
+            self._items.extend((now, row) for row in rows)
+            self._cond.notify_all()
+        return rows
+
+    def depth(self):
+        """Rows accepted but not yet flushed"""
+        with self._cond:
+            return len(self._items)
+
+    def _ready(self):
+        if not self._items:
+            return False
+        if len(self._items) >= self.flush_size or self._stopping:
+            return True
+        return time.monotonic() - self._items[0][0] >= self.max_delay
+
+    def _run(self):
+        backoff = 0
+        attempts = 0
+        while True:
+            with self._cond:
+                while not self._ready():
+                    if self._stopping:
+                        return
+                    if self._items:
+                        self._cond.wait(max(0.0, self.max_delay - (time.monotonic() - self._items[0][0])))
+                    else:
+                        self._cond.wait()
+                batch = [row for _, row in list(self._items)[:self.flush_size]]
+
+            error = self._flush(batch)
+            if error is not None:
+                attempts += 1
+                if self.max_attempts and attempts >= self.max_attempts and self._give_up(batch, error):
+                    attempts = backoff = 0
+                    continue
+                if self._stopping:
+                    return
+                backoff = min(max(backoff * 2, 0.5), 60)
+                time.sleep(backoff)
+                continue
+            attempts = backoff = 0
+
+    def _flush(self, batch):
+        """Send one batch; on success drop it from the buffer and spool
+
+        Returns None on success, else the exception ``flush_fn`` raised.
+        """
+        try:
+            self.flush_fn(batch)
+        except Exception as e:
+            self.failed_flushes += 1
+            self.last_error = str(e)
+            print(f"❌ {self.name} flush of {len(batch)} rows failed: {e}")
+            return e
+
+        self._commit(len(batch))
+        self.flushed_total += len(batch)
+        return None
+
+    def _give_up(self, batch, error):
+        """Hand a batch that keeps failing to ``on_give_up``; True if it was dropped"""
+        try:
+            dropped = self.on_give_up(batch, error) if self.on_give_up else False
+        except Exception as e:
+            print(f"❌ {self.name} could not set aside {len(batch)} failing rows: {e}")
+            return False
+        if dropped:
+            self._commit(len(batch))
+            self.given_up_total += len(batch)
+        return dropped
+
+    def _commit(self, count):
+        """Drop the oldest ``count`` rows from the buffer and the spool"""
+        with self._cond:
+            for _ in range(count):
+                self._items.popleft()
+            self._committed += count
+            if not self._items or self._committed >= self.COMPACT_AFTER:
+                # Keep the spool bounded by the rows still pending
+                self._spool.close()
+                self._rewrite_spool([row for _, row in self._items])
+                self._spool = open(self._spool_path(), 'a')
+                self._committed = 0
+            else:
+                self._write_offset(self._committed)
+            self._cond.notify_all()
+
+    def stop(self, timeout=5.0):
+        """Try to flush what is pending, then stop the flusher"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)